@@ -0,0 +1,79 @@
+"""
+Benchmark of the ohlcv cleaning engines (clean_ohlcv_dataframe, engine='pandas' / 'numpy').
+
+Run from download_data_scripts:
+    python benchmarks/benchmark_ohlcv_engines.py [--years 5] [--timeframe 1m] [--repeat 5]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from constants import AVAILABLE_OHLCV_ENGINES, DEFAULT_DATAFRAME_COLUMNS  # noqa: E402
+from data.converter import clean_ohlcv_dataframe  # noqa: E402
+from exchange import timeframe_to_minutes  # noqa: E402
+
+
+def make_ohlcv(rows: int, timeframe: str, gaps: float, duplicates: float) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'date': pd.date_range('2017-01-01', periods=rows,
+                              freq=f'{timeframe_to_minutes(timeframe)}min', tz='UTC'),
+        'open': rng.random(rows),
+        'high': rng.random(rows) + 1,
+        'low': rng.random(rows) - 1,
+        'close': rng.random(rows),
+        'volume': rng.random(rows) * 100,
+    }, columns=DEFAULT_DATAFRAME_COLUMNS)
+    if gaps:
+        df = df.loc[rng.random(rows) >= gaps]
+    if duplicates:
+        df = pd.concat([df, df.sample(frac=duplicates, random_state=0)])
+        df = df.sort_values('date', kind='stable')
+    return df.reset_index(drop=True)
+
+
+def bench(df: pd.DataFrame, timeframe: str, engine: str, repeat: int) -> float:
+    """
+    Best time (ms) of repeat runs
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        clean_ohlcv_dataframe(data, timeframe, 'BENCH/USDT', fill_missing=True,
+                              drop_incomplete=False, engine=engine)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--years', type=float, default=5)
+    parser.add_argument('--timeframe', default='1m')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rows = int(args.years * 365 * 24 * 60 / timeframe_to_minutes(args.timeframe))
+    cases = {
+        'no gaps': (0, 0),
+        '2% gaps': (0.02, 0),
+        '2% gaps + 1% dups': (0.02, 0.01),
+    }
+    print(f"clean_ohlcv_dataframe, {rows} {args.timeframe} candles, "
+          f"pandas {pd.__version__}, numpy {np.__version__}")
+    for name, (gaps, duplicates) in cases.items():
+        df = make_ohlcv(rows, args.timeframe, gaps, duplicates)
+        times = '  '.join(f"{engine} {bench(df, args.timeframe, engine, args.repeat):7.0f}ms"
+                          for engine in AVAILABLE_OHLCV_ENGINES)
+        print(f"  {name:<20} {times}")
+
+
+if __name__ == '__main__':
+    main()
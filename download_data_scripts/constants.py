@@ -28,11 +28,18 @@ AVAILABLE_PAIRLISTS = ['StaticPairList', 'VolumePairList',
                        'PriceFilter', 'RangeStabilityFilter', 'ShuffleFilter',
                        'SpreadFilter', 'VolatilityFilter']
 AVAILABLE_PROTECTIONS = ['CooldownPeriod', 'LowProfitPairs', 'MaxDrawdown', 'StoplossGuard']
-AVAILABLE_DATAHANDLERS = ['csv', 'json', 'jsongz', 'hdf5']
+AVAILABLE_DATAHANDLERS = ['csv', 'json', 'jsongz', 'hdf5', 'parquet', 'npy']
+# Trades can also be stored in one segment per period, e.g. 'csv:day'
+TRADES_SEGMENT_PERIODS = ['day', 'month']
+AVAILABLE_DATAHANDLERS_TRADES = AVAILABLE_DATAHANDLERS + [
+    f'{fmt}:{period}' for fmt in AVAILABLE_DATAHANDLERS for period in TRADES_SEGMENT_PERIODS]
 DRY_RUN_WALLET = 1000
 DATETIME_PRINT_FORMAT = '%Y-%m-%d %H:%M:%S'
 MATH_CLOSE_PREC = 1e-14  # Precision used for float comparisons
 DEFAULT_DATAFRAME_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume']
+# Implementation used to deduplicate and fill up ohlcv data, both give the same results
+AVAILABLE_OHLCV_ENGINES = ['pandas', 'numpy']
+DEFAULT_OHLCV_ENGINE = 'numpy'
 # Don't modify sequence of DEFAULT_TRADES_COLUMNS
 # it has wide consequences for stored trades files
 DEFAULT_TRADES_COLUMNS = ['timestamp', 'id', 'type', 'side', 'price', 'amount', 'cost']
@@ -308,9 +315,10 @@ CONF_SCHEMA = {
         },
         'dataformat_trades': {
             'type': 'string',
-                    'enum': AVAILABLE_DATAHANDLERS,
+                    'enum': AVAILABLE_DATAHANDLERS_TRADES,
                     'default': 'jsongz'
-        }
+        },
+        'download_concurrency': {'type': 'integer', 'minimum': 1, 'default': 1},
     },
     'definitions': {
         'exchange': {
@@ -338,6 +346,8 @@ CONF_SCHEMA = {
                 },
                 'outdated_offset': {'type': 'integer', 'minimum': 1},
                 'markets_refresh_interval': {'type': 'integer'},
+                'markets_cache_dir': {'type': 'string'},
+                'markets_cache_ttl': {'type': 'integer', 'minimum': 0},
                 'ccxt_config': {'type': 'object'},
                 'ccxt_async_config': {'type': 'object'}
             },
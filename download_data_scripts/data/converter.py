@@ -1,23 +1,25 @@
 """
 Functions to convert data from one format to another
 """
-import itertools
 import logging
 from datetime import datetime, timezone
-from operator import itemgetter
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Optional, Union
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame, to_datetime
 
-from constants import DEFAULT_DATAFRAME_COLUMNS, DEFAULT_TRADES_COLUMNS, TradeList
+from constants import (DEFAULT_DATAFRAME_COLUMNS, DEFAULT_OHLCV_ENGINE, DEFAULT_TRADES_COLUMNS,
+                       TradeList)
+from data.tradebatch import TradeBatch
 
 
 logger = logging.getLogger(__name__)
 
 
 def ohlcv_to_dataframe(ohlcv: list, timeframe: str, pair: str, *,
-                       fill_missing: bool = True, drop_incomplete: bool = True) -> DataFrame:
+                       fill_missing: bool = True, drop_incomplete: bool = True,
+                       engine: str = DEFAULT_OHLCV_ENGINE) -> DataFrame:
     """
     Converts a list with candle (OHLCV) data (in format returned by ccxt.fetch_ohlcv)
     to a Dataframe
@@ -27,6 +29,7 @@ def ohlcv_to_dataframe(ohlcv: list, timeframe: str, pair: str, *,
     :param fill_missing: fill up missing candles with 0 candles
                          (see ohlcv_fill_up_missing_data for details)
     :param drop_incomplete: Drop the last candle of the dataframe, assuming it's incomplete
+    :param engine: Implementation used to clean the data, one of AVAILABLE_OHLCV_ENGINES
     :return: DataFrame
     """
     logger.debug(f"Converting candle (OHLCV) data to dataframe for pair {pair}.")
@@ -42,12 +45,16 @@ def ohlcv_to_dataframe(ohlcv: list, timeframe: str, pair: str, *,
                           'volume': 'float'})
     return clean_ohlcv_dataframe(df, timeframe, pair,
                                  fill_missing=fill_missing,
-                                 drop_incomplete=drop_incomplete)
+                                 drop_incomplete=drop_incomplete,
+                                 engine=engine)
 
 
 def clean_ohlcv_dataframe(data: DataFrame, timeframe: str, pair: str, *,
                           fill_missing: bool = True,
-                          drop_incomplete: bool = True) -> DataFrame:
+                          drop_incomplete: bool = True,
+                          validated: bool = False,
+                          filled: bool = False,
+                          engine: str = DEFAULT_OHLCV_ENGINE) -> DataFrame:
     """
     Clense a OHLCV dataframe by
       * Grouping it by date (removes duplicate tics)
@@ -59,55 +66,77 @@ def clean_ohlcv_dataframe(data: DataFrame, timeframe: str, pair: str, *,
     :param fill_missing: fill up missing candles with 0 candles
                          (see ohlcv_fill_up_missing_data for details)
     :param drop_incomplete: Drop the last candle of the dataframe, assuming it's incomplete
+    :param validated: Data is known to be sorted by date without duplicates (e.g. checked
+                      when it was stored). The grouping is skipped if the dates are
+                      strictly increasing.
+    :param filled: Validated data is known to have no missing candles, skip the fill up
+    :param engine: 'pandas' or 'numpy' (see ohlcv_group_numpy), both give the same result
     :return: DataFrame
     """
-    # group by index and aggregate results to eliminate duplicate ticks
-    data = data.groupby(by='date', as_index=False, sort=True).agg({
-        'open': 'first',
-        'high': 'max',
-        'low': 'min',
-        'close': 'last',
-        'volume': 'max',
-    })
+    dates = data['date'].values
+    if validated and (dates[1:] > dates[:-1]).all():
+        data = data.loc[:, DEFAULT_DATAFRAME_COLUMNS]
+        data.reset_index(drop=True, inplace=True)
+    else:
+        filled = False
+        grouped = None
+        if engine == 'numpy':
+            grouped = ohlcv_group_numpy(data, volume='max')
+        if grouped is not None:
+            data = grouped
+        else:
+            # group by index and aggregate results to eliminate duplicate ticks
+            data = data.groupby(by='date', as_index=False, sort=True).agg({
+                'open': 'first',
+                'high': 'max',
+                'low': 'min',
+                'close': 'last',
+                'volume': 'max',
+            })
     # eliminate partial candle
     if drop_incomplete:
         data.drop(data.tail(1).index, inplace=True)
         logger.debug('Dropping last candle')
 
-    if fill_missing:
-        return ohlcv_fill_up_missing_data(data, timeframe, pair)
+    if fill_missing and not filled:
+        return ohlcv_fill_up_missing_data(data, timeframe, pair, engine=engine)
     else:
         return data
 
 
-def ohlcv_fill_up_missing_data(dataframe: DataFrame, timeframe: str, pair: str) -> DataFrame:
+def ohlcv_fill_up_missing_data(dataframe: DataFrame, timeframe: str, pair: str, *,
+                               engine: str = DEFAULT_OHLCV_ENGINE) -> DataFrame:
     """
     Fills up missing data with 0 volume rows,
     using the previous close as price for "open", "high" "low" and "close", volume is set to 0
-
+    :param engine: 'pandas' or 'numpy' (see ohlcv_group_numpy), both give the same result
     """
-    from freqtrade.exchange import timeframe_to_minutes
+    from exchange import timeframe_to_minutes
 
-    ohlcv_dict = {
-        'open': 'first',
-        'high': 'max',
-        'low': 'min',
-        'close': 'last',
-        'volume': 'sum'
-    }
     timeframe_minutes = timeframe_to_minutes(timeframe)
-    # Resample to create "NAN" values
-    df = dataframe.resample(f'{timeframe_minutes}min', on='date').agg(ohlcv_dict)
-
-    # Forwardfill close for missing columns
-    df['close'] = df['close'].fillna(method='ffill')
-    # Use close for "open, high, low"
-    df.loc[:, ['open', 'high', 'low']] = df[['open', 'high', 'low']].fillna(
-        value={'open': df['close'],
-               'high': df['close'],
-               'low': df['close'],
-               })
-    df.reset_index(inplace=True)
+    df = None
+    if engine == 'numpy':
+        df = ohlcv_group_numpy(dataframe, volume='sum', timeframe_minutes=timeframe_minutes)
+    if df is None:
+        ohlcv_dict = {
+            'open': 'first',
+            'high': 'max',
+            'low': 'min',
+            'close': 'last',
+            'volume': 'sum'
+        }
+        # Resample to create "NAN" values
+        df = dataframe.resample(f'{timeframe_minutes}min', on='date').agg(ohlcv_dict)
+
+        # Forwardfill close for missing columns
+        df['close'] = df['close'].fillna(method='ffill')
+        # Use close for "open, high, low"
+        df.loc[:, ['open', 'high', 'low']] = df[['open', 'high', 'low']].fillna(
+            value={'open': df['close'],
+                   'high': df['close'],
+                   'low': df['close'],
+                   })
+        df.reset_index(inplace=True)
     len_before = len(dataframe)
     len_after = len(df)
     pct_missing = (len_after - len_before) / len_before if len_before > 0 else 0
@@ -122,6 +151,77 @@ def ohlcv_fill_up_missing_data(dataframe: DataFrame, timeframe: str, pair: str)
     return df
 
 
+def ohlcv_group_numpy(data: DataFrame, volume: str,
+                      timeframe_minutes: Optional[int] = None) -> Optional[DataFrame]:
+    """
+    NumPy implementation of the grouping done by clean_ohlcv_dataframe (timeframe_minutes
+    not set) and by ohlcv_fill_up_missing_data (timeframe_minutes set).
+    Each candle gets an integer slot: its date, or the number of timeframes since the
+    start of the first day (the bins of DataFrame.resample). Candles sharing a slot are
+    aggregated, then they are scattered into the full range of slots, filling the
+    missing candles with the previous close.
+    :param data: DataFrame containing candle (OHLCV) data
+    :param volume: Aggregation of the volume of candles sharing a slot, 'max' or 'sum'
+    :param timeframe_minutes: Timeframe to fill up missing candles for
+    :return: DataFrame, None if the data can't be handled here (empty, not float or NaN
+             values, or volumes to sum up) and pandas must be used instead.
+    """
+    if data.empty or str(data['date'].dtype) != 'datetime64[ns, UTC]':
+        return None
+    values = data[DEFAULT_DATAFRAME_COLUMNS[1:]].to_numpy()
+    if values.dtype != np.float64 or np.isnan(values).any():
+        return None
+
+    dates = data['date'].values.view(np.int64)
+    if not (dates[1:] >= dates[:-1]).all():
+        # Stable, so first / last follow the order of the data within a slot
+        order = np.argsort(dates, kind='stable')
+        dates, values = dates[order], values[order]
+    if timeframe_minutes:
+        step = timeframe_minutes * 60 * 10 ** 9
+        origin = dates[0] - dates[0] % (86400 * 10 ** 9)
+        slots = (dates - origin) // step
+    else:
+        slots = dates
+
+    starts = np.flatnonzero(np.r_[True, slots[1:] != slots[:-1]])
+    if len(starts) < len(slots):
+        if volume == 'sum':
+            # pandas sums with compensated summation, the results could differ slightly
+            return None
+        ends = np.r_[starts[1:], len(slots)] - 1
+        values = np.column_stack([
+            values[starts, 0],
+            np.maximum.reduceat(values[:, 1], starts),
+            np.minimum.reduceat(values[:, 2], starts),
+            values[ends, 3],
+            np.maximum.reduceat(values[:, 4], starts),
+        ])
+        slots = slots[starts]
+
+    if timeframe_minutes:
+        first = slots[0]
+        grid = np.full((slots[-1] - first + 1, 5), np.nan)
+        grid[:, 4] = 0
+        grid[slots - first] = values
+        # Forwardfill close, use it for open, high and low of the missing candles
+        missing = np.isnan(grid[:, 3])
+        previous = np.where(missing, 0, np.arange(len(grid)))
+        np.maximum.accumulate(previous, out=previous)
+        grid[:, 3] = grid[previous, 3]
+        grid[missing, :3] = grid[missing, 3:4]
+        values = grid
+        dates = origin + (first + np.arange(len(grid))) * step
+    else:
+        dates = slots
+
+    return DataFrame({
+        'date': pd.arrays.DatetimeArray(dates.view('datetime64[ns]'),
+                                        dtype=pd.DatetimeTZDtype(tz='UTC')),
+        **{col: values[:, i] for i, col in enumerate(DEFAULT_DATAFRAME_COLUMNS[1:])}
+    })
+
+
 def trim_dataframe(df: DataFrame, timerange, df_date_col: str = 'date',
                    startup_candles: int = 0) -> DataFrame:
     """
@@ -170,15 +270,14 @@ def order_book_to_dataframe(bids: list, asks: list) -> DataFrame:
     return frame
 
 
-def trades_remove_duplicates(trades: List[List]) -> List[List]:
+def trades_remove_duplicates(trades: Union[TradeBatch, TradeList]) -> TradeBatch:
     """
-    Removes duplicates from the trades list.
-    Uses itertools.groupby to avoid converting to pandas.
-    Tests show it as being pretty efficient on lists of 4M Lists.
-    :param trades: List of Lists with constants.DEFAULT_TRADES_COLUMNS as columns
-    :return: same format as above, but with duplicates removed
+    Removes duplicates from the trades, sorting them by timestamp.
+    Trades are duplicates if they share the same id, trades without id are kept.
+    :param trades: TradeBatch, or List of Lists with constants.DEFAULT_TRADES_COLUMNS as columns
+    :return: TradeBatch, with duplicates removed
     """
-    return [i for i, _ in itertools.groupby(sorted(trades, key=itemgetter(0)))]
+    return TradeBatch.from_trades(trades).remove_duplicates()
 
 
 def trades_dict_to_list(trades: List[Dict]) -> TradeList:
@@ -190,25 +289,108 @@ def trades_dict_to_list(trades: List[Dict]) -> TradeList:
     return [[t[col] for col in DEFAULT_TRADES_COLUMNS] for t in trades]
 
 
-def trades_to_ohlcv(trades: TradeList, timeframe: str) -> DataFrame:
+def trades_to_ohlcv(trades: Union[TradeBatch, TradeList], timeframe: str) -> DataFrame:
     """
     Converts trades list to OHLCV list
-    :param trades: List of trades, as returned by ccxt.fetch_trades.
+    :param trades: TradeBatch, or List of trades with DEFAULT_TRADES_COLUMNS as columns
     :param timeframe: Timeframe to resample data to
     :return: OHLCV Dataframe.
     :raises: ValueError if no trades are provided
     """
-    from freqtrade.exchange import timeframe_to_minutes
+    from exchange import timeframe_to_minutes
     timeframe_minutes = timeframe_to_minutes(timeframe)
     if not trades:
         raise ValueError('Trade-list empty.')
-    df = pd.DataFrame(trades, columns=DEFAULT_TRADES_COLUMNS)
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms',
-                                     utc=True,)
-    df = df.set_index('timestamp')
+    df = _trades_price_frame(TradeBatch.from_trades(trades))
+    return _resample_trades(df, timeframe_minutes, origin='start_day')
 
-    df_new = df['price'].resample(f'{timeframe_minutes}min').ohlc()
-    df_new['volume'] = df['amount'].resample(f'{timeframe_minutes}min').sum()
+
+def trades_to_ohlcv_chunked(chunks: Iterable[Union[TradeBatch, TradeList]], timeframe: str,
+                            origin: Optional[pd.Timestamp] = None) -> DataFrame:
+    """
+    Converts trades to OHLCV, consuming them in time-ordered chunks.
+    The trades of the last (possibly still open) candle of each chunk are carried over
+    to the next chunk, so memory is bounded by the chunk size plus one candle.
+    The result is identical to trades_to_ohlcv() on the concatenated trades.
+    :param chunks: Iterable of TradeBatches or trade lists, in time order
+    :param timeframe: Timeframe to resample data to
+    :param origin: Timestamp the candles are aligned to.
+                   Defaults to the start of the day of the first trade, like trades_to_ohlcv()
+    :return: OHLCV Dataframe.
+    :raises: ValueError if no trades are provided
+    """
+    from exchange import timeframe_to_minutes
+    timeframe_minutes = timeframe_to_minutes(timeframe)
+    candle_length = pd.Timedelta(minutes=timeframe_minutes)
+
+    carry = None
+    ohlcv = []
+    for trades in chunks:
+        if not trades:
+            continue
+        df = _trades_price_frame(TradeBatch.from_trades(trades))
+        if carry is not None:
+            df = pd.concat([carry, df])
+        if origin is None:
+            # Same bins as resample(origin='start_day') on the whole trade-list
+            origin = df.index[0].normalize()
+
+        last_candle = origin + (df.index[-1] - origin) // candle_length * candle_length
+        complete = df.index < last_candle
+        if complete.any():
+            ohlcv.append(_resample_trades(df[complete], timeframe_minutes, origin=origin))
+        carry = df[~complete]
+
+    if carry is None:
+        raise ValueError('Trade-list empty.')
+    ohlcv.append(_resample_trades(carry, timeframe_minutes, origin=origin))
+    return pd.concat(ohlcv)
+
+
+def ohlcv_resample(ohlcv: DataFrame, timeframe: str, origin='start_day') -> DataFrame:
+    """
+    Aggregate candles to a coarser timeframe, dropping empty candles.
+    The timeframe must be a multiple of the timeframe of the candles.
+    Candles resampled from the output of trades_to_ohlcv() (with the default origin)
+    match trades_to_ohlcv() on the same trades - volume may differ by float rounding.
+    :param ohlcv: OHLCV Dataframe
+    :param timeframe: Timeframe to resample data to
+    :param origin: Timestamp the candles are aligned to (see pandas resample).
+                   Use 'epoch' for candles aligned like the exchange ones.
+    :return: OHLCV Dataframe.
+    """
+    from exchange import timeframe_to_minutes
+    timeframe_minutes = timeframe_to_minutes(timeframe)
+    df_new = ohlcv.set_index('date').resample(f'{timeframe_minutes}min', origin=origin).agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'volume': 'sum',
+    })
+    df_new['date'] = df_new.index
+    # Drop 0 volume rows
+    df_new = df_new.dropna()
+    return df_new.loc[:, DEFAULT_DATAFRAME_COLUMNS]
+
+
+def _trades_price_frame(trades: TradeBatch) -> DataFrame:
+    """
+    Price and amount of the trades, indexed by timestamp
+    """
+    # Viewed as datetime64 - to_datetime(unit='ms') fails on read-only arrays (e.g. parquet)
+    index = pd.DatetimeIndex(pd.to_datetime(trades.timestamp.view('datetime64[ms]'), utc=True),
+                             name='timestamp')
+    return DataFrame({'price': trades.columns['price'], 'amount': trades.columns['amount']},
+                     index=index)
+
+
+def _resample_trades(df: DataFrame, timeframe_minutes: int, origin) -> DataFrame:
+    """
+    Resample trades (indexed by timestamp) to OHLCV candles, dropping empty candles.
+    """
+    df_new = df['price'].resample(f'{timeframe_minutes}min', origin=origin).ohlc()
+    df_new['volume'] = df['amount'].resample(f'{timeframe_minutes}min', origin=origin).sum()
     df_new['date'] = df_new.index
     # Drop 0 volume rows
     df_new = df_new.dropna()
@@ -223,7 +405,7 @@ def convert_trades_format(config: Dict[str, Any], convert_from: str, convert_to:
     :param convert_to: Target format
     :param erase: Erase souce data (does not apply if source and target format are identical)
     """
-    from freqtrade.data.history.idatahandler import get_datahandler
+    from data.history.idatahandler import get_datahandler
     src = get_datahandler(config['datadir'], convert_from)
     trg = get_datahandler(config['datadir'], convert_to)
 
@@ -248,7 +430,7 @@ def convert_ohlcv_format(config: Dict[str, Any], convert_from: str, convert_to:
     :param convert_to: Target format
     :param erase: Erase souce data (does not apply if source and target format are identical)
     """
-    from freqtrade.data.history.idatahandler import get_datahandler
+    from data.history.idatahandler import get_datahandler
     src = get_datahandler(config['datadir'], convert_from)
     trg = get_datahandler(config['datadir'], convert_to)
     timeframes = config.get('timeframes', [config.get('timeframe')])
@@ -64,14 +64,18 @@ class DataProvider:
         """
         return list(self._exchange._klines.keys())
 
-    def ohlcv(self, pair: str, timeframe: str = None, copy: bool = True) -> DataFrame:
+    def ohlcv(self, pair: str, timeframe: str = None, copy: bool = False) -> DataFrame:
         """
         Get candle (OHLCV) data for the given pair as DataFrame
         Please use the `available_pairs` method to verify which pairs are currently cached.
         :param pair: pair to get the data for
         :param timeframe: Timeframe to get data for
         :param copy: copy dataframe before returning if True.
-                     Use False only for read-only operations (where the dataframe is not modified)
+                     Otherwise a read-only view on the cached candles is returned: columns can
+                     be added or replaced, but values can't be modified in place.
+                     Breaking change: the default used to be True. Callers modifying values in
+                     place now get "ValueError: assignment destination is read-only" and
+                     have to pass copy=True.
         """
         if self.runmode in (RunMode.DRY_RUN, RunMode.LIVE):
             return self._exchange.klines((pair, timeframe or self._config['timeframe']),
@@ -100,8 +104,8 @@ class DataProvider:
         :return: Dataframe for this pair
         """
         if self.runmode in (RunMode.DRY_RUN, RunMode.LIVE):
-            # Get live OHLCV data.
-            data = self.ohlcv(pair=pair, timeframe=timeframe)
+            # Get live OHLCV data - copied, writable like the historical data
+            data = self.ohlcv(pair=pair, timeframe=timeframe, copy=True)
         else:
             # Get historical OHLCV data (cached on disk).
             data = self.historic_ohlcv(pair=pair, timeframe=timeframe)
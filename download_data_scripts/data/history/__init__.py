@@ -9,4 +9,5 @@ Includes:
 from .history_utils import (convert_trades_to_ohlcv, get_timerange, load_data, load_pair_history,
                             refresh_backtest_ohlcv_data, refresh_backtest_trades_data, refresh_data,
                             validate_backtest_data)
-from .idatahandler import get_datahandler
+from .idatahandler import (disable_ohlcv_cache, enable_ohlcv_cache, get_datahandler,
+                           get_ohlcv_cache)
@@ -0,0 +1,136 @@
+"""
+Download and conversion checkpoints.
+Keeps track of how far the trades download of each pair got, so an interrupted
+download can resume without parsing the stored data, and of how far the trades
+were converted to OHLCV, so only new trades are converted.
+"""
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import misc
+
+
+logger = logging.getLogger(__name__)
+
+
+class _CheckpointFile:
+    """
+    Json file in the datadir holding one entry per key.
+    The file is rewritten atomically after each update.
+    Updates are serialized, so pairs downloaded concurrently can share one instance.
+    """
+
+    _filename: str
+
+    def __init__(self, datadir: Path) -> None:
+        self._path = Path(datadir) / self._filename
+        self._entries: Dict[str, Dict[str, Any]] = self._load()
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self._path.is_file():
+            return {}
+        try:
+            with self._path.open('r') as fp:
+                return misc.json_load(fp)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read checkpoint {self._path}, ignoring it.")
+            return {}
+
+    def _save(self) -> None:
+        misc.file_dump_json_atomic(self._path, self._entries)
+
+    def _set(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._save()
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+
+class TradesCheckpoint(_CheckpointFile):
+    """
+    Per-datadir manifest of the trades stored for each pair:
+    last trade id, last trade timestamp, size of the trades file and number of rows.
+    The manifest is rewritten atomically after each update.
+    """
+
+    _filename = 'trades_checkpoint.json'
+
+    def get(self, pair: str, byte_offset: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the checkpoint of a pair.
+        :param pair: Pair to get the checkpoint for
+        :param byte_offset: Current size of the trades file. If given, the checkpoint is
+                            only returned if it matches, so stale checkpoints are ignored.
+        :return: Dict with last_id, last_timestamp, byte_offset and row_count, or None
+        """
+        entry = self._entries.get(pair)
+        if entry and byte_offset is not None and entry['byte_offset'] != byte_offset:
+            logger.info(f"Download checkpoint for {pair} does not match the stored data.")
+            return None
+        return entry
+
+    def update(self, pair: str, *, last_id: Any, last_timestamp: int, byte_offset: int,
+               row_count: Optional[int]) -> None:
+        """
+        Record the state of a pair after a batch of trades was stored.
+        :param last_id: Id of the last stored trade
+        :param last_timestamp: Timestamp (ms) of the last stored trade
+        :param byte_offset: Size of the trades file after storing the batch
+        :param row_count: Number of stored trades, None if unknown
+        """
+        self._set(pair, {
+            'last_id': last_id,
+            'last_timestamp': last_timestamp,
+            'byte_offset': byte_offset,
+            'row_count': row_count,
+        })
+
+    def remove(self, pair: str) -> None:
+        self._remove(pair)
+
+
+class ConversionCheckpoint(_CheckpointFile):
+    """
+    Per-datadir record of the trades already converted to OHLCV, per pair and timeframe:
+    last converted trade id and timestamp, start of the last (possibly still open)
+    candle and the origin the candles are aligned to.
+    """
+
+    _filename = 'ohlcv_conversion_checkpoint.json'
+
+    @staticmethod
+    def _key(pair: str, timeframe: str) -> str:
+        return f'{pair}|{timeframe}'
+
+    def get(self, pair: str, timeframe: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the conversion state of a pair / timeframe.
+        :return: Dict with last_id, last_timestamp, candle_start and origin, or None
+        """
+        return self._entries.get(self._key(pair, timeframe))
+
+    def update(self, pair: str, timeframe: str, *, last_id: Any, last_timestamp: int,
+               candle_start: int, origin: int) -> None:
+        """
+        Record the state of a pair / timeframe after a conversion.
+        :param last_id: Id of the last converted trade
+        :param last_timestamp: Timestamp (ms) of the last converted trade
+        :param candle_start: Start (ms) of the last converted candle
+        :param origin: Timestamp (ms) the candles are aligned to
+        """
+        self._set(self._key(pair, timeframe), {
+            'last_id': last_id,
+            'last_timestamp': last_timestamp,
+            'candle_start': candle_start,
+            'origin': origin,
+        })
+
+    def remove(self, pair: str, timeframe: str) -> None:
+        self._remove(self._key(pair, timeframe))
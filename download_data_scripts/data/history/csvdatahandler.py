@@ -1,17 +1,19 @@
 import logging
+import os
 import re
 import io
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, to_datetime
 
 import misc
-#from configuration import TimeRange
 from constants import DEFAULT_DATAFRAME_COLUMNS, ListPairsWithTimeframes, TradeList
-from data.converter import trades_dict_to_list
+from data.tradebatch import TradeBatch
+from timerange import TimeRange
 
 from .idatahandler import IDataHandler
 
@@ -23,6 +25,8 @@ class CSVDataHandler(IDataHandler):
 
     _use_zip = False
     _columns = DEFAULT_DATAFRAME_COLUMNS
+    # Same sequence as DEFAULT_TRADES_COLUMNS, with the names used in the csv header
+    _trades_columns = ['timestamp', 'trade_id', 'null', 'type', 'price', 'amount', 'value']
 
     @classmethod
     def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
@@ -46,7 +50,8 @@ class CSVDataHandler(IDataHandler):
         :return: List of Pairs
         """
 
-        _tmp = [re.search(r'^(\S+)(?=\-' + timeframe + '.json)', p.name)
+        _tmp = [re.search(r'^(\S+)(?=\-' + timeframe + '.' + cls._get_file_extension() + ')',
+                          p.name)
                 for p in datadir.glob(f"*{timeframe}.{cls._get_file_extension()}")]
         # Check if regex found something and only return these results
         return [match[0].replace('_', '/') for match in _tmp if match]
@@ -62,18 +67,17 @@ class CSVDataHandler(IDataHandler):
         :return: None
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
-        _data = data.copy()
-        # Convert date to int
-        _data['date'] = _data['date'].astype(np.int64) // 1000 // 1000
 
         # Reset index, select only appropriate columns and save as CSV
-        _data.reset_index(drop=True).loc[:, self._columns].to_json(
-            filename, sep=",",
+        # (date is written as datetime, as in the trades files, and parsed back on load)
+        data.reset_index(drop=True).loc[:, self._columns].to_csv(
+            filename, index=False,
             compression='gzip' if self._use_zip else None)
+        self._ohlcv_store_meta(pair, timeframe, data)
 
     # nuova  per  gestire l'input CSV
     def _ohlcv_load(self, pair: str, timeframe: str,
-                    timerange, #: Optional[TimeRange] = None,
+                    timerange: Optional[TimeRange] = None,
                     ) -> DataFrame:
         """
         Internal method used to load data for one pair from disk.
@@ -82,15 +86,14 @@ class CSVDataHandler(IDataHandler):
         :param pair: Pair to load data
         :param timeframe: Timeframe (e.g. "5m")
         :param timerange: Limit data to be loaded to this timerange.
-                        Optionally implemented by subclasses to avoid loading
-                        all data where possible.
+                        Only the lines within the timerange are read.
         :return: DataFrame with ohlcv data, or empty DataFrame
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
         if not filename.exists():
             return DataFrame(columns=self._columns)
         try:
-            pairdata = pd.read_csv(filename)
+            pairdata = self._read_csv(filename, timerange)
             # la colonna timestamp non è uguale a self._columns... . lo rendo uguale per sicurezza
             pairdata.rename(columns={"timestamp":"date"}, inplace=True)
             pairdata = pairdata[self._columns]
@@ -114,6 +117,7 @@ class CSVDataHandler(IDataHandler):
         :return: True when deleted, false if file did not exist.
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        self._ohlcv_purge_meta(pair, timeframe)
         if filename.exists():
             filename.unlink()
             return True
@@ -121,12 +125,50 @@ class CSVDataHandler(IDataHandler):
 
     def ohlcv_append(self, pair: str, timeframe: str, data: DataFrame) -> None:
         """
-        Append data to existing data structures
+        Append data to existing data structures.
+        Only the last line of the file is read - if the first new candle has the same
+        date, the file is truncated before it.
         :param pair: Pair
         :param timeframe: Timeframe this ohlcv data is for
-        :param data: Data to append.
+        :param data: Data to append, sorted by date.
         """
-        raise NotImplementedError()
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not filename.exists():
+            return self.ohlcv_store(pair, timeframe, data)
+
+        last_line = self._read_last_line(filename)
+        last_date = (to_datetime(last_line[0].split(b',', 1)[0].decode(), utc=True)
+                     if last_line else None)
+        data, replace_last = self._ohlcv_new_candles(data, last_date)
+        if data.empty:
+            return
+        meta = self.ohlcv_data_meta(pair, timeframe)
+        if replace_last:
+            os.truncate(filename, last_line[1])
+        data.loc[:, self._columns].to_csv(filename, mode='a', header=False, index=False)
+        self._ohlcv_store_meta(pair, timeframe, data, meta, last_date, replace_last)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Date of the first and of the last stored candle.
+        Only the first and the last line of the file are read.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not filename.exists():
+            return None
+        last_line = self._read_last_line(filename)
+        if not last_line:
+            return None
+        with open(filename, 'rb') as f:
+            # Salto l'header
+            f.readline()
+            first_line = f.readline()
+        return tuple(to_datetime(line.split(b',', 1)[0].decode(), utc=True).to_pydatetime()
+                     for line in (first_line, last_line[0]))
 
     @classmethod
     def trades_get_pairs(cls, datadir: Path) -> List[str]:
@@ -140,19 +182,31 @@ class CSVDataHandler(IDataHandler):
         # Check if regex found something and only return these results to avoid exceptions.
         return [match[0].replace('_', '/') for match in _tmp if match]
 
-    def trades_store(self, pair: str, data: TradeList) -> None:
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
         """
         Store trades data (list of Dicts) to file
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
-        filename = self._pair_trades_filename(self._datadir, pair)
         #filename = self.renamefile(filename) # / "revised.csv"
         #misc.file_dump_json(filename, data, is_zip=self._use_zip)
 
-        # Convert list of lists to DataFrame
-        df = pd.DataFrame(data, columns=['timestamp', 'trade_id', 'null', 'type', 'price', 'amount', 'value'])
+        # CSV trade files are only ever extended
+        self.trades_append(pair, data)
+
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
+        """
+        Append data to existing files
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+
+        # Convert trades to DataFrame
+        df = TradeBatch.from_trades(data).to_frame()
+        df.columns = self._trades_columns
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
         # Drop the 'null' column if it's not needed
         #df.drop(columns=['null'], inplace=True)
@@ -163,70 +217,91 @@ class CSVDataHandler(IDataHandler):
         else:
             df.to_csv(filename, mode='w', header=True, index=False)
 
-    def trades_append(self, pair: str, data: TradeList):
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
         """
-        Append data to existing files
-        :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
-                     column sequence as in DEFAULT_TRADES_COLUMNS
+        Load a pair from csv file
+        :param pair: Load trades for this pair
+        :param timerange: Timerange to load trades for - only the lines within the
+                          timerange are read
+        :return: TradeBatch of trades
         """
-        raise NotImplementedError()
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if not filename.exists():
+            return TradeBatch.empty()
 
-    def _trades_load(self, pair: str, timerange): #Optional[TimeRange] = None) -> TradeList:
+        trades = self._read_csv(filename, timerange, dtype={'trade_id': str})
+        return self._trades_to_batch(trades)
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
         """
-        Load a pair from file, either .json.gz or .json
-        # TODO: respect timerange ...
+        Load a pair's trades in time-ordered chunks, reading the csv file incrementally.
+        Reading starts at the first line within the timerange.
         :param pair: Load trades for this pair
-        :param timerange: Timerange to load trades for - currently not implemented
-        :return: List of trades
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
         """
         filename = self._pair_trades_filename(self._datadir, pair)
-        #tradesdata = misc.file_load_json(filename)
-
         if not filename.exists():
-            return pd.DataFrame()  # Return an empty DataFrame if the file does not exist
-
-        # Load the CSV file into a DataFrame
-        #df = pd.read_csv(filename, parse_dates=['timestamp'], infer_datetime_format=True)
-        df = self.load_only_last_row(filename)
-
-        # Optional: filter data based on the timerange
-        #if timerange:
-        #    df = df[(df['timestamp'] >= timerange.start) & (df['timestamp'] <= timerange.end)]
-
-        # Convert DataFrame to list of dictionaries (TradeList)
-        #trade_list = df.to_dict('records')
-        return df
-
-        # if isinstance(tradesdata[0], dict):
-        #     # Convert trades dict to list
-        #     logger.info("Old trades format detected - converting")
-        #     tradesdata = trades_dict_to_list(tradesdata)
-        #     pass
-        # return tradesdata
-
-    def load_only_last_row(self, filename):
-        # Leggi la prima riga per ottenere i titoli delle colonne
-        with open(filename, 'r') as f:
-            column_names = f.readline().strip().split(',')
+            return
+        if not timerange or self._use_zip:
+            with pd.read_csv(filename, dtype={'trade_id': str}, chunksize=chunksize) as reader:
+                for trades in reader:
+                    chunk = self._trades_to_batch(trades).filter_timerange(timerange)
+                    if chunk:
+                        yield chunk
+            return
+
+        with open(filename, 'rb') as fp:
+            start, end = self._timerange_offsets(fp, timerange)
+            fp.seek(start)
+            with pd.read_csv(fp, header=None, names=self._trades_columns,
+                             dtype={'trade_id': str}, chunksize=chunksize) as reader:
+                for trades in reader:
+                    chunk = self._trades_to_batch(trades).filter_timerange(timerange)
+                    if chunk:
+                        yield chunk
+                    if len(chunk) < len(trades):
+                        # Past the end of the timerange
+                        break
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        The file is read backwards in blocks until enough lines are found.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if n <= 0 or not filename.exists():
+            return TradeBatch.empty()
+
+        # Una riga in più: la prima riga letta può essere incompleta
+        data, offset = misc.file_read_tail(filename, b'\n', n + 1)
+        lines = data.splitlines()
+        if offset == 0:
+            # Salto l'header
+            lines = lines[1:]
+        lines = lines[-n:]
+        if not lines:
+            return TradeBatch.empty()
+
+        trades = pd.read_csv(io.BytesIO(b'\n'.join(lines)), header=None,
+                             names=self._trades_columns, dtype={'trade_id': str})
+        return self._trades_to_batch(trades)
 
-        # Apri il file in modalità 'rb' (read binary) e posiziona il puntatore alla fine
-        with open(filename, 'rb') as f:
-            # Vai alla fine del file
-            f.seek(-2, 2)
-            # Muoviti indietro fino a trovare una nuova riga
-            while f.read(1) != b'\n':
-                f.seek(-2, 1)
-            # Leggi l'ultima riga
-            last_line = f.readline().decode()
-
-        # Carica l'ultima riga in un DataFrame
-        df_last_row = pd.read_csv(io.StringIO(last_line), header=None)
-        df_last_row.columns = column_names
-        # Effettua il parsing della colonna 'timestamp' come datetime
-        df_last_row['timestamp'] = pd.to_datetime(df_last_row['timestamp'], infer_datetime_format=True)
-
-        return df_last_row
+    @classmethod
+    def _trades_to_batch(cls, trades: DataFrame) -> TradeBatch:
+        """
+        Convert trades read from csv to a TradeBatch (ms timestamps)
+        """
+        trades['timestamp'] = to_datetime(trades['timestamp'], utc=True,
+                                          infer_datetime_format=True
+                                          ).astype(np.int64) // 10 ** 6
+        return TradeBatch.from_frame(trades.loc[:, cls._trades_columns])
 
     def trades_purge(self, pair: str) -> bool:
         """
@@ -240,6 +315,58 @@ class CSVDataHandler(IDataHandler):
             return True
         return False
 
+    def _read_csv(self, filename: Path, timerange: Optional[TimeRange], **kwargs) -> DataFrame:
+        """
+        Read a csv file, limited to the lines within the timerange.
+        :param kwargs: Passed to pandas.read_csv
+        """
+        if not timerange or self._use_zip:
+            return pd.read_csv(filename, **kwargs)
+        with open(filename, 'rb') as fp:
+            header = fp.readline()
+            start, end = self._timerange_offsets(fp, timerange)
+            fp.seek(start)
+            data = fp.read(end - start)
+        return pd.read_csv(io.BytesIO(header + data), **kwargs)
+
+    @classmethod
+    def _timerange_offsets(cls, fp, timerange: TimeRange) -> Tuple[int, int]:
+        """
+        Offsets of the first line within the timerange and of the end of the last one.
+        Lines are sorted by date, so they're located with a binary search on the date
+        in the first column.
+        :param fp: csv file opened in binary mode
+        """
+        fp.seek(0)
+        fp.readline()
+        start = fp.tell()
+        end = fp.seek(0, os.SEEK_END)
+        if timerange.starttype == 'date':
+            start = misc.file_bisect(fp, timerange.startts * 1000, cls._line_date_ms, b'\n',
+                                     start, end)
+        if timerange.stoptype == 'date':
+            end = misc.file_bisect(fp, timerange.stopts * 1000, cls._line_date_ms, b'\n',
+                                   start, end)
+        return start, end
+
+    @staticmethod
+    def _line_date_ms(line: bytes) -> int:
+        return to_datetime(line.split(b',', 1)[0].decode(), utc=True).value // 10 ** 6
+
+    @staticmethod
+    def _read_last_line(filename: Path) -> Optional[Tuple[bytes, int]]:
+        """
+        Read the last line of a csv file.
+        :return: Tuple of (last line, offset of the line in the file),
+                 None if the file only contains the header
+        """
+        data, offset = misc.file_read_tail(filename, b'\n', 2)
+        data = data.rstrip(b'\n')
+        start = data.rfind(b'\n') + 1
+        if start == 0 and offset == 0:
+            return None
+        return data[start:], offset + start
+
     @classmethod
     def _pair_data_filename(cls, datadir: Path, pair: str, timeframe: str) -> Path:
         pair_s = misc.pair_to_filename(pair)
@@ -1,15 +1,16 @@
 import logging
 import re
+import threading
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-import numpy as np
 import pandas as pd
 
-from freqtrade import misc
-from freqtrade.configuration import TimeRange
-from freqtrade.constants import (DEFAULT_DATAFRAME_COLUMNS, DEFAULT_TRADES_COLUMNS,
-                                 ListPairsWithTimeframes, TradeList)
+import misc
+from constants import DEFAULT_DATAFRAME_COLUMNS, ListPairsWithTimeframes, TradeList
+from data.tradebatch import TradeBatch
+from timerange import TimeRange
 
 from .idatahandler import IDataHandler
 
@@ -18,8 +19,86 @@ logger = logging.getLogger(__name__)
 
 
 class HDF5DataHandler(IDataHandler):
+    """
+    Stores data in PyTables tables, which are appended to in place.
+    `date` / `timestamp` are data columns with a full index, used by `where` queries.
+    One store per file is kept open for the lifetime of the datahandler - call close()
+    to release them.
+    """
 
     _columns = DEFAULT_DATAFRAME_COLUMNS
+    _load_in_processes = False
+    # String columns are sized by the first write - reserve enough room for later appends
+    # (e.g. an all-None 'type' column would otherwise be 3 characters wide).
+    _trades_min_itemsize = {'id': 64, 'type': 16, 'side': 8}
+
+    def __init__(self, datadir: Path) -> None:
+        super().__init__(datadir)
+        self._stores: Dict[Path, pd.HDFStore] = {}
+        # PyTables is not thread safe
+        self._lock = threading.RLock()
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close all open stores.
+        """
+        with self._lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores.clear()
+
+    def _get_store(self, filename: Path) -> pd.HDFStore:
+        """
+        Get the open store of filename, opening (and creating) it if needed.
+        """
+        store = self._stores.get(filename)
+        if store is None or not store.is_open:
+            store = pd.HDFStore(filename, mode='a', complevel=9, complib='blosc')
+            self._stores[filename] = store
+        return store
+
+    def _close_store(self, filename: Path) -> None:
+        store = self._stores.pop(filename, None)
+        if store is not None:
+            store.close()
+
+    @staticmethod
+    def _write_table(ds: pd.HDFStore, key: str, data: pd.DataFrame, index_column: str,
+                     append: bool, **kwargs) -> None:
+        """
+        Write data to the table `key`, creating the index of index_column with the table.
+        PyTables keeps the index updated on later appends.
+        """
+        new_table = not append or key not in ds
+        if append:
+            ds.append(key, data, format='table', data_columns=[index_column], index=False,
+                      **kwargs)
+        else:
+            ds.put(key, data, format='table', data_columns=[index_column], index=False,
+                   **kwargs)
+        # Empty data doesn't create the table
+        if new_table and key in ds:
+            ds.create_table_index(key, columns=[index_column], optlevel=9, kind='full')
+        ds.flush()
+
+    @staticmethod
+    def _where(column: str, timerange: Optional[TimeRange], factor: int,
+               value: str = '{}') -> Optional[List[str]]:
+        """
+        `where` conditions selecting the timerange on column
+        :param factor: Multiplier from timerange seconds to the stored unit
+        :param value: Format of the compared value
+        """
+        where = []
+        if timerange:
+            if timerange.starttype == 'date':
+                where.append(f"{column} >= " + value.format(timerange.startts * factor))
+            if timerange.stoptype == 'date':
+                where.append(f"{column} < " + value.format(timerange.stopts * factor))
+        return where or None
 
     @classmethod
     def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
@@ -57,17 +136,16 @@ class HDF5DataHandler(IDataHandler):
         :return: None
         """
         key = self._pair_ohlcv_key(pair, timeframe)
-        _data = data.copy()
-
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
 
-        ds = pd.HDFStore(filename, mode='a', complevel=9, complib='blosc')
-        ds.put(key, _data.loc[:, self._columns], format='table', data_columns=['date'])
-
-        ds.close()
+        with self._lock:
+            self._write_table(self._get_store(filename), key, data.loc[:, self._columns],
+                              'date', append=False)
+            self._ohlcv_store_meta(pair, timeframe, data)
 
     def _ohlcv_load(self, pair: str, timeframe: str,
-                    timerange: Optional[TimeRange] = None) -> pd.DataFrame:
+                    timerange: Optional[TimeRange] = None,
+                    ) -> pd.DataFrame:
         """
         Internal method used to load data for one pair from disk.
         Implements the loading and conversion to a Pandas dataframe.
@@ -84,14 +162,12 @@ class HDF5DataHandler(IDataHandler):
 
         if not filename.exists():
             return pd.DataFrame(columns=self._columns)
-        where = []
-        if timerange:
-            if timerange.starttype == 'date':
-                where.append(f"date >= Timestamp({timerange.startts * 1e9})")
-            if timerange.stoptype == 'date':
-                where.append(f"date < Timestamp({timerange.stopts * 1e9})")
-
-        pairdata = pd.read_hdf(filename, key=key, mode="r", where=where)
+        with self._lock:
+            ds = self._get_store(filename)
+            if key not in ds:
+                return pd.DataFrame(columns=self._columns)
+            pairdata = ds.select(key, where=self._where('date', timerange, 10 ** 9,
+                                                        'Timestamp({})'))
 
         if list(pairdata.columns) != self._columns:
             raise ValueError("Wrong dataframe format")
@@ -107,6 +183,9 @@ class HDF5DataHandler(IDataHandler):
         :return: True when deleted, false if file did not exist.
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        with self._lock:
+            self._close_store(filename)
+        self._ohlcv_purge_meta(pair, timeframe)
         if filename.exists():
             filename.unlink()
             return True
@@ -114,12 +193,54 @@ class HDF5DataHandler(IDataHandler):
 
     def ohlcv_append(self, pair: str, timeframe: str, data: pd.DataFrame) -> None:
         """
-        Append data to existing data structures
+        Append data to existing data structures.
+        Only the last row of the table is read - if the first new candle has the same
+        date, that row is removed before appending.
         :param pair: Pair
         :param timeframe: Timeframe this ohlcv data is for
-        :param data: Data to append.
+        :param data: Data to append, sorted by date.
+        """
+        key = self._pair_ohlcv_key(pair, timeframe)
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+
+        with self._lock:
+            ds = self._get_store(filename)
+            last_date = None
+            if key in ds:
+                nrows = ds.get_storer(key).nrows
+                if nrows:
+                    last_date = ds.select(key, start=nrows - 1)['date'].iloc[-1]
+            data, replace_last = self._ohlcv_new_candles(data, last_date)
+            if data.empty:
+                return
+            meta = self.ohlcv_data_meta(pair, timeframe)
+            if replace_last:
+                ds.remove(key, start=nrows - 1, stop=nrows)
+            self._write_table(ds, key, data.loc[:, self._columns], 'date', append=True)
+            self._ohlcv_store_meta(pair, timeframe, data, meta, last_date, replace_last)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
         """
-        raise NotImplementedError()
+        Date of the first and of the last stored candle.
+        Only the first and the last row of the table are read.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
+        """
+        key = self._pair_ohlcv_key(pair, timeframe)
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+
+        if not filename.exists():
+            return None
+        with self._lock:
+            ds = self._get_store(filename)
+            if key not in ds or not ds.get_storer(key).nrows:
+                return None
+            nrows = ds.get_storer(key).nrows
+            first = ds.select(key, start=0, stop=1)['date'].iloc[0]
+            last = ds.select(key, start=nrows - 1)['date'].iloc[-1]
+        return first.to_pydatetime(), last.to_pydatetime()
 
     @classmethod
     def trades_get_pairs(cls, datadir: Path) -> List[str]:
@@ -133,52 +254,115 @@ class HDF5DataHandler(IDataHandler):
         # Check if regex found something and only return these results to avoid exceptions.
         return [match[0].replace('_', '/') for match in _tmp if match]
 
-    def trades_store(self, pair: str, data: TradeList) -> None:
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
         """
         Store trades data (list of Dicts) to file
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
         key = self._pair_trades_key(pair)
+        filename = self._pair_trades_filename(self._datadir, pair)
 
-        ds = pd.HDFStore(self._pair_trades_filename(self._datadir, pair),
-                         mode='a', complevel=9, complib='blosc')
-        ds.put(key, pd.DataFrame(data, columns=DEFAULT_TRADES_COLUMNS),
-               format='table', data_columns=['timestamp'])
-        ds.close()
+        with self._lock:
+            self._write_table(self._get_store(filename), key,
+                              TradeBatch.from_trades(data).to_frame(),
+                              'timestamp', append=False, min_itemsize=self._trades_min_itemsize)
 
-    def trades_append(self, pair: str, data: TradeList):
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
         """
         Append data to existing files
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
-        raise NotImplementedError()
+        if not data:
+            return
+        key = self._pair_trades_key(pair)
+        filename = self._pair_trades_filename(self._datadir, pair)
+
+        with self._lock:
+            self._write_table(self._get_store(filename), key,
+                              TradeBatch.from_trades(data).to_frame(),
+                              'timestamp', append=True, min_itemsize=self._trades_min_itemsize)
 
-    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeList:
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
         """
         Load a pair from h5 file.
         :param pair: Load trades for this pair
-        :param timerange: Timerange to load trades for - currently not implemented
-        :return: List of trades
+        :param timerange: Timerange to load trades for, selected with the timestamp index
+        :return: TradeBatch of trades
         """
         key = self._pair_trades_key(pair)
         filename = self._pair_trades_filename(self._datadir, pair)
 
         if not filename.exists():
-            return []
-        where = []
-        if timerange:
-            if timerange.starttype == 'date':
-                where.append(f"timestamp >= {timerange.startts * 1e3}")
-            if timerange.stoptype == 'date':
-                where.append(f"timestamp < {timerange.stopts * 1e3}")
+            return TradeBatch.empty()
+        with self._lock:
+            ds = self._get_store(filename)
+            if key not in ds:
+                return TradeBatch.empty()
+            trades: pd.DataFrame = ds.select(key, where=self._where('timestamp', timerange,
+                                                                    1000))
+        return TradeBatch.from_frame(trades)
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks from the h5 file.
+        Only the chunk being returned is held in memory.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        key = self._pair_trades_key(pair)
+        filename = self._pair_trades_filename(self._datadir, pair)
+
+        if not filename.exists():
+            return
+        where = self._where('timestamp', timerange, 1000)
+        with self._lock:
+            ds = self._get_store(filename)
+            if key not in ds:
+                return
+            if where:
+                # Row numbers are resolved with the index once, chunks are then read by number
+                coordinates = ds.select_as_coordinates(key, where=where)
+            else:
+                coordinates = None
+            nrows = ds.get_storer(key).nrows if coordinates is None else len(coordinates)
+
+        for start in range(0, nrows, chunksize):
+            with self._lock:
+                ds = self._get_store(filename)
+                if coordinates is None:
+                    trades = ds.select(key, start=start, stop=start + chunksize)
+                else:
+                    trades = ds.select(key, where=coordinates[start:start + chunksize])
+            yield TradeBatch.from_frame(trades)
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        Uses the row count of the table, so only the last rows are read.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        key = self._pair_trades_key(pair)
+        filename = self._pair_trades_filename(self._datadir, pair)
 
-        trades: pd.DataFrame = pd.read_hdf(filename, key=key, mode="r", where=where)
-        trades[['id', 'type']] = trades[['id', 'type']].replace({np.nan: None})
-        return trades.values.tolist()
+        if n <= 0 or not filename.exists():
+            return TradeBatch.empty()
+        with self._lock:
+            ds = self._get_store(filename)
+            if key not in ds:
+                return TradeBatch.empty()
+            nrows = ds.get_storer(key).nrows
+            trades: pd.DataFrame = ds.select(key, start=max(nrows - n, 0))
+        return TradeBatch.from_frame(trades)
 
     def trades_purge(self, pair: str) -> bool:
         """
@@ -187,6 +371,8 @@ class HDF5DataHandler(IDataHandler):
         :return: True when deleted, false if file did not exist.
         """
         filename = self._pair_trades_filename(self._datadir, pair)
+        with self._lock:
+            self._close_store(filename)
         if filename.exists():
             filename.unlink()
             return True
@@ -1,30 +1,40 @@
+import asyncio
 import logging
 import operator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import arrow
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
-#from download_data_scripts.configuration import TimeRange
-from constants import DEFAULT_DATAFRAME_COLUMNS
-from data.converter import (clean_ohlcv_dataframe, ohlcv_to_dataframe,
-                trades_remove_duplicates, trades_to_ohlcv)
+from data.converter import (ohlcv_resample, ohlcv_to_dataframe, trades_remove_duplicates,
+                            trades_to_ohlcv, trades_to_ohlcv_chunked)
+from data.history.checkpoint import ConversionCheckpoint, TradesCheckpoint
 from data.history.idatahandler import IDataHandler, get_datahandler
+from data.tradebatch import TradeBatch
 from exceptions import OperationalException
-from exchange import Exchange
+from exchange import Exchange, timeframe_to_minutes
 from misc import format_ms_time
+from timerange import TimeRange
 
 
 logger = logging.getLogger(__name__)
 
+# Number of downloaded trades kept in memory before they are appended to storage
+TRADES_FLUSH_SIZE = 100_000
+# Number of trades loaded at once by incremental conversions
+TRADES_CONVERT_CHUNKSIZE = 1_000_000
+
 
 def load_pair_history(pair: str,
                       timeframe: str,
                       datadir: Path, *,
-                      timerange,  #: Optional[TimeRange] = None,
+                      timerange: Optional[TimeRange] = None,
                       fill_up_missing: bool = True,
                       drop_incomplete: bool = True,
                       startup_candles: int = 0,
@@ -50,7 +60,7 @@ def load_pair_history(pair: str,
 
     return data_handler.ohlcv_load(pair=pair,
                                    timeframe=timeframe,
-                                   timerange=None,
+                                   timerange=timerange,
                                    fill_missing=fill_up_missing,
                                    drop_incomplete=drop_incomplete,
                                    startup_candles=startup_candles,
@@ -60,14 +70,17 @@ def load_pair_history(pair: str,
 def load_data(datadir: Path,
               timeframe: str,
               pairs: List[str], *,
-              timerange,  #: Optional[TimeRange] = None,
+              timerange: Optional[TimeRange] = None,
               fill_up_missing: bool = True,
               startup_candles: int = 0,
               fail_without_data: bool = False,
               data_format: str = 'json',
+              workers: int = 1,
               ) -> Dict[str, DataFrame]:
     """
     Load ohlcv history data for a list of pairs.
+    With workers > 1, pairs are loaded concurrently - in threads for binary formats,
+    in processes for formats which have to be parsed (csv / json).
 
     :param datadir: Path to the data storage location.
     :param timeframe: Timeframe (e.g. "5m")
@@ -77,6 +90,7 @@ def load_data(datadir: Path,
     :param startup_candles: Additional candles to load at the start of the period
     :param fail_without_data: Raise OperationalException if no data is found.
     :param data_format: Data format which should be used. Defaults to json
+    :param workers: Number of pairs loaded at the same time. 1 loads pairs one by one.
     :return: dict(<pair>:<Dataframe>)
     """
     result: Dict[str, DataFrame] = {}
@@ -84,14 +98,25 @@ def load_data(datadir: Path,
         logger.info(f'Using indicator startup period: {startup_candles} ...')
 
     data_handler = get_datahandler(datadir, data_format)
-
-    for pair in pairs:
-        hist = load_pair_history(pair=pair, timeframe=timeframe,
-                                 datadir=datadir, timerange=timerange,
-                                 fill_up_missing=fill_up_missing,
-                                 startup_candles=startup_candles,
-                                 data_handler=data_handler
-                                 )
+    load_kwargs = dict(timeframe=timeframe, datadir=datadir, timerange=timerange,
+                       fill_up_missing=fill_up_missing, startup_candles=startup_candles)
+
+    if workers > 1 and len(pairs) > 1:
+        if data_handler._load_in_processes:
+            # Datahandlers are not shared with worker processes, each loads with its own
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                hists = list(executor.map(
+                    partial(_load_pair_history_worker, data_format, load_kwargs), pairs))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                hists = list(executor.map(
+                    lambda pair: load_pair_history(pair=pair, data_handler=data_handler,
+                                                   **load_kwargs), pairs))
+    else:
+        hists = (load_pair_history(pair=pair, data_handler=data_handler, **load_kwargs)
+                 for pair in pairs)
+
+    for pair, hist in zip(pairs, hists):
         if not hist.empty:
             result[pair] = hist
 
@@ -100,12 +125,20 @@ def load_data(datadir: Path,
     return result
 
 
+def _load_pair_history_worker(data_format: str, load_kwargs: Dict[str, Any],
+                              pair: str) -> DataFrame:
+    """
+    Load one pair in a worker process of load_data()
+    """
+    return load_pair_history(pair=pair, data_format=data_format, **load_kwargs)
+
+
 def refresh_data(datadir: Path,
                  timeframe: str,
                  pairs: List[str],
                  exchange: Exchange,
                  data_format: str = None,
-                 timerange = None, #: Optional[TimeRange] = None,
+                 timerange: Optional[TimeRange] = None,
                  ) -> None:
     """
     Refresh ohlcv history data for a list of pairs.
@@ -123,47 +156,49 @@ def refresh_data(datadir: Path,
                                exchange=exchange, data_handler=data_handler)
 
 
-def _load_cached_data_for_updating(pair: str, timeframe: str, timerange, #: Optional[TimeRange],
-                                   data_handler: IDataHandler) -> Tuple[DataFrame, Optional[int]]:
+def _load_cached_data_for_updating(pair: str, timeframe: str, timerange: Optional[TimeRange],
+                                   data_handler: IDataHandler
+                                   ) -> Tuple[Optional[Tuple[datetime, datetime]], Optional[int]]:
     """
-    Load cached data to download more data.
+    Get the range of cached data to download more data.
     If timerange is passed in, checks whether data from an before the stored data will be
     downloaded.
     If that's the case then what's available should be completely overwritten.
-    Otherwise downloads always start at the end of the available data to avoid data gaps.
+    Otherwise downloads always start at the last stored candle (which is replaced on append,
+    as it may have been stored incomplete) to avoid data gaps.
+    Only the first and last stored candle are read, not the full dataset.
     Note: Only used by download_pair_history().
+    :return: Tuple of (first, last) stored candle dates or None if the data has to be
+             (re)downloaded completely, and the download start in ms
     """
     start = None
     if timerange:
         if timerange.starttype == 'date':
             start = datetime.fromtimestamp(timerange.startts, tz=timezone.utc)
 
-    # Intentionally don't pass timerange in - since we need to load the full dataset.
-    data = data_handler.ohlcv_load(pair, timeframe=timeframe,
-                                   timerange=None, fill_missing=False,
-                                   drop_incomplete=True, warn_no_data=False)
-    if not data.empty:
-        if start and start < data.iloc[0]['date']:
+    min_max = data_handler.ohlcv_data_min_max(pair, timeframe)
+    if min_max:
+        if start and start < min_max[0]:
             # Earlier data than existing data requested, redownload all
-            data = DataFrame(columns=DEFAULT_DATAFRAME_COLUMNS)
+            min_max = None
         else:
-            start = data.iloc[-1]['date']
+            start = min_max[1]
 
     start_ms = int(start.timestamp() * 1000) if start else None
-    return data, start_ms
+    return min_max, start_ms
 
 
 def _download_pair_history(datadir: Path,
                            exchange: Exchange,
                            pair: str, *,
                            timeframe: str = '5m',
-                           timerange, #: Optional[TimeRange] = None,
+                           timerange: Optional[TimeRange] = None,
                            data_handler: IDataHandler = None) -> bool:
     """
     Download latest candles from the exchange for the pair and timeframe passed in parameters
     The data is downloaded starting from the last correct data that
-    exists in a cache. If timerange starts earlier than the data in the cache,
-    the full data will be redownloaded
+    exists in a cache and appended to it. If timerange starts earlier than the data
+    in the cache, the full data will be redownloaded
 
     Based on @Rybolov work: https://github.com/rybolov/freqtrade-data
 
@@ -180,14 +215,13 @@ def _download_pair_history(datadir: Path,
             f'and store in {datadir}.'
         )
 
-        # data, since_ms = _load_cached_data_for_updating_old(datadir, pair, timeframe, timerange)
-        data, since_ms = _load_cached_data_for_updating(pair, timeframe, timerange,
-                                                        data_handler=data_handler)
+        min_max, since_ms = _load_cached_data_for_updating(pair, timeframe, timerange,
+                                                           data_handler=data_handler)
 
         logger.debug("Current Start: %s",
-                     f"{data.iloc[0]['date']:%Y-%m-%d %H:%M:%S}" if not data.empty else 'None')
+                     f"{min_max[0]:%Y-%m-%d %H:%M:%S}" if min_max else 'None')
         logger.debug("Current End: %s",
-                     f"{data.iloc[-1]['date']:%Y-%m-%d %H:%M:%S}" if not data.empty else 'None')
+                     f"{min_max[1]:%Y-%m-%d %H:%M:%S}" if min_max else 'None')
 
         # Default since_ms to 30 days if nothing is given
         new_data = exchange.get_historic_ohlcv(pair=pair,
@@ -199,20 +233,19 @@ def _download_pair_history(datadir: Path,
         # TODO: Maybe move parsing to exchange class (?)
         new_dataframe = ohlcv_to_dataframe(new_data, timeframe, pair,
                                            fill_missing=False, drop_incomplete=True)
-        if data.empty:
-            data = new_dataframe
-        else:
-            # Run cleaning again to ensure there were no duplicate candles
-            # Especially between existing and new data.
-            data = clean_ohlcv_dataframe(data.append(new_dataframe), timeframe, pair,
-                                         fill_missing=False, drop_incomplete=False)
 
         logger.debug("New  Start: %s",
-                     f"{data.iloc[0]['date']:%Y-%m-%d %H:%M:%S}" if not data.empty else 'None')
+                     f"{new_dataframe.iloc[0]['date']:%Y-%m-%d %H:%M:%S}"
+                     if not new_dataframe.empty else 'None')
         logger.debug("New End: %s",
-                     f"{data.iloc[-1]['date']:%Y-%m-%d %H:%M:%S}" if not data.empty else 'None')
+                     f"{new_dataframe.iloc[-1]['date']:%Y-%m-%d %H:%M:%S}"
+                     if not new_dataframe.empty else 'None')
 
-        data_handler.ohlcv_store(pair, timeframe, data=data)
+        if min_max is None:
+            data_handler.ohlcv_store(pair, timeframe, data=new_dataframe)
+        else:
+            # Only the new candles are written, replacing the last stored one
+            data_handler.ohlcv_append(pair, timeframe, data=new_dataframe)
         return True
 
     except Exception:
@@ -222,112 +255,263 @@ def _download_pair_history(datadir: Path,
         return False
 
 
+def _derive_pair_history(pair: str, base_timeframe: str, timeframes: List[str], *,
+                         data_handler: IDataHandler) -> None:
+    """
+    Build candles of coarser timeframes from the stored candles of base_timeframe.
+    Only the base candles from the last stored candle of each derived timeframe onwards
+    are read, derived candles replace the stored ones from there on.
+    Timeframes without stored candles, or with base candles starting earlier than their
+    stored candles, are built from all base candles.
+    :param base_timeframe: Timeframe of the stored candles to aggregate
+    :param timeframes: Timeframes to build - multiples of base_timeframe which
+                       divide one day, so they're aligned like the exchange candles
+    """
+    base_min_max = data_handler.ohlcv_data_min_max(pair, base_timeframe)
+    if not base_min_max:
+        return
+    base_start = pd.Timestamp(base_min_max[0])
+
+    # Start of the candles to rebuild per timeframe, None to rebuild all candles
+    starts: Dict[str, Optional[pd.Timestamp]] = {}
+    for timeframe in timeframes:
+        candle_length = pd.Timedelta(minutes=timeframe_to_minutes(timeframe))
+        min_max = data_handler.ohlcv_data_min_max(pair, timeframe)
+        if min_max and pd.Timestamp(min_max[0]) <= base_start.ceil(candle_length):
+            starts[timeframe] = pd.Timestamp(min_max[1])
+        else:
+            starts[timeframe] = None
+
+    timerange = None
+    if None not in starts.values():
+        timerange = TimeRange('date', None, int(min(starts.values()).timestamp()), 0)
+    base = data_handler.ohlcv_load(pair, base_timeframe, timerange, fill_missing=False,
+                                   drop_incomplete=False, warn_no_data=False)
+    if base.empty:
+        return
+    base_end = base['date'].iloc[-1] + pd.Timedelta(minutes=timeframe_to_minutes(base_timeframe))
+
+    for timeframe in timeframes:
+        candle_length = pd.Timedelta(minutes=timeframe_to_minutes(timeframe))
+        start = starts[timeframe]
+        data = ohlcv_resample(base if start is None else base[base['date'] >= start],
+                              timeframe, origin='epoch')
+        # Only keep candles fully covered by the base candles
+        data = data[(data['date'] >= base_start)
+                    & (data['date'] + candle_length <= base_end)].reset_index(drop=True)
+        if data.empty:
+            continue
+        logger.info(f'Derived {len(data)} candles for pair {pair}, interval {timeframe} '
+                    f'from interval {base_timeframe}.')
+        if start is None:
+            data_handler.ohlcv_store(pair, timeframe, data=data)
+        else:
+            # Replaces the last stored candle, which may have been incomplete
+            data_handler.ohlcv_append(pair, timeframe, data=data)
+
+
 def refresh_backtest_ohlcv_data(exchange: Exchange, pairs: List[str], timeframes: List[str],
-                                datadir: Path, timerange, #: Optional[TimeRange] = None,
-                                erase: bool = False, data_format: str = None) -> List[str]:
+                                datadir: Path, timerange: Optional[TimeRange] = None,
+                                erase: bool = False, data_format: str = None,
+                                derive_timeframes: bool = False) -> List[str]:
     """
     Refresh stored ohlcv data for backtesting and hyperopt operations.
     Used by freqtrade download-data subcommand.
+    :param derive_timeframes: Only download the finest timeframe, and build the coarser
+                              timeframes dividing one day (e.g. 5m, 1h, 1d) from it.
     :return: List of pairs that are not available.
     """
     pairs_not_available = []
     data_handler = get_datahandler(datadir, data_format)
+
+    download_timeframes = [str(timeframe) for timeframe in timeframes]
+    derived_timeframes: List[str] = []
+    if derive_timeframes and download_timeframes:
+        base_timeframe = min(download_timeframes, key=timeframe_to_minutes)
+        base_minutes = timeframe_to_minutes(base_timeframe)
+        derived_timeframes = [
+            timeframe for timeframe in download_timeframes
+            if timeframe != base_timeframe
+            and timeframe_to_minutes(timeframe) % base_minutes == 0
+            and (24 * 60) % timeframe_to_minutes(timeframe) == 0]
+        download_timeframes = [timeframe for timeframe in download_timeframes
+                               if timeframe not in derived_timeframes]
+
     for pair in pairs:
         if pair not in exchange.markets:
             pairs_not_available.append(pair)
             logger.info(f"Skipping pair {pair}...")
             continue
-        for timeframe in timeframes:
 
-            if erase:
+        if erase:
+            for timeframe in timeframes:
                 if data_handler.ohlcv_purge(pair, timeframe):
                     logger.info(
                         f'Deleting existing data for pair {pair}, interval {timeframe}.')
 
+        for timeframe in download_timeframes:
             logger.info(f'Downloading pair {pair}, interval {timeframe}.')
             _download_pair_history(datadir=datadir, exchange=exchange,
-                                   pair=pair, timeframe=str(timeframe),
+                                   pair=pair, timeframe=timeframe,
                                    timerange=timerange, data_handler=data_handler)
+        if derived_timeframes:
+            _derive_pair_history(pair, base_timeframe, derived_timeframes,
+                                 data_handler=data_handler)
     return pairs_not_available
 
 
+def _prepare_trades_download(pair: str, timerange: Optional[TimeRange],
+                             data_handler: IDataHandler, checkpoint: TradesCheckpoint
+                             ) -> Tuple[int, float, Any, Optional[Dict[str, Any]]]:
+    """
+    Determine where the trades download for this pair has to resume from.
+    Uses the download checkpoint if it matches the stored data, and only falls back to
+    reading the stored trades otherwise.
+    :return: Tuple of (since, until, from_id, resume state).
+             The resume state holds last_id, last_timestamp and row_count of the stored
+             trades, None if nothing is stored yet.
+    """
+    if (timerange and timerange.starttype == 'date'):
+        since = timerange.startts * 1000
+    else:
+        since = int(arrow.utcnow().shift(days=-30).float_timestamp) * 1000
+
+    resume = checkpoint.get(pair, byte_offset=data_handler.trades_data_size(pair))
+    if resume:
+        logger.info(f"Resuming {pair} from trade id {resume['last_id']} "
+                    f"({format_ms_time(resume['last_timestamp'])}).")
+    else:
+        # Only the last stored trade is needed to resume
+        trades = data_handler.trades_tail(pair, 1)
+        if trades:
+            resume = {
+                'last_id': trades[-1][1],
+                'last_timestamp': trades[-1][0],
+                'row_count': None,
+            }
+            logger.info(f"Current End for {pair}: {format_ms_time(trades[-1][0])}")
+
+    # TradesList columns are defined in constants.DEFAULT_TRADES_COLUMNS
+    # DEFAULT_TRADES_COLUMNS: 0 -> timestamp
+    # DEFAULT_TRADES_COLUMNS: 1 -> id
+
+    # trovo il "from_id" e il "since"
+    if not resume:
+        from_id = 1
+        until = 1534358028000  # 15-8-2018     1625464801081.0  #  5 luglio 2021: se la crypto non è mai stata scaricata non voglio scaricarla tutta insieme per evitare errori per la lunga durata
+    else:
+        # The last stored trade is fetched again, and dropped by its id.
+        from_id = resume['last_id']
+
+        one_month = 60*60*24*30
+        until = resume['last_timestamp'] + one_month * 3 * 1000
+
+        if since < resume['last_timestamp']:
+            # Reset since to the last available point
+            # - 5 seconds (to ensure we're getting all trades)
+            since = resume['last_timestamp'] - (5 * 1000)
+            logger.info(f"Using last trade date -5s - Downloading trades for {pair} "
+                        f"since: {format_ms_time(since)}.")
+
+    return since, until, from_id, resume
+
+
+def _is_new_trade(trades: TradeBatch, resume: Dict[str, Any]) -> np.ndarray:
+    """
+    Check which downloaded trades come after the last stored trade.
+    Compares ids where they are numeric, so trades sharing the last timestamp are kept.
+    :return: Boolean mask, True for new trades
+    """
+    try:
+        return trades.ids.astype(np.int64) > int(resume['last_id'])
+    except (TypeError, ValueError):
+        return trades.timestamp > resume['last_timestamp']
+
+
 def _download_trades_history(exchange: Exchange,
                              pair: str, *,
-                             timerange, #: Optional[TimeRange] = None,
-                             data_handler: IDataHandler
+                             timerange: Optional[TimeRange] = None,
+                             data_handler: IDataHandler,
+                             checkpoint: Optional[TradesCheckpoint] = None
                              ) -> bool:
     """
     Download trade history from the exchange.
     Appends to previously downloaded trades data.
     """
-    try:
-
-        if (timerange and timerange.starttype == 'date'):
-            since = timerange.startts * 1000
-        else:
-            since = int(arrow.utcnow().shift(days=-30).float_timestamp) * 1000
-        # OCCHIO: quì carica il file già scaricato
-        trades = data_handler.trades_load(pair, timerange)
-
-        # TradesList columns are defined in constants.DEFAULT_TRADES_COLUMNS
-        # DEFAULT_TRADES_COLUMNS: 0 -> timestamp
-        # DEFAULT_TRADES_COLUMNS: 1 -> id
-
-        # trovo il "from_id" e il "since"
-        if trades.empty:
-            from_id = 1
-            until = 1534358028000.0  # 15-8-2018     1625464801081.0  #  5 luglio 2021: se la crypto non è mai stata scaricata non voglio scaricarla tutta insieme per evitare errori per la lunga durata
-        else:
-            from_id = trades['trade_id'].iloc[-1]
+    if not exchange.exchange_has("fetchTrades"):
+        raise OperationalException("This exchange does not suport downloading Trades.")
 
-            time_trades = trades['timestamp']
-            one_month = 60*60*24*30
-            until = (time_trades.iloc[-1].timestamp() + one_month*3 ) * 1000
-
-            if since < time_trades.iloc[0].timestamp() * 1000:
-                # since is before the first trade
-                logger.info(f"Start earlier than available data. Redownloading trades for {pair}...")
-                #trades = []
-                #trades = DataFrame()
-
-            if since < time_trades.iloc[-1].timestamp() * 1000:
-                # Reset since to the last available point
-                # - 5 seconds (to ensure we're getting all trades)
-                since = time_trades.iloc[-1].timestamp() * 1000 - (5 * 1000)
-                print(f"Using last trade date -5s - Downloading trades for {pair} "
-                            f"since: {format_ms_time(since)}.")
-
-            #print(f"Current Start: {format_ms_time(time_trades.iloc[0].to_pydatetime())}")
-            print(f"Current Start: {time_trades.iloc[0].to_pydatetime()}")
-            #print(f"Current End: {format_ms_time(time_trades.iloc[-1].to_pydatetime())}")
-            print(f"Current End: {time_trades.iloc[-1].to_pydatetime()}")
-            print(f"Current Amount of trades: {len(trades)}")
+    return exchange.loop.run_until_complete(
+        _async_download_trades_history(exchange, pair, timerange=timerange,
+                                       data_handler=data_handler, checkpoint=checkpoint))
 
 
+async def _async_download_trades_history(exchange: Exchange,
+                                         pair: str, *,
+                                         timerange: Optional[TimeRange] = None,
+                                         data_handler: IDataHandler,
+                                         checkpoint: Optional[TradesCheckpoint] = None,
+                                         flush_size: Optional[int] = TRADES_FLUSH_SIZE
+                                         ) -> bool:
+    """
+    Download trade history from the exchange, appending pages to the stored trades
+    as they arrive.
+    At most `flush_size` trades (plus one page) are held in memory at any time.
+    Datahandlers rewriting all stored trades on append get the whole download at once.
+    The download checkpoint is updated after each flushed batch.
+    File I/O runs in the loop's default executor, so other pairs downloading on the
+    same loop are not blocked while a batch is stored.
+    :param checkpoint: Download checkpoint of the datadir
+    :param flush_size: Number of trades to buffer before appending them to storage,
+                       None to store all trades once the download is complete
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        if checkpoint is None:
+            checkpoint = TradesCheckpoint(data_handler._datadir)
+        since, until, from_id, resume = await loop.run_in_executor(
+            None, _prepare_trades_download, pair, timerange, data_handler, checkpoint)
+        row_count = resume['row_count'] if resume else 0
+        if not data_handler._trades_append_in_place:
+            flush_size = None
+
+        def _flush(pages: List[TradeBatch]) -> None:
+            nonlocal row_count
+            trades = TradeBatch.concat(pages)
+            data_handler.trades_append(pair, data=trades)
+            row_count = row_count + len(trades) if row_count is not None else None
+            checkpoint.update(pair, last_id=trades[-1][1], last_timestamp=trades[-1][0],
+                              byte_offset=data_handler.trades_data_size(pair),
+                              row_count=row_count)
+
+        # Pages are concatenated once per flush
+        buffer: List[TradeBatch] = []
+        buffered = 0
+        total = 0
         # Default since_ms to 30 days if nothing is given
-        new_trades = exchange.get_historic_trades(pair=pair, since=since, until=until, from_id=from_id)
-        #trades.extend(new_trades[1])
-
-        # Rimuovo dalla lista i trades che sono precedenti all'ultimo tempo del file già salvato
-        if not trades.empty:
-            last_timestamp = trades['timestamp'].max()
-            filtered_trades = [trade for trade in new_trades[1] if pd.to_datetime(trade[0], unit='ms', utc=True) > last_timestamp]
-            start_time = time_trades.iloc[0].to_pydatetime()
-        else:
-            filtered_trades = new_trades[1]
-            start_time = format_ms_time(filtered_trades[0][0])
-        #end_time = format_ms_time(filtered_trades[-1][0])
-
-        if len(filtered_trades) > 0:
-            # aggiungo al file già presente in memoria
-            data_handler.trades_store(pair, data=filtered_trades)
-
-            #print(f"New Start: {start_time}")
-            #print(f"New End: {end_time}")
-            print(f"New Amount of trades: {len(filtered_trades)}")
+        async for new_trades in exchange._async_iter_trade_history(
+                pair=pair, since=since, until=until, from_id=from_id):
+            if resume is not None:
+                # Rimuovo i trades già salvati
+                new_trades = new_trades[_is_new_trade(new_trades, resume)]
+                if new_trades:
+                    resume = None
+            if new_trades:
+                buffer.append(new_trades)
+                buffered += len(new_trades)
+            if flush_size is not None and buffered >= flush_size:
+                await loop.run_in_executor(None, _flush, buffer)
+                total += buffered
+                buffer, buffered = [], 0
+
+        if buffer:
+            await loop.run_in_executor(None, _flush, buffer)
+            total += buffered
+
+        if total > 0:
+            logger.info(f"New Amount of trades for {pair}: {total}")
         else:
-            print("No new trades to add")
-
+            logger.info(f"No new trades to add for {pair}")
         return True
 
     except Exception:
@@ -337,15 +521,54 @@ def _download_trades_history(exchange: Exchange,
         return False
 
 
-def refresh_backtest_trades_data(exchange: Exchange, pairs: List[str], datadir: Path, timerange,  #: TimeRange,
-                                  erase: bool = False, data_format: str = 'jsongz') -> List[str]:
+def _download_trades_history_concurrent(exchange: Exchange, pairs: List[str], *,
+                                        timerange: Optional[TimeRange] = None,
+                                        data_handler: IDataHandler,
+                                        checkpoint: TradesCheckpoint,
+                                        concurrency: int) -> List[str]:
+    """
+    Download trades for multiple pairs at once, on one event loop.
+    :param concurrency: Maximum number of pairs downloaded at the same time
+    :return: List of pairs for which the download failed.
+    """
+    if not exchange.exchange_has("fetchTrades"):
+        raise OperationalException("This exchange does not suport downloading Trades.")
+
+    async def _download_all() -> List[bool]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _download(pair: str) -> bool:
+            async with semaphore:
+                logger.info(f'Downloading trades for pair {pair}.')
+                return await _async_download_trades_history(exchange, pair, timerange=timerange,
+                                                            data_handler=data_handler,
+                                                            checkpoint=checkpoint)
+
+        return await asyncio.gather(*[_download(pair) for pair in pairs])
+
+    results = exchange.loop.run_until_complete(_download_all())
+    return [pair for pair, success in zip(pairs, results) if not success]
+
+
+def refresh_backtest_trades_data(exchange: Exchange, pairs: List[str], datadir: Path, timerange: TimeRange,
+                                  erase: bool = False, data_format: str = 'jsongz',
+                                  concurrency: int = 1) -> List[str]:
     """
     Refresh stored trades data for backtesting and hyperopt operations.
     Used by freqtrade download-data subcommand.
-    :return: List of pairs that are not available.
+    :param concurrency: Number of pairs to download at the same time.
+                        1 downloads one pair after the other.
+    :return: List of pairs that are not available, or which failed to download.
     """
     pairs_not_available = []
+    pairs_to_download = []
     data_handler = get_datahandler(datadir, data_format=data_format)
+    checkpoint = TradesCheckpoint(datadir)
+    if not data_handler._trades_append_in_place:
+        logger.warning(f"Trades in {data_format} format are rewritten on every append, so "
+                       f"they are stored once the download of a pair is complete. "
+                       f"Use a segmented format (e.g. '{data_format}:day') to store trades "
+                       f"as they are downloaded.")
     for pair in pairs:
         if pair not in exchange.markets:
             pairs_not_available.append(pair)
@@ -353,38 +576,153 @@ def refresh_backtest_trades_data(exchange: Exchange, pairs: List[str], datadir:
             continue
 
         if erase:
+            checkpoint.remove(pair)
             if data_handler.trades_purge(pair):
                 logger.info(f'Deleting existing data for pair {pair}.')
 
-        print(f'Downloading trades for pair {pair}.')
-        _download_trades_history(exchange=exchange,
-                                 pair=pair,
-                                 timerange=timerange,
-                                 data_handler=data_handler)
+        if concurrency > 1:
+            pairs_to_download.append(pair)
+            continue
+
+        logger.info(f'Downloading trades for pair {pair}.')
+        if not _download_trades_history(exchange=exchange,
+                                        pair=pair,
+                                        timerange=timerange,
+                                        data_handler=data_handler,
+                                        checkpoint=checkpoint):
+            pairs_not_available.append(pair)
+
+    if pairs_to_download:
+        logger.info(f"Downloading trades for {len(pairs_to_download)} pairs, "
+                    f"{concurrency} at a time.")
+        pairs_failed = _download_trades_history_concurrent(
+            exchange, pairs_to_download, timerange=timerange,
+            data_handler=data_handler, checkpoint=checkpoint, concurrency=concurrency)
+        for pair in pairs_failed:
+            logger.info(f"Failed to download trades for pair {pair}.")
+        pairs_not_available.extend(pairs_failed)
     return pairs_not_available
 
 
-def convert_trades_to_ohlcv(pairs: List[str], timeframes: List[str], datadir: Path, timerange, #: TimeRange,
+def _convert_pair_trades_incremental(pair: str, timeframes: List[str], *,
+                                     data_handler_trades: IDataHandler,
+                                     data_handler_ohlcv: IDataHandler,
+                                     checkpoint: ConversionCheckpoint,
+                                     chunksize: int) -> bool:
+    """
+    Convert only the trades added since the last conversion of this pair.
+    The last converted candle of each timeframe may have been incomplete - it is
+    recomputed from all its trades and replaces the stored candles from its start.
+    :param timeframes: Timeframes to convert, finest first
+    :return: False if there's no usable conversion state and the pair has to be
+             converted completely
+    """
+    states = [checkpoint.get(pair, timeframe) for timeframe in timeframes]
+    if not all(states) or any(
+            pair not in data_handler_ohlcv.ohlcv_get_pairs(data_handler_ohlcv._datadir, timeframe)
+            for timeframe in timeframes):
+        return False
+    last_trade = data_handler_trades.trades_tail(pair, 1)
+    if not last_trade:
+        return False
+    last_timestamp, last_id = last_trade[-1][0], last_trade[-1][1]
+    if all(state['last_id'] == last_id for state in states):
+        logger.info(f'No new trades to convert for pair {pair}.')
+        return True
+
+    origin = pd.Timestamp(states[0]['origin'], unit='ms', tz='UTC')
+    start = min(state['candle_start'] for state in states)
+
+    def _new_trades():
+        # Datahandlers only read the trades from the start of the second onwards
+        timerange = TimeRange('date', None, start // 1000, 0)
+        for trades in data_handler_trades.trades_load_chunks(pair, chunksize, timerange):
+            if trades and trades[-1][0] >= start:
+                yield trades[trades.timestamp >= start]
+
+    base_minutes = timeframe_to_minutes(timeframes[0])
+    base = None
+    for timeframe, state in zip(timeframes, states):
+        candle_start = pd.Timestamp(state['candle_start'], unit='ms', tz='UTC')
+        if base is not None and timeframe_to_minutes(timeframe) % base_minutes == 0:
+            ohlcv = ohlcv_resample(base[base['date'] >= candle_start], timeframe, origin=origin)
+        else:
+            ohlcv = trades_to_ohlcv_chunked(_new_trades(), timeframe, origin=origin)
+            if base is None:
+                base = ohlcv
+            ohlcv = ohlcv[ohlcv['date'] >= candle_start]
+        logger.info(f'Converted {len(ohlcv)} new candles for pair {pair}, '
+                    f'interval {timeframe}.')
+        # New candles start at the last stored one, so appending replaces it
+        data_handler_ohlcv.ohlcv_append(pair, timeframe, ohlcv)
+        checkpoint.update(pair, timeframe, last_id=last_id, last_timestamp=last_timestamp,
+                          candle_start=ohlcv['date'].iloc[-1].value // 10 ** 6,
+                          origin=state['origin'])
+    return True
+
+
+def convert_trades_to_ohlcv(pairs: List[str], timeframes: List[str], datadir: Path, timerange: TimeRange,
                             erase: bool = False, data_format_ohlcv: str = 'json',
-                            data_format_trades: str = 'jsongz') -> None:
+                            data_format_trades: str = 'jsongz',
+                            chunksize: Optional[int] = None,
+                            incremental: bool = False) -> None:
     """
     Convert stored trades data to ohlcv data
+    :param chunksize: Convert trades in chunks of this many trades instead of loading
+                      all trades of a pair at once. The resulting candles are identical.
+    :param incremental: Only convert trades added since the last conversion, recomputing
+                        the last (possibly incomplete) candle. Pairs without conversion
+                        state are converted completely.
     """
     data_handler_trades = get_datahandler(datadir, data_format=data_format_trades)
     data_handler_ohlcv = get_datahandler(datadir, data_format=data_format_ohlcv)
+    checkpoint = ConversionCheckpoint(datadir)
 
+    # The finest timeframe is built from trades, coarser ones are aggregated from it
+    timeframes = sorted(timeframes, key=timeframe_to_minutes)
+    base_minutes = timeframe_to_minutes(timeframes[0]) if timeframes else 0
     for pair in pairs:
-        trades = data_handler_trades.trades_load(pair)
+        if incremental and not erase:
+            try:
+                if _convert_pair_trades_incremental(
+                        pair, timeframes, data_handler_trades=data_handler_trades,
+                        data_handler_ohlcv=data_handler_ohlcv, checkpoint=checkpoint,
+                        chunksize=chunksize or TRADES_CONVERT_CHUNKSIZE):
+                    continue
+            except ValueError:
+                logger.exception(f'Could not convert {pair} to OHLCV.')
+                continue
+            logger.info(f'No conversion state for pair {pair}, converting all trades.')
+
+        last_trade = data_handler_trades.trades_tail(pair, 1)
+        if not chunksize:
+            trades = data_handler_trades.trades_load(pair)
+        base = None
         for timeframe in timeframes:
             if erase:
+                checkpoint.remove(pair, timeframe)
                 if data_handler_ohlcv.ohlcv_purge(pair, timeframe):
                     logger.info(f'Deleting existing data for pair {pair}, interval {timeframe}.')
             try:
-                ohlcv = trades_to_ohlcv(trades, timeframe)
+                if base is not None and timeframe_to_minutes(timeframe) % base_minutes == 0:
+                    ohlcv = ohlcv_resample(base, timeframe)
+                elif chunksize:
+                    ohlcv = trades_to_ohlcv_chunked(
+                        data_handler_trades.trades_load_chunks(pair, chunksize), timeframe)
+                else:
+                    ohlcv = trades_to_ohlcv(trades, timeframe)
+                if base is None:
+                    base = ohlcv
                 # Store ohlcv
                 data_handler_ohlcv.ohlcv_store(pair, timeframe, data=ohlcv)
             except ValueError:
                 logger.exception(f'Could not convert {pair} to OHLCV.')
+                continue
+            if last_trade:
+                checkpoint.update(pair, timeframe,
+                                  last_id=last_trade[-1][1], last_timestamp=last_trade[-1][0],
+                                  candle_start=ohlcv['date'].iloc[-1].value // 10 ** 6,
+                                  origin=base['date'].iloc[0].normalize().value // 10 ** 6)
 
 
 def get_timerange(data: Dict[str, DataFrame]) -> Tuple[arrow.Arrow, arrow.Arrow]:
@@ -4,28 +4,127 @@ It's subclasses handle and storing data from disk.
 
 """
 import logging
+import threading
 from abc import ABC, abstractclassmethod, abstractmethod
 from copy import deepcopy
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional, Type
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple, Type, Union
 
-from pandas import DataFrame
+import numpy as np
+from cachetools import LRUCache
+from pandas import DataFrame, to_datetime
 
-#from download_data_scripts.configuration import TimeRange
+import misc
 from constants import ListPairsWithTimeframes, TradeList
 from data.converter import clean_ohlcv_dataframe, trades_remove_duplicates, trim_dataframe
+from data.tradebatch import TradeBatch
 from exchange import timeframe_to_seconds
+from timerange import TimeRange
 
 
 logger = logging.getLogger(__name__)
 
 
+class OhlcvCache:
+    """
+    LRU cache of loaded ohlcv dataframes, limited by the memory used by the dataframes.
+    Entries are keyed by the identity (mtime / size) of the stored data, so data
+    modified on disk is never served from the cache.
+    Dataframes are copied when they're added and returned, callers can modify them.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self._cache: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=self._getsizeof)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _getsizeof(df: DataFrame) -> int:
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    def get(self, key: Hashable) -> Optional[DataFrame]:
+        with self._lock:
+            df = self._cache.get(key)
+            if df is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return df.copy()
+
+    def put(self, key: Hashable, df: DataFrame) -> None:
+        df = df.copy()
+        with self._lock:
+            try:
+                self._cache[key] = df
+            except ValueError:
+                # Larger than the whole cache
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> Dict[str, Any]:
+        """
+        Cache statistics
+        :return: Dict with hits, misses, entries, bytes and max_bytes
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._cache),
+                    'bytes': self._cache.currsize, 'max_bytes': self._cache.maxsize}
+
+
+# Process-wide cache used by IDataHandler.ohlcv_load() - disabled unless enabled explicitly
+_ohlcv_cache: Optional[OhlcvCache] = None
+
+
+def enable_ohlcv_cache(max_bytes: int = 1024 ** 3) -> OhlcvCache:
+    """
+    Cache ohlcv data loaded by all datahandlers of this process.
+    Repeated loads of unchanged data return a copy of the cached dataframe.
+    :param max_bytes: Memory budget of the cached dataframes, least recently used
+                      dataframes are evicted first
+    :return: The cache, e.g. to read its statistics with info()
+    """
+    global _ohlcv_cache
+    _ohlcv_cache = OhlcvCache(max_bytes)
+    return _ohlcv_cache
+
+
+def disable_ohlcv_cache() -> None:
+    """
+    Disable and drop the ohlcv cache.
+    """
+    global _ohlcv_cache
+    _ohlcv_cache = None
+
+
+def get_ohlcv_cache() -> Optional[OhlcvCache]:
+    """
+    :return: The ohlcv cache, None if caching is disabled
+    """
+    return _ohlcv_cache
+
+
 class IDataHandler(ABC):
 
+    # Parsing holds the GIL - load_data() loads pairs in processes instead of threads
+    _load_in_processes = True
+    # trades_append() writes only the new trades - False if it rewrites all stored trades
+    _trades_append_in_place = True
+
     def __init__(self, datadir: Path) -> None:
         self._datadir = datadir
 
+    def close(self) -> None:
+        """
+        Release resources held by the datahandler, like open file handles.
+        The datahandler can still be used afterwards.
+        """
+
     @abstractclassmethod
     def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
         """
@@ -56,7 +155,7 @@ class IDataHandler(ABC):
 
     @abstractmethod
     def _ohlcv_load(self, pair: str, timeframe: str,
-                    timerange, #: Optional[TimeRange] = None,
+                    timerange: Optional[TimeRange] = None,
                     ) -> DataFrame:
         """
         Internal method used to load data for one pair from disk.
@@ -82,11 +181,115 @@ class IDataHandler(ABC):
     @abstractmethod
     def ohlcv_append(self, pair: str, timeframe: str, data: DataFrame) -> None:
         """
-        Append data to existing data structures
+        Append data to existing data structures.
+        Only the boundary with the stored data is deduplicated: candles older than the
+        last stored candle are ignored, a candle at the date of the last stored candle
+        replaces it.
         :param pair: Pair
         :param timeframe: Timeframe this ohlcv data is for
-        :param data: Data to append.
+        :param data: Data to append, sorted by date.
+        """
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Date of the first and of the last stored candle.
+        Subclasses override this to avoid loading all data.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
         """
+        data = self._ohlcv_load(pair, timeframe, timerange=None)
+        if data.empty:
+            return None
+        return data['date'].iloc[0].to_pydatetime(), data['date'].iloc[-1].to_pydatetime()
+
+    def ohlcv_data_identity(self, pair: str, timeframe: str) -> Optional[Tuple[int, int]]:
+        """
+        Identity of the stored ohlcv data, changing whenever the data is modified.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (latest mtime in ns, size in bytes), None if no data is stored
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        try:
+            # Stores using a directory (e.g. npy) are modified in place
+            files = list(filename.iterdir()) if filename.is_dir() else [filename]
+            stats = [f.stat() for f in files]
+        except FileNotFoundError:
+            return None
+        if not stats:
+            return None
+        return max(st.st_mtime_ns for st in stats), sum(st.st_size for st in stats)
+
+    def ohlcv_data_meta(self, pair: str, timeframe: str) -> Optional[Dict[str, Any]]:
+        """
+        Properties of the stored ohlcv data, validated when the data was written.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Dict with 'sorted' (sorted by date, without duplicates) and 'filled'
+                 (without missing candles), None if unknown or the data was modified since
+        """
+        meta = misc.file_load_json(self._ohlcv_meta_filename(pair, timeframe))
+        if not meta or meta.get('timeframe') != timeframe:
+            return None
+        if tuple(meta.get('identity') or ()) != self.ohlcv_data_identity(pair, timeframe):
+            return None
+        return meta
+
+    def _ohlcv_meta_filename(self, pair: str, timeframe: str) -> Path:
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        return filename.with_name(f'{filename.name}.meta')
+
+    def _ohlcv_store_meta(self, pair: str, timeframe: str, data: DataFrame,
+                          previous: Optional[Dict[str, Any]] = None,
+                          last_date: Optional[datetime] = None,
+                          replace_last: bool = False) -> None:
+        """
+        Validate the candles just written and record the result next to the data.
+        Called by the datahandlers after writing ohlcv data.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :param data: Candles written
+        :param previous: ohlcv_data_meta() read before appending, None if data was stored
+        :param last_date: Date of the last stored candle before appending
+        :param replace_last: The first candle of data replaced the last stored candle
+        """
+        dates = to_datetime(data['date'], utc=True).values.view(np.int64)
+        if last_date is not None:
+            if previous is None:
+                # Properties of the existing data are unknown
+                return
+            if replace_last:
+                dates = dates[1:]
+            dates = np.concatenate([[to_datetime(last_date, utc=True).value], dates])
+        steps = np.diff(dates)
+        is_sorted = bool((steps > 0).all()) and (previous or {}).get('sorted', True)
+        filled = (is_sorted and bool((steps == timeframe_to_seconds(timeframe) * 10 ** 9).all())
+                  and (previous or {}).get('filled', True))
+        misc.file_dump_json_atomic(self._ohlcv_meta_filename(pair, timeframe), {
+            'timeframe': timeframe,
+            'sorted': is_sorted,
+            'filled': filled,
+            'identity': self.ohlcv_data_identity(pair, timeframe),
+        })
+
+    def _ohlcv_purge_meta(self, pair: str, timeframe: str) -> None:
+        self._ohlcv_meta_filename(pair, timeframe).unlink(missing_ok=True)
+
+    @staticmethod
+    def _ohlcv_new_candles(data: DataFrame, last_date: Optional[datetime]
+                           ) -> Tuple[DataFrame, bool]:
+        """
+        Select the candles to append after the stored candles.
+        :param data: Candles to append, sorted by date
+        :param last_date: Date of the last stored candle, None if nothing is stored
+        :return: Tuple of (candles to append, True if the last stored candle is replaced)
+        """
+        if last_date is None:
+            return data, False
+        data = data.loc[data['date'] >= last_date]
+        return data, bool(len(data)) and data['date'].iloc[0] == last_date
 
     @abstractclassmethod
     def trades_get_pairs(cls, datadir: Path) -> List[str]:
@@ -97,30 +300,42 @@ class IDataHandler(ABC):
         """
 
     @abstractmethod
-    def trades_store(self, pair: str, data: TradeList) -> None:
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
         """
         Store trades data (list of Dicts) to file
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
 
     @abstractmethod
-    def trades_append(self, pair: str, data: TradeList):
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
         """
         Append data to existing files
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
 
     @abstractmethod
-    def _trades_load(self, pair: str, timerange):  # Optional[TimeRange] = None) -> TradeList:
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
         """
         Load a pair from file, either .json.gz or .json
         :param pair: Load trades for this pair
-        :param timerange: Timerange to load trades for - currently not implemented
-        :return: List of trades
+        :param timerange: Timerange to load trades for. Only trades within the timerange
+                          are returned - implementations avoid reading other trades
+                          where possible.
+        :return: TradeBatch of trades
+        """
+
+    @abstractmethod
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        Reads from the end of the stored data, so the cost does not grow with its size.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
         """
 
     @abstractmethod
@@ -131,20 +346,45 @@ class IDataHandler(ABC):
         :return: True when deleted, false if file did not exist.
         """
 
-    def trades_load(self, pair: str, timerange): #: Optional[TimeRange] = None) -> TradeList:
+    def trades_data_size(self, pair: str) -> int:
+        """
+        Size of the stored trades for this pair.
+        :param pair: Pair to check
+        :return: File size in bytes, 0 if no trades are stored
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        return filename.stat().st_size if filename.exists() else 0
+
+    def trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
         """
         Load a pair from file, either .json.gz or .json
         Removes duplicates in the process.
         :param pair: Load trades for this pair
-        :param timerange: Timerange to load trades for - currently not implemented
-        :return: List of trades
+        :param timerange: Timerange to load trades for
+        :return: TradeBatch of trades
         """
         #return trades_remove_duplicates(self._trades_load(pair, timerange=timerange))
         return self._trades_load(pair, timerange=timerange)
 
 
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks.
+        Subclasses override this to avoid loading all trades at once - the default
+        implementation loads everything and splits it.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        trades = self.trades_load(pair, timerange=timerange)
+        for start in range(0, len(trades), chunksize):
+            yield trades[start:start + chunksize]
+
     def ohlcv_load(self, pair, timeframe: str,
-                   timerange,  #: Optional[TimeRange] = None,
+                   timerange: Optional[TimeRange] = None,
                    fill_missing: bool = True,
                    drop_incomplete: bool = True,
                    startup_candles: int = 0,
@@ -162,19 +402,55 @@ class IDataHandler(ABC):
         :param warn_no_data: Log a warning message when no data is found
         :return: DataFrame with ohlcv data, or empty DataFrame
         """
+        cache = _ohlcv_cache
+        if cache is None:
+            return self._ohlcv_load_clean(pair, timeframe, timerange, fill_missing,
+                                          drop_incomplete, startup_candles, warn_no_data)
+
+        identity = self.ohlcv_data_identity(pair, timeframe)
+        key = (type(self), str(self._datadir), pair, timeframe, identity,
+               (timerange.starttype, timerange.startts, timerange.stoptype, timerange.stopts)
+               if timerange else None,
+               fill_missing, drop_incomplete, startup_candles)
+        pairdf = cache.get(key) if identity else None
+        if pairdf is None:
+            pairdf = self._ohlcv_load_clean(pair, timeframe, timerange, fill_missing,
+                                            drop_incomplete, startup_candles, warn_no_data)
+            if identity and not pairdf.empty:
+                cache.put(key, pairdf)
+        return pairdf
+
+    def _ohlcv_load_clean(self, pair, timeframe: str, timerange: Optional[TimeRange],
+                          fill_missing: bool, drop_incomplete: bool, startup_candles: int,
+                          warn_no_data: bool) -> DataFrame:
+        """
+        Load ohlcv data from disk, trim and clean it - see ohlcv_load()
+        """
         # Fix startup period
         timerange_startup = deepcopy(timerange)
         if startup_candles > 0 and timerange_startup:
             timerange_startup.subtract_start(timeframe_to_seconds(timeframe) * startup_candles)
 
-        pairdf = self._ohlcv_load(pair, timeframe, timerange=timerange_startup)
+        # Datahandlers only read the data within the timerange - the end of the timerange
+        # is included (as in trim_dataframe), candle dates are whole seconds.
+        timerange_load = deepcopy(timerange_startup)
+        if timerange_load and timerange_load.stoptype == 'date':
+            timerange_load.stopts += 1
+
+        meta = self.ohlcv_data_meta(pair, timeframe)
+        pairdf = self._ohlcv_load(pair, timeframe, timerange=timerange_load)
         if self._check_empty_df(pairdf, pair, timeframe, warn_no_data):
             return pairdf
         else:
             enddate = pairdf.iloc[-1]['date']
+            if timerange_load and timerange_load.stoptype == 'date':
+                # Data after the timerange was not loaded, take the end of the stored data
+                min_max = self.ohlcv_data_min_max(pair, timeframe)
+                if min_max:
+                    enddate = min_max[1]
 
             if timerange_startup:
-                self._validate_pairdata(pair, pairdf, timerange_startup)
+                self._validate_pairdata(pair, pairdf, timerange_startup, enddate)
                 pairdf = trim_dataframe(pairdf, timerange_startup)
                 if self._check_empty_df(pairdf, pair, timeframe, warn_no_data):
                     return pairdf
@@ -184,7 +460,9 @@ class IDataHandler(ABC):
                                            pair=pair,
                                            fill_missing=fill_missing,
                                            drop_incomplete=(drop_incomplete and
-                                                            enddate == pairdf.iloc[-1]['date']))
+                                                            enddate == pairdf.iloc[-1]['date']),
+                                           validated=bool(meta and meta['sorted']),
+                                           filled=bool(meta and meta['filled']))
             self._check_empty_df(pairdf, pair, timeframe, warn_no_data)
             return pairdf
 
@@ -201,11 +479,13 @@ class IDataHandler(ABC):
             return True
         return False
 
-    def _validate_pairdata(self, pair, pairdata: DataFrame, timerange): #TimeRange):
+    def _validate_pairdata(self, pair, pairdata: DataFrame, timerange: TimeRange,
+                           enddate: datetime):
         """
         Validates pairdata for missing data at start end end and logs warnings.
         :param pairdata: Dataframe to validate
         :param timerange: Timerange specified for start and end dates
+        :param enddate: Date of the last stored candle
         """
 
         if timerange.starttype == 'date':
@@ -215,9 +495,9 @@ class IDataHandler(ABC):
                                f"data starts at {pairdata.iloc[0]['date']:%Y-%m-%d %H:%M:%S}")
         if timerange.stoptype == 'date':
             stop = datetime.fromtimestamp(timerange.stopts, tz=timezone.utc)
-            if pairdata.iloc[-1]['date'] < stop:
+            if enddate < stop:
                 logger.warning(f"Missing data at end for pair {pair}, "
-                               f"data ends at {pairdata.iloc[-1]['date']:%Y-%m-%d %H:%M:%S}")
+                               f"data ends at {enddate:%Y-%m-%d %H:%M:%S}")
 
 
 def get_datahandlerclass(datatype: str) -> Type[IDataHandler]:
@@ -229,7 +509,12 @@ def get_datahandlerclass(datatype: str) -> Type[IDataHandler]:
     :return: Datahandler class
     """
 
-    if datatype == 'json':
+    if ':' in datatype:
+        # Segmented trades storage, e.g. 'csv:day'
+        from .segmenteddatahandler import get_segmented_datahandlerclass
+        base_datatype, period = datatype.split(':', 1)
+        return get_segmented_datahandlerclass(get_datahandlerclass(base_datatype), period)
+    elif datatype == 'json':
         from .jsondatahandler import JsonDataHandler
         return JsonDataHandler
     elif datatype == 'jsongz':
@@ -238,6 +523,12 @@ def get_datahandlerclass(datatype: str) -> Type[IDataHandler]:
     elif datatype == 'hdf5':
         from .hdf5datahandler import HDF5DataHandler
         return HDF5DataHandler
+    elif datatype == 'parquet':
+        from .parquetdatahandler import ParquetDataHandler
+        return ParquetDataHandler
+    elif datatype == 'npy':
+        from .npydatahandler import NpyDataHandler
+        return NpyDataHandler
     if datatype == 'csv':
         from .csvdatahandler import CSVDataHandler
         return CSVDataHandler
@@ -1,21 +1,32 @@
+import gzip
+import io
 import logging
 import re
+import zlib
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import IO, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
-from pandas import DataFrame, read_json, to_datetime
+import rapidjson
+from pandas import DataFrame, concat, read_json, to_datetime
 
-from freqtrade import misc
-from freqtrade.configuration import TimeRange
-from freqtrade.constants import DEFAULT_DATAFRAME_COLUMNS, ListPairsWithTimeframes, TradeList
-from freqtrade.data.converter import trades_dict_to_list
+import misc
+from constants import DEFAULT_DATAFRAME_COLUMNS, ListPairsWithTimeframes, TradeList
+from data.tradebatch import TradeBatch
+from timerange import TimeRange
 
 from .idatahandler import IDataHandler
 
 
 logger = logging.getLogger(__name__)
 
+# Last gzip member of a .json.gz trades file, holding only the closing bracket.
+# Appending replaces it by a member with the new trades, followed by this one again.
+_GZIP_CLOSING_BRACKET = gzip.compress(b']', mtime=0)
+# Start of every gzip member (magic bytes and deflate method)
+_GZIP_MAGIC = b'\x1f\x8b\x08'
+
 
 class JsonDataHandler(IDataHandler):
 
@@ -68,6 +79,7 @@ class JsonDataHandler(IDataHandler):
         _data.reset_index(drop=True).loc[:, self._columns].to_json(
             filename, orient="values",
             compression='gzip' if self._use_zip else None)
+        self._ohlcv_store_meta(pair, timeframe, data)
 
     # TODO: copio da qui una nuova classe per  gestire l'input CSV
     def _ohlcv_load(self, pair: str, timeframe: str,
@@ -80,15 +92,20 @@ class JsonDataHandler(IDataHandler):
         :param pair: Pair to load data
         :param timeframe: Timeframe (e.g. "5m")
         :param timerange: Limit data to be loaded to this timerange.
-                        Optionally implemented by subclasses to avoid loading
-                        all data where possible.
+                        Only the candles within the timerange are parsed (plain json only).
         :return: DataFrame with ohlcv data, or empty DataFrame
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
         if not filename.exists():
             return DataFrame(columns=self._columns)
         try:
-            pairdata = read_json(filename, orient='values')
+            if timerange and not self._use_zip:
+                pairdata = read_json(io.StringIO(
+                    self._read_timerange(filename, timerange).decode()), orient='values')
+            else:
+                pairdata = read_json(filename, orient='values')
+            if pairdata.empty:
+                return DataFrame(columns=self._columns)
             pairdata.columns = self._columns
         except ValueError:
             logger.error(f"Could not load data for {pair}.")
@@ -109,6 +126,7 @@ class JsonDataHandler(IDataHandler):
         :return: True when deleted, false if file did not exist.
         """
         filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        self._ohlcv_purge_meta(pair, timeframe)
         if filename.exists():
             filename.unlink()
             return True
@@ -116,12 +134,115 @@ class JsonDataHandler(IDataHandler):
 
     def ohlcv_append(self, pair: str, timeframe: str, data: DataFrame) -> None:
         """
-        Append data to existing data structures
+        Append data to existing data structures.
+        Plain json files are extended in place: only the last candle is read, and the
+        file is truncated before the closing bracket (or before the last candle, if
+        the first new candle has the same date).
+        Gzipped files can't be edited in place and are rewritten.
         :param pair: Pair
         :param timeframe: Timeframe this ohlcv data is for
-        :param data: Data to append.
+        :param data: Data to append, sorted by date.
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if self._use_zip or not filename.exists():
+            stored = self._ohlcv_load(pair, timeframe, timerange=None)
+            data, replace_last = self._ohlcv_new_candles(
+                data, stored['date'].iloc[-1] if not stored.empty else None)
+            if replace_last:
+                stored = stored.iloc[:-1]
+            return self.ohlcv_store(pair, timeframe, concat([stored, data]))
+
+        last_candle = self._read_last_candle(filename)
+        last_date = to_datetime(last_candle[0][0], unit='ms', utc=True) if last_candle else None
+        data, replace_last = self._ohlcv_new_candles(data, last_date)
+        if data.empty:
+            return
+        meta = self.ohlcv_data_meta(pair, timeframe)
+        _data = data.loc[:, self._columns].reset_index(drop=True)
+        # Convert date to int
+        _data['date'] = _data['date'].astype(np.int64) // 1000 // 1000
+        candles = _data.to_json(orient="values")[1:]
+
+        with open(filename, 'r+b') as fp:
+            if replace_last:
+                fp.seek(last_candle[1])
+            elif last_candle:
+                # Overwrite the closing bracket
+                fp.seek(last_candle[2])
+                candles = ',' + candles
+            else:
+                fp.seek(0)
+                candles = '[' + candles
+            fp.write(candles.encode())
+            fp.truncate()
+        self._ohlcv_store_meta(pair, timeframe, data, meta, last_date, replace_last)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Date of the first and of the last stored candle.
+        Plain json files are only read at the start and at the end.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
         """
-        raise NotImplementedError()
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if self._use_zip or not filename.exists():
+            return super().ohlcv_data_min_max(pair, timeframe)
+        last_candle = self._read_last_candle(filename)
+        if not last_candle:
+            return None
+        with open(filename, 'rb') as fp:
+            head = fp.read(1024)
+        first_date = int(head[head.index(b'[', 1) + 1:].split(b',', 1)[0])
+        return tuple(to_datetime(date, unit='ms', utc=True).to_pydatetime()
+                     for date in (first_date, last_candle[0][0]))
+
+    @staticmethod
+    def _read_timerange(filename: Path, timerange: TimeRange) -> bytes:
+        """
+        Read the rows of a plain json file ([[<date>, ...], ...]) within the timerange.
+        Rows are sorted by date, so they're located with a binary search on the first
+        value of each row.
+        :return: json list of the rows within the timerange
+        :raises: ValueError if the file is not in this format
+        """
+        with open(filename, 'rb') as fp:
+            head = fp.read(2)
+            if head != b'[[':
+                if (head + fp.read()).strip() in (b'', b'[]'):
+                    return b'[]'
+                raise ValueError(f"Unexpected format of {filename}")
+            data, offset = misc.file_read_tail(filename, b']', 1)
+            # Offset of the closing bracket of the list
+            end = offset + data.rstrip().rfind(b']')
+            start = 2
+            if timerange.starttype == 'date':
+                start = misc.file_bisect(fp, timerange.startts * 1000, _row_date, b',[',
+                                         start, end)
+            if timerange.stoptype == 'date':
+                end = misc.file_bisect(fp, timerange.stopts * 1000, _row_date, b',[',
+                                       start, end)
+            fp.seek(start)
+            data = fp.read(end - start)
+        if not data:
+            return b'[]'
+        # Rows end with the separator before the next row, if end is not the closing bracket
+        return b'[[' + (data[:-2] if data.endswith(b',[') else data) + b']'
+
+    @staticmethod
+    def _read_last_candle(filename: Path) -> Optional[Tuple[list, int, int]]:
+        """
+        Read the last candle of a plain json file ([[<date>, ...], ...]).
+        :return: Tuple of (last candle, offset of the candle, offset of the closing bracket),
+                 None if the file holds no candles
+        """
+        data, offset = misc.file_read_tail(filename, b'[', 2)
+        start = data.rfind(b'[')
+        end = data.rfind(b']')
+        if start <= 0 and offset == 0:
+            return None
+        return misc.json_load(io.BytesIO(data[start:end])), offset + start, offset + end
 
     @classmethod
     def trades_get_pairs(cls, datadir: Path) -> List[str]:
@@ -135,45 +256,247 @@ class JsonDataHandler(IDataHandler):
         # Check if regex found something and only return these results to avoid exceptions.
         return [match[0].replace('_', '/') for match in _tmp if match]
 
-    def trades_store(self, pair: str, data: TradeList) -> None:
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
         """
         Store trades data (list of Dicts) to file
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
         filename = self._pair_trades_filename(self._datadir, pair)
-        misc.file_dump_json(filename, data, is_zip=self._use_zip)
+        if isinstance(data, TradeBatch):
+            data = data.to_list()
+        if not self._use_zip or not data:
+            return misc.file_dump_json(filename, data, is_zip=self._use_zip)
 
-    def trades_append(self, pair: str, data: TradeList):
+        # Opening bracket and trades in one member, the closing bracket in another one,
+        # so trades_append() can add members in between
+        logger.info(f'dumping json to "{filename}"')
+        with open(filename, 'wb') as fp:
+            fp.write(gzip.compress(b'[' + self._trades_json_rows(data)))
+            fp.write(_GZIP_CLOSING_BRACKET)
+
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
         """
-        Append data to existing files
+        Append data to existing files, without reading the stored trades:
+        * plain json files are truncated before the closing bracket and extended
+        * gzipped files get a new gzip member with the trades, replacing the last member
+          which holds the closing bracket
+        Files in another layout (old dict format, gzipped files written as one member)
+        are loaded and rewritten once.
         :param pair: Pair - used for filename
-        :param data: List of Lists containing trade data,
+        :param data: TradeBatch, or List of Lists containing trade data,
                      column sequence as in DEFAULT_TRADES_COLUMNS
         """
-        raise NotImplementedError()
+        trades = TradeBatch.from_trades(data)
+        if not len(trades):
+            return
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if not filename.is_file():
+            return self.trades_store(pair, trades)
+
+        rows = b',' + self._trades_json_rows(trades.to_list())
+        if self._use_zip:
+            size = filename.stat().st_size
+            offset = size - len(_GZIP_CLOSING_BRACKET)
+            with open(filename, 'r+b') as fp:
+                fp.seek(max(offset, 0))
+                if offset > 0 and fp.read() == _GZIP_CLOSING_BRACKET:
+                    fp.seek(offset)
+                    fp.write(gzip.compress(rows) + _GZIP_CLOSING_BRACKET)
+                    return
+        else:
+            with open(filename, 'rb') as fp:
+                head = fp.read(2)
+            if head == b'[[':
+                tail, offset = misc.file_read_tail(filename, b']', 1)
+                with open(filename, 'r+b') as fp:
+                    # Overwrite the closing bracket
+                    fp.seek(offset + tail.rstrip().rfind(b']'))
+                    fp.write(rows + b']')
+                    fp.truncate()
+                return
+
+        stored = self._trades_load(pair)
+        self.trades_store(pair, TradeBatch.concat([stored, trades]))
+
+    @staticmethod
+    def _trades_json_rows(data: TradeList) -> bytes:
+        """
+        Trades as json, without the enclosing brackets of the list
+        """
+        return rapidjson.dumps(data, default=str, number_mode=rapidjson.NM_NATIVE).encode()[1:-1]
 
-    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeList:
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
         """
         Load a pair from file, either .json.gz or .json
-        # TODO: respect timerange ...
         :param pair: Load trades for this pair
-        :param timerange: Timerange to load trades for - currently not implemented
-        :return: List of trades
+        :param timerange: Timerange to load trades for - only the trades within the
+                          timerange are parsed (plain json only)
+        :return: TradeBatch of trades
         """
         filename = self._pair_trades_filename(self._datadir, pair)
+        if timerange and not self._use_zip and filename.is_file():
+            try:
+                return TradeBatch.from_list(
+                    misc.json_load(io.BytesIO(self._read_timerange(filename, timerange))))
+            except ValueError:
+                # Old (dict) format - load everything
+                pass
         tradesdata = misc.file_load_json(filename)
 
         if not tradesdata:
-            return []
+            return TradeBatch.empty()
 
         if isinstance(tradesdata[0], dict):
             # Convert trades dict to list
             logger.info("Old trades format detected - converting")
-            tradesdata = trades_dict_to_list(tradesdata)
-            pass
-        return tradesdata
+            return TradeBatch.from_dicts(tradesdata).filter_timerange(timerange)
+        return TradeBatch.from_list(tradesdata).filter_timerange(timerange)
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks, parsing the file incrementally.
+        Plain json files are read from the first trade within the timerange.
+        Files in the old (dict) format are loaded completely.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if not filename.is_file():
+            return
+        with (gzip.open if self._use_zip else open)(filename, 'rb') as fp:
+            if fp.read(2) == b'[[':
+                if timerange and timerange.starttype == 'date' and not self._use_zip:
+                    tail, offset = misc.file_read_tail(filename, b']', 1)
+                    end = offset + tail.rstrip().rfind(b']')
+                    fp.seek(misc.file_bisect(fp, timerange.startts * 1000, _row_date, b',[',
+                                             2, end))
+                yield from self._read_trade_chunks(fp, chunksize, timerange)
+                return
+        # Empty or old (dict) format
+        yield from super().trades_load_chunks(pair, chunksize, timerange)
+
+    @staticmethod
+    def _read_trade_chunks(fp: IO, chunksize: int, timerange: Optional[TimeRange],
+                           block_size: int = 1024 * 1024) -> Iterator[TradeBatch]:
+        """
+        Parse trades ([[<timestamp>, ...], ...]) one block at a time.
+        At most one block and one chunk of trades are held in memory.
+        :param fp: File positioned at the start of a trade, after its opening bracket
+        """
+        stop = timerange.stopts * 1000 if timerange and timerange.stoptype == 'date' else None
+        pending: List[TradeBatch] = []
+        count = 0
+        data = b''
+        done = False
+        while not done:
+            block = fp.read(block_size)
+            data += block
+            if block:
+                # Complete trades only - the last one may continue in the next block
+                cut = data.rfind(b'],[')
+                if cut < 0:
+                    continue
+                rows, data = data[:cut + 1], data[cut + 3:]
+            else:
+                # Up to the closing bracket of the list
+                rows, done = data.rstrip()[:-1], True
+            if not rows:
+                continue
+            trades = TradeBatch.from_list(misc.json_load(io.BytesIO(b'[[' + rows + b']')))
+            # Trades are sorted - nothing within the timerange after the stop
+            done = done or (stop is not None and trades.timestamp[-1] >= stop)
+            trades = trades.filter_timerange(timerange)
+            if trades:
+                pending.append(trades)
+                count += len(trades)
+            while count >= chunksize or (done and count):
+                trades = TradeBatch.concat(pending)
+                yield trades[:chunksize]
+                pending = [trades[chunksize:]]
+                count = len(pending[0])
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        Plain json files are scanned backwards from the end. Of gzipped files, only the
+        last gzip members (one per append) are decompressed - files written as a single
+        member are loaded completely.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if self._use_zip and filename.is_file() and n > 0:
+            trades = self._gzip_trades_tail(filename, n)
+            if trades is not None:
+                return trades
+        if self._use_zip or not filename.is_file():
+            return self._trades_load(pair)[-n:] if n > 0 else TradeBatch.empty()
+
+        # Trades are stored as [[...],[...]] - every trade starts with "["
+        data, offset = misc.file_read_tail(filename, b'[', n + 1)
+        start = len(data)
+        for _ in range(n):
+            start = data.rfind(b'[', 0, start)
+            if start < 0:
+                break
+        if start > 0 or (start == 0 and offset > 0):
+            try:
+                return TradeBatch.from_list(misc.json_load(io.BytesIO(b'[' + data[start:])))
+            except ValueError:
+                pass
+        # Small file or old (dict) format
+        return self._trades_load(pair)[-n:] if n > 0 else TradeBatch.empty()
+
+    @staticmethod
+    def _gzip_trades_tail(filename: Path, n: int,
+                          block_size: int = 1024 * 1024) -> Optional[TradeBatch]:
+        """
+        Decode the gzip members of a .json.gz trades file from the end, until they hold
+        n trades. Members are located by their magic bytes, and only accepted if they
+        decompress completely up to the next member.
+        :return: TradeBatch of the last n trades, None if the file isn't split in members
+        """
+        end = filename.stat().st_size - len(_GZIP_CLOSING_BRACKET)
+        batches: List[TradeBatch] = []
+        count = 0
+        with open(filename, 'rb') as fp:
+            fp.seek(max(end, 0))
+            if end <= 0 or fp.read() != _GZIP_CLOSING_BRACKET:
+                return None
+            # File contents from offset up to the start of the last decoded member
+            offset, data = end, b''
+            while count < n:
+                pos, rows = len(data), None
+                while rows is None:
+                    pos = data.rfind(_GZIP_MAGIC, 0, pos)
+                    if pos < 0:
+                        break
+                    rows = _gzip_member(data[pos:])
+                    if rows is not None and rows[:1] not in (b'[', b','):
+                        rows = None
+                if rows is None:
+                    if offset == 0:
+                        return None
+                    start = max(0, offset - max(block_size, len(data)))
+                    fp.seek(start)
+                    data = fp.read(offset - start) + data
+                    offset = start
+                    continue
+                trades = TradeBatch.from_list(misc.json_load(io.BytesIO(b'[' + rows[1:] + b']')))
+                batches.append(trades)
+                count += len(trades)
+                if rows[:1] == b'[':
+                    # First member of the file
+                    break
+                data = data[:pos]
+        return TradeBatch.concat(reversed(batches))[-n:]
 
     def trades_purge(self, pair: str) -> bool:
         """
@@ -204,6 +527,28 @@ class JsonDataHandler(IDataHandler):
         return filename
 
 
+def _row_date(data: bytes) -> int:
+    """
+    Date of a row of a json file ([<date>, ...]), from the bytes after its opening bracket
+    """
+    return int(data.split(b',', 1)[0])
+
+
+def _gzip_member(data: bytes) -> Optional[bytes]:
+    """
+    Decompress data consisting of exactly one gzip member
+    :return: Decompressed content, None if data is not a single complete gzip member
+    """
+    decompressor = zlib.decompressobj(wbits=31)
+    try:
+        content = decompressor.decompress(data)
+    except zlib.error:
+        return None
+    if not decompressor.eof or decompressor.unused_data:
+        return None
+    return content
+
+
 class JsonGzDataHandler(JsonDataHandler):
 
     _use_zip = True
@@ -0,0 +1,412 @@
+import io
+import logging
+import os
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+import misc
+from constants import (DEFAULT_DATAFRAME_COLUMNS, DEFAULT_TRADES_COLUMNS,
+                       ListPairsWithTimeframes, TradeList)
+from data.tradebatch import CATEGORICAL_COLUMNS, TradeBatch
+from timerange import TimeRange
+
+from .idatahandler import IDataHandler
+
+
+logger = logging.getLogger(__name__)
+
+_HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0,
+                   (2, 0): np.lib.format.read_array_header_2_0}
+_HEADER_WRITERS = {(1, 0): np.lib.format.write_array_header_1_0,
+                   (2, 0): np.lib.format.write_array_header_2_0}
+
+
+class NpyDataHandler(IDataHandler):
+    """
+    Column store of raw NumPy arrays: one directory per pair / timeframe, holding one
+    `.npy` file per column.
+    Loading memory-maps the files, so OHLCV dataframes are built without parsing or
+    copying - only the pages actually used are read. The mapping is copy-on-write,
+    changes to loaded data are never written back to disk.
+    Dates are stored as int64 ns, so they can be viewed as datetime64 without conversion.
+    Appending writes the new rows at the end of each file and updates the .npy header.
+    """
+
+    _columns = DEFAULT_DATAFRAME_COLUMNS
+    _load_in_processes = False
+    _mmap_mode = 'c'
+    _ohlcv_dtypes = {'date': np.int64, **{col: np.float64
+                                          for col in DEFAULT_DATAFRAME_COLUMNS[1:]}}
+    # Strings are stored as bytes, with the width of the longest value (None is stored as b'')
+    _trades_dtypes = {'timestamp': np.int64, 'id': np.bytes_, 'type': np.bytes_,
+                      'side': np.bytes_, 'price': np.float64, 'amount': np.float64,
+                      'cost': np.float64}
+
+    @classmethod
+    def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
+        """
+        Returns a list of all pairs with ohlcv data available in this datadir
+        :param datadir: Directory to search for ohlcv files
+        :return: List of Tuples of (pair, timeframe)
+        """
+        _tmp = [re.search(r'^([a-zA-Z_]+)\-(\d+\S+)(?=.npy)', p.name)
+                for p in datadir.glob("*.npy")]
+        return [(match[1].replace('_', '/'), match[2]) for match in _tmp
+                if match and len(match.groups()) > 1]
+
+    @classmethod
+    def ohlcv_get_pairs(cls, datadir: Path, timeframe: str) -> List[str]:
+        """
+        Returns a list of all pairs with ohlcv data available in this datadir
+        for the specified timeframe
+        :param datadir: Directory to search for ohlcv files
+        :param timeframe: Timeframe to search pairs for
+        :return: List of Pairs
+        """
+
+        _tmp = [re.search(r'^(\S+)(?=\-' + timeframe + '.npy)', p.name)
+                for p in datadir.glob(f"*{timeframe}.npy")]
+        # Check if regex found something and only return these results
+        return [match[0].replace('_', '/') for match in _tmp if match]
+
+    def ohlcv_store(self, pair: str, timeframe: str, data: pd.DataFrame) -> None:
+        """
+        Store data as one .npy file per column.
+        :param pair: Pair - used to generate filename
+        :timeframe: Timeframe - used to generate filename
+        :data: Dataframe containing OHLCV data
+        :return: None
+        """
+        dirname = self._pair_data_filename(self._datadir, pair, timeframe)
+        self._store_columns(dirname, self._ohlcv_to_columns(data))
+        self._ohlcv_store_meta(pair, timeframe, data)
+
+    def _ohlcv_load(self, pair: str, timeframe: str,
+                    timerange: Optional[TimeRange] = None,
+                    ) -> pd.DataFrame:
+        """
+        Internal method used to load data for one pair from disk.
+        Implements the loading and conversion to a Pandas dataframe.
+        Timerange trimming and dataframe validation happens outside of this method.
+        :param pair: Pair to load data
+        :param timeframe: Timeframe (e.g. "5m")
+        :param timerange: Limit data to be loaded to this timerange.
+                        The rows are located with a binary search on the dates.
+        :return: DataFrame with ohlcv data, or empty DataFrame
+        """
+        dirname = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not dirname.exists():
+            return pd.DataFrame(columns=self._columns)
+
+        columns = self._load_columns(dirname, self._columns)
+        rows = self._timerange_slice(columns['date'], timerange, 10 ** 9)
+        dates = pd.arrays.DatetimeArray(columns['date'][rows].view('datetime64[ns]'),
+                                        dtype=pd.DatetimeTZDtype(tz='UTC'))
+        return pd.DataFrame({'date': dates,
+                             **{col: columns[col][rows] for col in self._columns[1:]}},
+                            copy=False)
+
+    def ohlcv_purge(self, pair: str, timeframe: str) -> bool:
+        """
+        Remove data for this pair
+        :param pair: Delete data for this pair.
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: True when deleted, false if file did not exist.
+        """
+        dirname = self._pair_data_filename(self._datadir, pair, timeframe)
+        self._ohlcv_purge_meta(pair, timeframe)
+        if dirname.exists():
+            shutil.rmtree(dirname)
+            return True
+        return False
+
+    def ohlcv_append(self, pair: str, timeframe: str, data: pd.DataFrame) -> None:
+        """
+        Append data to existing data structures.
+        The new rows are written in place at the end of each column file - if the first
+        new candle has the same date as the last stored one, it overwrites it.
+        :param pair: Pair
+        :param timeframe: Timeframe this ohlcv data is for
+        :param data: Data to append, sorted by date.
+        """
+        dirname = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not dirname.exists():
+            self.ohlcv_store(pair, timeframe, data)
+            return
+
+        dates = self._load_columns(dirname, ['date'])['date']
+        last_date = pd.Timestamp(dates[-1], tz='UTC') if len(dates) else None
+        data, replace_last = self._ohlcv_new_candles(data, last_date)
+        if data.empty:
+            return
+        meta = self.ohlcv_data_meta(pair, timeframe)
+        self._append_columns(dirname, self._ohlcv_to_columns(data),
+                             len(dates) - 1 if replace_last else len(dates))
+        self._ohlcv_store_meta(pair, timeframe, data, meta, last_date, replace_last)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Date of the first and of the last stored candle.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
+        """
+        dirname = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not dirname.exists():
+            return None
+        dates = self._load_columns(dirname, ['date'])['date']
+        if not len(dates):
+            return None
+        return (pd.Timestamp(dates[0], tz='UTC').to_pydatetime(),
+                pd.Timestamp(dates[-1], tz='UTC').to_pydatetime())
+
+    @classmethod
+    def trades_get_pairs(cls, datadir: Path) -> List[str]:
+        """
+        Returns a list of all pairs for which trade data is available in this
+        :param datadir: Directory to search for ohlcv files
+        :return: List of Pairs
+        """
+        _tmp = [re.search(r'^(\S+)(?=\-trades.npy)', p.name)
+                for p in datadir.glob("*trades.npy")]
+        # Check if regex found something and only return these results to avoid exceptions.
+        return [match[0].replace('_', '/') for match in _tmp if match]
+
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
+        """
+        Store trades data (list of Dicts) as one .npy file per column
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        self._store_columns(dirname, self._trades_to_columns(data))
+
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
+        """
+        Append data to existing files, in place at the end of each column file.
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        if not data:
+            return
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if not dirname.exists():
+            self.trades_store(pair, data)
+            return
+        rows = len(self._load_columns(dirname, ['timestamp'])['timestamp'])
+        self._append_columns(dirname, self._trades_to_columns(data), rows)
+
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
+        """
+        Load a pair from the .npy files.
+        :param pair: Load trades for this pair
+        :param timerange: Timerange to load trades for.
+                          The rows are located with a binary search on the timestamps.
+        :return: TradeBatch of trades
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if not dirname.exists():
+            return TradeBatch.empty()
+        columns = self._load_columns(dirname, DEFAULT_TRADES_COLUMNS)
+        return self._columns_to_trades(
+            columns, self._timerange_slice(columns['timestamp'], timerange, 1000))
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks.
+        Only the rows of the chunk being returned are read from the memory-mapped files.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if not dirname.exists():
+            return
+        columns = self._load_columns(dirname, DEFAULT_TRADES_COLUMNS)
+        rows = self._timerange_slice(columns['timestamp'], timerange, 1000)
+        for start in range(rows.start, rows.stop, chunksize):
+            yield self._columns_to_trades(columns, slice(start, min(start + chunksize,
+                                                                    rows.stop)))
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if n <= 0 or not dirname.exists():
+            return TradeBatch.empty()
+        columns = self._load_columns(dirname, DEFAULT_TRADES_COLUMNS)
+        rows = len(columns['timestamp'])
+        return self._columns_to_trades(columns, slice(max(rows - n, 0), rows))
+
+    def trades_purge(self, pair: str) -> bool:
+        """
+        Remove data for this pair
+        :param pair: Delete data for this pair.
+        :return: True when deleted, false if file did not exist.
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if dirname.exists():
+            shutil.rmtree(dirname)
+            return True
+        return False
+
+    def trades_data_size(self, pair: str) -> int:
+        """
+        Size of the stored trades for this pair.
+        :param pair: Pair to check
+        :return: Size in bytes of all column files, 0 if no trades are stored
+        """
+        dirname = self._pair_trades_filename(self._datadir, pair)
+        if not dirname.exists():
+            return 0
+        return sum(f.stat().st_size for f in dirname.glob('*.npy'))
+
+    @classmethod
+    def _ohlcv_to_columns(cls, data: pd.DataFrame) -> Dict[str, np.ndarray]:
+        columns = {col: data[col].to_numpy(dtype=dtype)
+                   for col, dtype in cls._ohlcv_dtypes.items() if col != 'date'}
+        # datetime64[ns] -> int64 ns
+        columns['date'] = data['date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        return columns
+
+    @classmethod
+    def _trades_to_columns(cls, data: Union[TradeBatch, TradeList]) -> Dict[str, np.ndarray]:
+        batch = TradeBatch.from_trades(data)
+        columns = {}
+        for col, dtype in cls._trades_dtypes.items():
+            values = batch.columns[col]
+            if col in CATEGORICAL_COLUMNS:
+                # codes -> bytes, -1 (None) -> b''
+                categories = [c.encode() for c in batch.categories[col]]
+                values = np.array(categories + [b''], dtype=dtype)[values]
+            elif values.dtype.kind == 'U':
+                values = np.char.encode(values, 'utf-8')
+            columns[col] = values.astype(dtype, copy=False)
+        return columns
+
+    @classmethod
+    def _columns_to_trades(cls, columns: Dict[str, np.ndarray], rows: slice) -> TradeBatch:
+        return TradeBatch.from_columns(*(columns[col][rows] for col in DEFAULT_TRADES_COLUMNS))
+
+    @staticmethod
+    def _timerange_slice(times: np.ndarray, timerange: Optional[TimeRange],
+                         factor: int) -> slice:
+        """
+        Rows of the (sorted) times within the timerange
+        :param factor: Multiplier from timerange seconds to the stored unit
+        """
+        start, stop = 0, len(times)
+        if timerange:
+            if timerange.starttype == 'date':
+                start = int(np.searchsorted(times, timerange.startts * factor, side='left'))
+            if timerange.stoptype == 'date':
+                stop = int(np.searchsorted(times, timerange.stopts * factor, side='left'))
+        return slice(start, max(start, stop))
+
+    def _load_columns(self, dirname: Path, columns: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Memory-map the column files of dirname.
+        Columns are cut to the same length, in case an append was interrupted.
+        """
+        arrays = {col: np.load(dirname / f'{col}.npy', mmap_mode=self._mmap_mode)
+                  for col in columns}
+        rows = min(len(array) for array in arrays.values())
+        if any(len(array) != rows for array in arrays.values()):
+            logger.warning(f"Columns in {dirname} have different lengths, "
+                           f"using the first {rows} rows.")
+            arrays = {col: array[:rows] for col, array in arrays.items()}
+        return arrays
+
+    @staticmethod
+    def _save_column(filename: Path, values: np.ndarray) -> None:
+        """
+        Write a column file next to the target and move it in place once complete.
+        """
+        tmp_filename = filename.with_name(filename.name + '.tmp')
+        with tmp_filename.open('wb') as f:
+            np.save(f, values)
+        os.replace(tmp_filename, filename)
+
+    def _store_columns(self, dirname: Path, columns: Dict[str, np.ndarray]) -> None:
+        dirname.mkdir(parents=True, exist_ok=True)
+        for col, values in columns.items():
+            self._save_column(dirname / f'{col}.npy', values)
+
+    def _append_columns(self, dirname: Path, columns: Dict[str, np.ndarray],
+                        start_row: int) -> None:
+        """
+        Write columns starting at row start_row of the column files.
+        Rows from start_row on are overwritten, the files are extended as needed.
+        """
+        for col, values in columns.items():
+            filename = dirname / f'{col}.npy'
+            if not self._write_rows(filename, values, start_row):
+                # The stored dtype can't hold the new values (e.g. longer strings)
+                stored = np.load(filename, mmap_mode=self._mmap_mode)[:start_row]
+                dtype = np.promote_types(stored.dtype, values.dtype)
+                self._save_column(filename, np.concatenate([stored.astype(dtype),
+                                                            values.astype(dtype)]))
+
+    @staticmethod
+    def _write_rows(filename: Path, values: np.ndarray, start_row: int) -> bool:
+        """
+        Write values from row start_row of a .npy file and update the shape in its header.
+        :return: False if the file can't be updated in place
+        """
+        with filename.open('r+b') as f:
+            version = np.lib.format.read_magic(f)
+            if version not in _HEADER_READERS:
+                return False
+            shape, fortran_order, dtype = _HEADER_READERS[version](f)
+            offset = f.tell()
+            if values.dtype.kind == 'S' and dtype.kind == 'S':
+                if values.dtype.itemsize > dtype.itemsize:
+                    return False
+                values = values.astype(dtype)
+            if values.dtype != dtype or len(shape) != 1 or start_row > shape[0]:
+                return False
+
+            header = io.BytesIO()
+            _HEADER_WRITERS[version](header, {
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': fortran_order,
+                'shape': (start_row + len(values), ),
+            })
+            if len(header.getvalue()) != offset:
+                # No room left in the header for the new shape
+                return False
+            # Data first - an interrupted write leaves the old shape in place
+            f.seek(offset + start_row * dtype.itemsize)
+            f.write(values.tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+    @classmethod
+    def _pair_data_filename(cls, datadir: Path, pair: str, timeframe: str) -> Path:
+        pair_s = misc.pair_to_filename(pair)
+        filename = datadir.joinpath(f'{pair_s}-{timeframe}.npy')
+        return filename
+
+    @classmethod
+    def _pair_trades_filename(cls, datadir: Path, pair: str) -> Path:
+        pair_s = misc.pair_to_filename(pair)
+        filename = datadir.joinpath(f'{pair_s}-trades.npy')
+        return filename
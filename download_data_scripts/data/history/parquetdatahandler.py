@@ -0,0 +1,417 @@
+import logging
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import misc
+from constants import (DEFAULT_DATAFRAME_COLUMNS, DEFAULT_TRADES_COLUMNS,
+                       ListPairsWithTimeframes, TradeList)
+from data.tradebatch import CATEGORICAL_COLUMNS, TradeBatch
+from timerange import TimeRange
+
+from .idatahandler import IDataHandler
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetDataHandler(IDataHandler):
+    """
+    Columnar storage based on Apache Parquet.
+    Timestamps are stored as int64 (ms), trade side / type are dictionary encoded.
+    Each row group holds a single time period, so loading a timerange only reads the
+    row groups overlapping it (using the min / max statistics of the time column).
+    Parquet files can't be extended in place - appending rewrites the file.
+    """
+
+    _columns = DEFAULT_DATAFRAME_COLUMNS
+    _load_in_processes = False
+    _trades_append_in_place = False
+    _compression = 'zstd'
+    # numpy datetime64 units used to split row groups
+    _ohlcv_row_group_period = 'M'
+    _trades_row_group_period = 'D'
+
+    _ohlcv_schema = pa.schema([('date', pa.int64())] +
+                              [(col, pa.float64()) for col in DEFAULT_DATAFRAME_COLUMNS[1:]])
+    _trades_schema = pa.schema([
+        ('timestamp', pa.int64()),
+        ('id', pa.string()),
+        ('type', pa.dictionary(pa.int32(), pa.string())),
+        ('side', pa.dictionary(pa.int32(), pa.string())),
+        ('price', pa.float64()),
+        ('amount', pa.float64()),
+        ('cost', pa.float64()),
+    ])
+
+    @classmethod
+    def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
+        """
+        Returns a list of all pairs with ohlcv data available in this datadir
+        :param datadir: Directory to search for ohlcv files
+        :return: List of Tuples of (pair, timeframe)
+        """
+        _tmp = [re.search(r'^([a-zA-Z_]+)\-(\d+\S+)(?=.parquet)', p.name)
+                for p in datadir.glob("*.parquet")]
+        return [(match[1].replace('_', '/'), match[2]) for match in _tmp
+                if match and len(match.groups()) > 1]
+
+    @classmethod
+    def ohlcv_get_pairs(cls, datadir: Path, timeframe: str) -> List[str]:
+        """
+        Returns a list of all pairs with ohlcv data available in this datadir
+        for the specified timeframe
+        :param datadir: Directory to search for ohlcv files
+        :param timeframe: Timeframe to search pairs for
+        :return: List of Pairs
+        """
+
+        _tmp = [re.search(r'^(\S+)(?=\-' + timeframe + '.parquet)', p.name)
+                for p in datadir.glob(f"*{timeframe}.parquet")]
+        # Check if regex found something and only return these results
+        return [match[0].replace('_', '/') for match in _tmp if match]
+
+    def ohlcv_store(self, pair: str, timeframe: str, data: pd.DataFrame) -> None:
+        """
+        Store data in parquet file.
+        :param pair: Pair - used to generate filename
+        :timeframe: Timeframe - used to generate filename
+        :data: Dataframe containing OHLCV data
+        :return: None
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        _data = data.loc[:, self._columns].reset_index(drop=True)
+        # Convert date to int (ms)
+        _data['date'] = _data['date'].astype(np.int64) // 1000 // 1000
+
+        table = pa.Table.from_pandas(_data, schema=self._ohlcv_schema, preserve_index=False)
+        self._write_table(filename, table, 'date', self._ohlcv_row_group_period)
+        self._ohlcv_store_meta(pair, timeframe, data)
+
+    def _ohlcv_load(self, pair: str, timeframe: str,
+                    timerange: Optional[TimeRange] = None,
+                    ) -> pd.DataFrame:
+        """
+        Internal method used to load data for one pair from disk.
+        Implements the loading and conversion to a Pandas dataframe.
+        Timerange trimming and dataframe validation happens outside of this method.
+        :param pair: Pair to load data
+        :param timeframe: Timeframe (e.g. "5m")
+        :param timerange: Limit data to be loaded to this timerange.
+                        Only row groups overlapping the timerange are read.
+        :return: DataFrame with ohlcv data, or empty DataFrame
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not filename.exists():
+            return pd.DataFrame(columns=self._columns)
+
+        pairdata = self._read_table(filename, 'date', timerange).to_pandas()
+        if list(pairdata.columns) != self._columns:
+            raise ValueError("Wrong dataframe format")
+        pairdata['date'] = pd.to_datetime(pairdata['date'], unit='ms', utc=True)
+        return pairdata
+
+    def ohlcv_purge(self, pair: str, timeframe: str) -> bool:
+        """
+        Remove data for this pair
+        :param pair: Delete data for this pair.
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: True when deleted, false if file did not exist.
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        self._ohlcv_purge_meta(pair, timeframe)
+        if filename.exists():
+            filename.unlink()
+            return True
+        return False
+
+    def ohlcv_append(self, pair: str, timeframe: str, data: pd.DataFrame) -> None:
+        """
+        Append data to existing data structures.
+        The last stored date is taken from the row group statistics, the existing row
+        groups are read back and the file is rewritten.
+        :param pair: Pair
+        :param timeframe: Timeframe this ohlcv data is for
+        :param data: Data to append, sorted by date.
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        min_max = self.ohlcv_data_min_max(pair, timeframe)
+        last_date = min_max[1] if min_max else None
+        data, replace_last = self._ohlcv_new_candles(data, last_date)
+        if data.empty:
+            return
+        meta = self.ohlcv_data_meta(pair, timeframe)
+        _data = data.loc[:, self._columns].reset_index(drop=True)
+        # Convert date to int (ms)
+        _data['date'] = _data['date'].astype(np.int64) // 1000 // 1000
+
+        table = pa.Table.from_pandas(_data, schema=self._ohlcv_schema, preserve_index=False)
+        if filename.exists():
+            stored = pq.read_table(filename, schema=self._ohlcv_schema)
+            if replace_last:
+                stored = stored.slice(0, stored.num_rows - 1)
+            table = pa.concat_tables([stored, table])
+        self._write_table(filename, table, 'date', self._ohlcv_row_group_period)
+        self._ohlcv_store_meta(pair, timeframe, data, meta, last_date, replace_last)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str
+                           ) -> Optional[Tuple[datetime, datetime]]:
+        """
+        Date of the first and of the last stored candle, from the row group statistics.
+        :param pair: Pair
+        :param timeframe: Timeframe (e.g. "5m")
+        :return: Tuple of (first date, last date), None if no data is stored
+        """
+        filename = self._pair_data_filename(self._datadir, pair, timeframe)
+        if not filename.exists():
+            return None
+        pf = pq.ParquetFile(filename)
+        col_idx = pf.schema_arrow.get_field_index('date')
+        stats = [pf.metadata.row_group(i).column(col_idx).statistics
+                 for i in range(pf.metadata.num_row_groups)]
+        stats = [stat for stat in stats if stat is not None and stat.has_min_max]
+        if not stats:
+            return None
+        return tuple(pd.Timestamp(date, unit='ms', tz='UTC').to_pydatetime()
+                     for date in (min(s.min for s in stats), max(s.max for s in stats)))
+
+    @classmethod
+    def trades_get_pairs(cls, datadir: Path) -> List[str]:
+        """
+        Returns a list of all pairs for which trade data is available in this
+        :param datadir: Directory to search for ohlcv files
+        :return: List of Pairs
+        """
+        _tmp = [re.search(r'^(\S+)(?=\-trades.parquet)', p.name)
+                for p in datadir.glob("*trades.parquet")]
+        # Check if regex found something and only return these results to avoid exceptions.
+        return [match[0].replace('_', '/') for match in _tmp if match]
+
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
+        """
+        Store trades data (list of Dicts) to file
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        self._write_table(filename, self._trades_to_table(data), 'timestamp',
+                          self._trades_row_group_period)
+
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
+        """
+        Append data to existing files.
+        The existing row groups are read back and the file is rewritten.
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        table = self._trades_to_table(data)
+        if filename.exists():
+            table = pa.concat_tables([pq.read_table(filename, schema=self._trades_schema),
+                                      table])
+        self._write_table(filename, table, 'timestamp', self._trades_row_group_period)
+
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
+        """
+        Load a pair from parquet file.
+        :param pair: Load trades for this pair
+        :param timerange: Timerange to load trades for.
+                          Only row groups overlapping the timerange are read.
+        :return: TradeBatch of trades
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if not filename.exists():
+            return TradeBatch.empty()
+        return self._table_to_trades(self._read_table(filename, 'timestamp', timerange))
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks, reading only the row groups
+        overlapping the timerange.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if not filename.exists():
+            return
+
+        pf = pq.ParquetFile(filename)
+        row_groups = self._select_row_groups(pf, 'timestamp', timerange)
+        if not row_groups:
+            return
+        for batch in pf.iter_batches(batch_size=chunksize, row_groups=row_groups):
+            table = self._filter_timerange(pa.Table.from_batches([batch]), 'timestamp',
+                                           timerange)
+            if table.num_rows:
+                yield self._table_to_trades(table)
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair.
+        Uses the row group metadata, so only the last row groups are read.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if n <= 0 or not filename.exists():
+            return TradeBatch.empty()
+
+        pf = pq.ParquetFile(filename)
+        row_groups: List[int] = []
+        rows = 0
+        for i in reversed(range(pf.metadata.num_row_groups)):
+            if rows >= n:
+                break
+            row_groups.insert(0, i)
+            rows += pf.metadata.row_group(i).num_rows
+        table = pf.read_row_groups(row_groups)
+        return self._table_to_trades(table.slice(max(table.num_rows - n, 0)))
+
+    def trades_purge(self, pair: str) -> bool:
+        """
+        Remove data for this pair
+        :param pair: Delete data for this pair.
+        :return: True when deleted, false if file did not exist.
+        """
+        filename = self._pair_trades_filename(self._datadir, pair)
+        if filename.exists():
+            filename.unlink()
+            return True
+        return False
+
+    @classmethod
+    def _trades_to_table(cls, data: Union[TradeBatch, TradeList]) -> pa.Table:
+        """
+        Convert trades to a typed arrow table.
+        Columns are converted without going through python objects - type and side
+        codes become the indices of the dictionary arrays.
+        """
+        batch = TradeBatch.from_trades(data)
+        arrays = []
+        for field in cls._trades_schema:
+            values = batch.columns[field.name]
+            if field.name in CATEGORICAL_COLUMNS:
+                array = pa.DictionaryArray.from_arrays(
+                    pa.array(values.astype(np.int32), mask=values < 0),
+                    pa.array(batch.categories[field.name], type=pa.string()))
+            elif field.name == 'id':
+                array = pa.array(values, type=pa.binary(), mask=values == b'').cast(pa.string())
+            else:
+                array = pa.array(values, type=field.type)
+            arrays.append(array)
+        return pa.Table.from_arrays(arrays, schema=cls._trades_schema)
+
+    @staticmethod
+    def _table_to_trades(table: pa.Table) -> TradeBatch:
+        """
+        Convert an arrow table to a TradeBatch
+        """
+        columns = []
+        for col in DEFAULT_TRADES_COLUMNS:
+            column = table.column(col)
+            if pa.types.is_dictionary(column.type):
+                # Decoded first - to_numpy() fails on all-null columns with empty dictionary
+                column = column.cast(pa.string())
+            columns.append(column.to_numpy(zero_copy_only=False))
+        return TradeBatch.from_columns(*columns)
+
+    @staticmethod
+    def _timerange_ms(timerange: Optional[TimeRange]) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Start and stop of a timerange in ms (None if open)
+        """
+        start = stop = None
+        if timerange:
+            if timerange.starttype == 'date':
+                start = int(timerange.startts * 1000)
+            if timerange.stoptype == 'date':
+                stop = int(timerange.stopts * 1000)
+        return start, stop
+
+    def _read_table(self, filename: Path, time_column: str,
+                    timerange: Optional[TimeRange]) -> pa.Table:
+        """
+        Read a parquet file, limited to the timerange.
+        """
+        pf = pq.ParquetFile(filename)
+        if timerange is None:
+            return pf.read()
+        table = pf.read_row_groups(self._select_row_groups(pf, time_column, timerange))
+        return self._filter_timerange(table, time_column, timerange)
+
+    def _select_row_groups(self, pf: pq.ParquetFile, time_column: str,
+                           timerange: Optional[TimeRange]) -> List[int]:
+        """
+        Row groups overlapping the timerange.
+        Row groups are skipped based on the min / max statistics of `time_column`.
+        """
+        start, stop = self._timerange_ms(timerange)
+        col_idx = pf.schema_arrow.get_field_index(time_column)
+        row_groups = []
+        for i in range(pf.metadata.num_row_groups):
+            stats = pf.metadata.row_group(i).column(col_idx).statistics
+            if stats is not None and stats.has_min_max:
+                if ((start is not None and stats.max < start)
+                        or (stop is not None and stats.min >= stop)):
+                    continue
+            row_groups.append(i)
+        return row_groups
+
+    def _filter_timerange(self, table: pa.Table, time_column: str,
+                          timerange: Optional[TimeRange]) -> pa.Table:
+        """
+        Filter the rows of a table exactly to the timerange.
+        """
+        start, stop = self._timerange_ms(timerange)
+        if start is not None:
+            table = table.filter(pc.greater_equal(table.column(time_column), start))
+        if stop is not None:
+            table = table.filter(pc.less(table.column(time_column), stop))
+        return table
+
+    def _write_table(self, filename: Path, table: pa.Table, time_column: str,
+                     period: str) -> None:
+        """
+        Write a table with one row group (or more, for large periods) per time period.
+        The file is written next to the target and moved in place once complete.
+        :param period: numpy datetime64 unit to split row groups by (e.g. 'D', 'M')
+        """
+        timestamps = table.column(time_column).to_numpy()
+        periods = timestamps.astype('datetime64[ms]').astype(f'datetime64[{period}]')
+        bounds = [0, *(np.flatnonzero(periods[1:] != periods[:-1]) + 1), len(table)]
+
+        tmp_filename = filename.with_name(filename.name + '.tmp')
+        with pq.ParquetWriter(tmp_filename, table.schema,
+                              compression=self._compression) as writer:
+            if len(table) == 0:
+                writer.write_table(table)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                writer.write_table(table.slice(start, stop - start))
+        os.replace(tmp_filename, filename)
+
+    @classmethod
+    def _pair_data_filename(cls, datadir: Path, pair: str, timeframe: str) -> Path:
+        pair_s = misc.pair_to_filename(pair)
+        filename = datadir.joinpath(f'{pair_s}-{timeframe}.parquet')
+        return filename
+
+    @classmethod
+    def _pair_trades_filename(cls, datadir: Path, pair: str) -> Path:
+        pair_s = misc.pair_to_filename(pair)
+        filename = datadir.joinpath(f'{pair_s}-trades.parquet')
+        return filename
@@ -0,0 +1,296 @@
+"""
+Time-partitioned trades storage.
+Trades of a pair are split in one segment per UTC day or month, each stored by a
+regular datahandler, plus a manifest describing the segments.
+"""
+import logging
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Type, Union
+
+import numpy as np
+from pandas import DataFrame
+
+import misc
+from constants import ListPairsWithTimeframes, TradeList
+from data.tradebatch import TradeBatch
+from timerange import TimeRange
+
+from .idatahandler import IDataHandler
+
+
+logger = logging.getLogger(__name__)
+
+# numpy datetime64 unit of each segment period
+SEGMENT_UNITS = {'day': 'D', 'month': 'M'}
+
+
+class SegmentedTradesDataHandler(IDataHandler):
+    """
+    Stores trades in `{pair}-trades/`, one file per segment, using the base datahandler.
+    `manifest.json` holds min / max timestamp, id range and row count of each segment.
+    Only the newest segment can be appended to, older segments are immutable.
+    OHLCV data is handled by the base datahandler unchanged.
+    Don't use directly - use get_datahandlerclass('<format>:<period>').
+    """
+
+    _base_handler: Type[IDataHandler]
+    _period: str
+    _manifest_filename = 'manifest.json'
+    # Number of segments loaded at the same time
+    _load_workers = 4
+
+    def __init__(self, datadir: Path) -> None:
+        super().__init__(datadir)
+        self._ohlcv_handler = self._base_handler(datadir)
+        self._manifests: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._segment_handlers: Dict[str, IDataHandler] = {}
+
+    def close(self) -> None:
+        self._ohlcv_handler.close()
+        for handler in self._segment_handlers.values():
+            handler.close()
+
+    @classmethod
+    def ohlcv_get_available_data(cls, datadir: Path) -> ListPairsWithTimeframes:
+        return cls._base_handler.ohlcv_get_available_data(datadir)
+
+    @classmethod
+    def ohlcv_get_pairs(cls, datadir: Path, timeframe: str) -> List[str]:
+        return cls._base_handler.ohlcv_get_pairs(datadir, timeframe)
+
+    def ohlcv_store(self, pair: str, timeframe: str, data: DataFrame) -> None:
+        self._ohlcv_handler.ohlcv_store(pair, timeframe, data)
+
+    def _ohlcv_load(self, pair: str, timeframe: str,
+                    timerange: Optional[TimeRange] = None,
+                    ) -> DataFrame:
+        return self._ohlcv_handler._ohlcv_load(pair, timeframe, timerange=timerange)
+
+    def ohlcv_purge(self, pair: str, timeframe: str) -> bool:
+        return self._ohlcv_handler.ohlcv_purge(pair, timeframe)
+
+    def ohlcv_append(self, pair: str, timeframe: str, data: DataFrame) -> None:
+        self._ohlcv_handler.ohlcv_append(pair, timeframe, data)
+
+    def ohlcv_data_min_max(self, pair: str, timeframe: str):
+        return self._ohlcv_handler.ohlcv_data_min_max(pair, timeframe)
+
+    def ohlcv_data_identity(self, pair: str, timeframe: str):
+        return self._ohlcv_handler.ohlcv_data_identity(pair, timeframe)
+
+    def ohlcv_data_meta(self, pair: str, timeframe: str):
+        return self._ohlcv_handler.ohlcv_data_meta(pair, timeframe)
+
+    @classmethod
+    def trades_get_pairs(cls, datadir: Path) -> List[str]:
+        """
+        Returns a list of all pairs for which trade data is available in this
+        :param datadir: Directory to search for ohlcv files
+        :return: List of Pairs
+        """
+        _tmp = [re.search(r'^(\S+)(?=\-trades$)', p.parent.name)
+                for p in datadir.glob(f"*-trades/{cls._manifest_filename}")]
+        # Check if regex found something and only return these results to avoid exceptions.
+        return [match[0].replace('_', '/') for match in _tmp if match]
+
+    def trades_store(self, pair: str, data: Union[TradeBatch, TradeList]) -> None:
+        """
+        Store trades data (list of Dicts), replacing all existing segments
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        self.trades_purge(pair)
+        self.trades_append(pair, data)
+
+    def trades_append(self, pair: str, data: Union[TradeBatch, TradeList]):
+        """
+        Append data to the newest segment, starting new segments where needed.
+        :param pair: Pair - used for filename
+        :param data: TradeBatch, or List of Lists containing trade data,
+                     column sequence as in DEFAULT_TRADES_COLUMNS
+        :raises: ValueError if data belongs to a segment older than the newest one
+        """
+        data = TradeBatch.from_trades(data)
+        if not len(data):
+            return
+        manifest = self._get_manifest(pair)
+        self._pair_segment_dir(self._datadir, pair).mkdir(parents=True, exist_ok=True)
+        handler = self._segment_handler(pair)
+        newest = max(manifest) if manifest else None
+
+        for key, segment in self._split_segments(data):
+            if newest is not None and key < newest:
+                raise ValueError(f"Trades for {pair} belong to segment {key}, "
+                                 f"but only the newest segment ({newest}) can be extended.")
+            entry = manifest.get(key)
+            handler.trades_append(key, segment)
+            manifest[key] = {
+                'min_ts': entry['min_ts'] if entry else segment[0][0],
+                'max_ts': segment[-1][0],
+                'min_id': entry['min_id'] if entry else segment[0][1],
+                'max_id': segment[-1][1],
+                'rows': (entry['rows'] if entry else 0) + len(segment),
+            }
+            newest = key
+        self._save_manifest(pair)
+
+    def _trades_load(self, pair: str, timerange: Optional[TimeRange] = None) -> TradeBatch:
+        """
+        Load the trades of a pair, reading only the segments overlapping the timerange.
+        Segments are loaded in parallel.
+        :param pair: Load trades for this pair
+        :param timerange: Timerange to load trades for
+        :return: TradeBatch of trades
+        """
+        keys = self.trades_segments(pair, timerange)
+        if not keys:
+            return TradeBatch.empty()
+
+        with ThreadPoolExecutor(max_workers=self._load_workers) as executor:
+            segments = list(executor.map(lambda key: self._load_segment(pair, key), keys))
+        return TradeBatch.concat(segments).filter_timerange(timerange)
+
+    def trades_load_chunks(self, pair: str, chunksize: int,
+                           timerange: Optional[TimeRange] = None
+                           ) -> Iterator[TradeBatch]:
+        """
+        Load a pair's trades in time-ordered chunks, one segment at a time.
+        Only segments overlapping the timerange are read.
+        :param pair: Load trades for this pair
+        :param chunksize: Maximum number of trades per chunk
+        :param timerange: Timerange to load trades for
+        :return: Iterator of TradeBatches
+        """
+        handler = self._segment_handler(pair)
+        for key in self.trades_segments(pair, timerange):
+            for trades in handler.trades_load_chunks(key, chunksize, timerange=timerange):
+                trades = trades.filter_timerange(timerange)
+                if len(trades):
+                    yield trades
+
+    def trades_tail(self, pair: str, n: int = 1) -> TradeBatch:
+        """
+        Load only the last trades of a pair, starting from the newest segment.
+        :param pair: Load trades for this pair
+        :param n: Number of trades to load
+        :return: TradeBatch of the last n trades
+        """
+        handler = self._segment_handler(pair)
+        trades = TradeBatch.empty()
+        for key in sorted(self._get_manifest(pair), reverse=True):
+            if len(trades) >= n:
+                break
+            trades = TradeBatch.concat([handler.trades_tail(key, n - len(trades)), trades])
+        return trades
+
+    def trades_purge(self, pair: str) -> bool:
+        """
+        Remove data for this pair
+        :param pair: Delete data for this pair.
+        :return: True when deleted, false if no data existed.
+        """
+        self._manifests.pop(pair, None)
+        handler = self._segment_handlers.pop(pair, None)
+        if handler:
+            handler.close()
+        segment_dir = self._pair_segment_dir(self._datadir, pair)
+        if segment_dir.exists():
+            shutil.rmtree(segment_dir)
+            return True
+        return False
+
+    def trades_data_size(self, pair: str) -> int:
+        """
+        Size of the stored trades for this pair.
+        :param pair: Pair to check
+        :return: Size in bytes of all segments, 0 if no trades are stored
+        """
+        handler = self._segment_handler(pair)
+        return sum(handler.trades_data_size(key) for key in self._get_manifest(pair))
+
+    def trades_segments(self, pair: str,
+                        timerange: Optional[TimeRange] = None) -> List[str]:
+        """
+        Segments of a pair, oldest first.
+        :param pair: Pair to get segments for
+        :param timerange: Only return segments overlapping this timerange
+        :return: List of segment keys
+        """
+        keys = []
+        for key, entry in sorted(self._get_manifest(pair).items()):
+            if timerange:
+                if timerange.starttype == 'date' and entry['max_ts'] < timerange.startts * 1000:
+                    continue
+                if timerange.stoptype == 'date' and entry['min_ts'] >= timerange.stopts * 1000:
+                    continue
+            keys.append(key)
+        return keys
+
+    def _load_segment(self, pair: str, key: str) -> TradeBatch:
+        """
+        Load one segment, checking it against the manifest
+        """
+        try:
+            trades = self._segment_handler(pair)._trades_load(key)
+        except ValueError:
+            logger.error(f"Could not load segment {key} of {pair}, skipping it.")
+            return TradeBatch.empty()
+        rows = self._get_manifest(pair)[key]['rows']
+        if len(trades) != rows:
+            logger.warning(f"Segment {key} of {pair} has {len(trades)} trades, "
+                           f"the manifest expects {rows}.")
+        return trades
+
+    def _split_segments(self, data: TradeBatch):
+        """
+        Split trades (sorted by timestamp) into segments.
+        :return: Iterator of (segment key, trades)
+        """
+        periods = data.timestamp.astype('datetime64[ms]').astype(
+            f'datetime64[{SEGMENT_UNITS[self._period]}]')
+        bounds = [0, *(np.flatnonzero(periods[1:] != periods[:-1]) + 1), len(data)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield str(periods[start]), data[start:stop]
+
+    def _segment_handler(self, pair: str) -> IDataHandler:
+        # Kept per pair, so datahandlers holding open files reuse them
+        if pair not in self._segment_handlers:
+            self._segment_handlers[pair] = self._base_handler(
+                self._pair_segment_dir(self._datadir, pair))
+        return self._segment_handlers[pair]
+
+    def _get_manifest(self, pair: str) -> Dict[str, Dict[str, Any]]:
+        if pair not in self._manifests:
+            filename = self._pair_segment_dir(self._datadir, pair) / self._manifest_filename
+            self._manifests[pair] = misc.file_load_json(filename) or {}
+        return self._manifests[pair]
+
+    def _save_manifest(self, pair: str) -> None:
+        filename = self._pair_segment_dir(self._datadir, pair) / self._manifest_filename
+        misc.file_dump_json_atomic(filename, self._manifests[pair])
+
+    @classmethod
+    def _pair_segment_dir(cls, datadir: Path, pair: str) -> Path:
+        pair_s = misc.pair_to_filename(pair)
+        return datadir.joinpath(f'{pair_s}-trades')
+
+
+@lru_cache(maxsize=None)
+def get_segmented_datahandlerclass(base_handler: Type[IDataHandler],
+                                   period: str) -> Type[IDataHandler]:
+    """
+    Get a segmented trades datahandler class storing segments with `base_handler`
+    :param base_handler: Datahandler class used for each segment
+    :param period: Segment period, 'day' or 'month'
+    :return: Datahandler class
+    """
+    if period not in SEGMENT_UNITS:
+        raise ValueError(f"Unknown segment period {period}, use one of {list(SEGMENT_UNITS)}.")
+    return type(f'Segmented{base_handler.__name__}', (SegmentedTradesDataHandler, ),
+                {'_base_handler': base_handler, '_period': period,
+                 '_load_in_processes': base_handler._load_in_processes})
@@ -0,0 +1,177 @@
+"""
+Fixed-capacity in-memory store of live candles
+"""
+import logging
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Index, RangeIndex
+from pandas.arrays import DatetimeArray
+from pandas.core.dtypes.dtypes import DatetimeTZDtype
+
+from constants import DEFAULT_DATAFRAME_COLUMNS, PairWithTimeframe
+
+
+logger = logging.getLogger(__name__)
+
+# Columns stored as one float64 block
+VALUE_COLUMNS = DEFAULT_DATAFRAME_COLUMNS[1:]
+
+# DataFrame(BlockManager) relies on pandas internals and is deprecated since pandas 2.2
+_FRAME_VIEWS = tuple(int(v) for v in pd.__version__.split('.')[:2]) < (2, 2)
+
+
+def _frame_from_arrays(dates: np.ndarray, values: np.ndarray) -> DataFrame:
+    """
+    DataFrame with DEFAULT_DATAFRAME_COLUMNS from candle arrays.
+    Up to pandas 2.1 the frame is built from blocks and is a view on the arrays - the
+    DataFrame constructor would copy them. Later versions get a copy.
+    :param dates: Dates, int64 ns
+    :param values: float64 array of shape (len(VALUE_COLUMNS), len(dates))
+    :return: DataFrame
+    """
+    dates = DatetimeArray(dates.view('M8[ns]'), dtype=DatetimeTZDtype(tz='UTC'), copy=False)
+    if _FRAME_VIEWS:
+        from pandas.core.internals import BlockManager
+        from pandas.core.internals.api import make_block
+        mgr = BlockManager([make_block(dates.reshape(1, -1), placement=[0]),
+                            make_block(values, placement=slice(1, len(VALUE_COLUMNS) + 1))],
+                           [Index(DEFAULT_DATAFRAME_COLUMNS), RangeIndex(len(dates))])
+        return DataFrame(mgr)
+    return DataFrame({'date': dates, **dict(zip(VALUE_COLUMNS, values))},
+                     columns=DEFAULT_DATAFRAME_COLUMNS, copy=True)
+
+
+class KlineBuffer:
+    """
+    Candles of one (pair, timeframe), keeping at most `capacity` candles.
+    Dates (int64 ns) and values are stored in buffers of twice the capacity, so the last
+    `capacity` candles are always contiguous:
+      * appending a candle writes one row - O(1)
+      * once the buffer is full, the kept candles move to a new buffer - O(capacity)
+        every `capacity` appends
+    Frames returned by `frame()` are read-only views on the buffer, nothing is copied
+    (copies from pandas 2.2 on, see _frame_from_arrays).
+    As full buffers are replaced and not reused, a view only changes if its rows are
+    rewritten by `update()` - usually the last, incomplete candle.
+    """
+
+    __slots__ = ('capacity', '_dates', '_values', '_start', '_stop')
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._dates = np.empty(2 * capacity, dtype=np.int64)
+        self._values = np.empty((len(VALUE_COLUMNS), 2 * capacity), dtype=np.float64)
+        self._start = 0
+        self._stop = 0
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    @property
+    def last_date(self) -> Optional[int]:
+        """
+        Date of the last candle in ns, None if empty
+        """
+        return int(self._dates[self._stop - 1]) if len(self) else None
+
+    def update(self, data: DataFrame) -> None:
+        """
+        Write candles (sorted by date): stored candles at or after the first new date are
+        replaced, the others are appended. The oldest candles are dropped beyond capacity.
+        :param data: Dataframe with DEFAULT_DATAFRAME_COLUMNS
+        """
+        if data.empty:
+            return
+        data = data.iloc[-self.capacity:]
+        dates = data['date'].values.view(np.int64)
+        values = data[VALUE_COLUMNS].to_numpy(dtype=np.float64).T
+
+        # Rewind to the first replaced candle
+        self._stop = self._start + int(np.searchsorted(self._dates[self._start:self._stop],
+                                                       dates[0]))
+        rows = len(dates)
+        if self._stop + rows > len(self._dates):
+            self._move(self.capacity - rows)
+        self._dates[self._stop:self._stop + rows] = dates
+        self._values[:, self._stop:self._stop + rows] = values
+        self._stop += rows
+        self._start = max(self._start, self._stop - self.capacity)
+
+    def _move(self, keep: int) -> None:
+        """
+        Move the last `keep` candles to a new buffer.
+        Views on the old buffer stay unchanged.
+        """
+        keep = min(keep, len(self))
+        dates = np.empty_like(self._dates)
+        values = np.empty_like(self._values)
+        dates[:keep] = self._dates[self._stop - keep:self._stop]
+        values[:, :keep] = self._values[:, self._stop - keep:self._stop]
+        self._dates, self._values = dates, values
+        self._start, self._stop = 0, keep
+
+    def frame(self) -> DataFrame:
+        """
+        :return: Read-only DataFrame view of the candles (a copy from pandas 2.2 on),
+                 with DEFAULT_DATAFRAME_COLUMNS
+        """
+        dates = self._dates[self._start:self._stop]
+        values = self._values[:, self._start:self._stop]
+        dates.flags.writeable = False
+        values.flags.writeable = False
+        return _frame_from_arrays(dates, values)
+
+
+class KlineStore:
+    """
+    KlineBuffers by (pair, timeframe), used like a dict of DataFrames.
+    Reading a key returns a read-only view - copy it before modifying values in place.
+    """
+
+    def __init__(self) -> None:
+        self._buffers: Dict[PairWithTimeframe, KlineBuffer] = {}
+
+    def __contains__(self, key: PairWithTimeframe) -> bool:
+        return key in self._buffers
+
+    def __iter__(self) -> Iterator[PairWithTimeframe]:
+        return iter(self._buffers)
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def __getitem__(self, key: PairWithTimeframe) -> DataFrame:
+        return self._buffers[key].frame()
+
+    def get(self, key: PairWithTimeframe,
+            default: Optional[DataFrame] = None) -> Optional[DataFrame]:
+        return self[key] if key in self._buffers else default
+
+    def keys(self):
+        return self._buffers.keys()
+
+    def set(self, key: PairWithTimeframe, data: DataFrame, capacity: int) -> None:
+        """
+        Replace the candles of a key
+        :param capacity: Maximum number of candles kept for this key - only the last
+                         `capacity` candles of data are kept
+        """
+        buffer = KlineBuffer(max(capacity, 1))
+        buffer.update(data)
+        self._buffers[key] = buffer
+
+    def update(self, key: PairWithTimeframe, data: DataFrame) -> None:
+        """
+        Merge candles into the stored candles of a key, see KlineBuffer.update()
+        """
+        self._buffers[key].update(data)
+
+    def last_date(self, key: PairWithTimeframe) -> Optional[int]:
+        """
+        Date of the last candle of a key in ms, None if there is none
+        """
+        buffer = self._buffers.get(key)
+        last = buffer.last_date if buffer else None
+        return last // 10 ** 6 if last is not None else None
@@ -0,0 +1,248 @@
+"""
+Columnar representation of trades
+"""
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from constants import DEFAULT_TRADES_COLUMNS, TradeList
+from timerange import TimeRange
+
+
+logger = logging.getLogger(__name__)
+
+# Columns with few distinct values, stored as codes into a list of categories
+CATEGORICAL_COLUMNS = ('type', 'side')
+
+
+class TradeBatch:
+    """
+    Trades stored as one NumPy array per column of DEFAULT_TRADES_COLUMNS:
+      * timestamp: int64 ms
+      * id: bytes, b'' if the trade has no id
+      * type, side: int8 codes into `categories[column]`, -1 for None
+      * price, amount, cost: float64
+    A trade takes ~45 bytes instead of ~500 bytes as list in a TradeList.
+    Indexing with an integer returns the trade as list (as in a TradeList), slices,
+    masks and index arrays return a new TradeBatch.
+    """
+
+    __slots__ = ('columns', 'categories')
+
+    def __init__(self, columns: Dict[str, np.ndarray],
+                 categories: Dict[str, Tuple[str, ...]]) -> None:
+        self.columns = columns
+        self.categories = categories
+
+    @classmethod
+    def empty(cls) -> 'TradeBatch':
+        return cls.from_columns(*([] for _ in DEFAULT_TRADES_COLUMNS))
+
+    @classmethod
+    def from_columns(cls, timestamp: Sequence, id: Sequence, type: Sequence, side: Sequence,
+                     price: Sequence, amount: Sequence, cost: Sequence) -> 'TradeBatch':
+        """
+        Build a batch from one array-like per column of DEFAULT_TRADES_COLUMNS.
+        Strings may be str, bytes or None.
+        """
+        columns = {
+            'timestamp': np.asarray(timestamp, dtype=np.int64),
+            'id': _to_bytes(id),
+            'price': np.asarray(price, dtype=np.float64),
+            'amount': np.asarray(amount, dtype=np.float64),
+            'cost': np.asarray(cost, dtype=np.float64),
+        }
+        categories = {}
+        for col, values in zip(CATEGORICAL_COLUMNS, (type, side)):
+            columns[col], categories[col] = _factorize(values)
+        return cls(columns, categories)
+
+    @classmethod
+    def from_list(cls, trades: TradeList) -> 'TradeBatch':
+        """
+        :param trades: List of Lists, column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        if not trades:
+            return cls.empty()
+        return cls.from_columns(*(_list_column(trades, i, dtype) for i, dtype in enumerate(
+            [np.int64, None, None, None, np.float64, np.float64, np.float64])))
+
+    @classmethod
+    def from_dicts(cls, trades: List[Dict]) -> 'TradeBatch':
+        """
+        :param trades: List of trades, as returned by ccxt.fetch_trades
+        """
+        return cls.from_columns(*([t[col] for t in trades] for col in DEFAULT_TRADES_COLUMNS))
+
+    @classmethod
+    def from_frame(cls, df: DataFrame) -> 'TradeBatch':
+        """
+        :param df: DataFrame with the columns of DEFAULT_TRADES_COLUMNS, in this sequence
+                   (names are ignored). Timestamps in ms.
+        """
+        return cls.from_columns(*(df.iloc[:, i].to_numpy()
+                                  for i in range(len(DEFAULT_TRADES_COLUMNS))))
+
+    @classmethod
+    def from_trades(cls, trades: Union['TradeBatch', TradeList]) -> 'TradeBatch':
+        """
+        Batch of trades given either as TradeBatch or as TradeList
+        """
+        return trades if isinstance(trades, TradeBatch) else cls.from_list(trades)
+
+    @classmethod
+    def concat(cls, batches: Iterable['TradeBatch']) -> 'TradeBatch':
+        """
+        Concatenate batches, merging the categories of type and side.
+        """
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        columns = {col: np.concatenate([b.columns[col] for b in batches])
+                   for col in DEFAULT_TRADES_COLUMNS if col not in CATEGORICAL_COLUMNS}
+        categories = {}
+        for col in CATEGORICAL_COLUMNS:
+            merged: Dict[str, int] = {}
+            codes = []
+            for b in batches:
+                # Map the codes of each batch to the merged categories, -1 stays -1
+                mapping = np.array([merged.setdefault(c, len(merged))
+                                    for c in b.categories[col]] + [-1], dtype=np.int8)
+                codes.append(mapping[b.columns[col]])
+            columns[col] = np.concatenate(codes)
+            categories[col] = tuple(merged)
+        return cls(columns, categories)
+
+    def __len__(self) -> int:
+        return len(self.columns['timestamp'])
+
+    def __getitem__(self, key: Any) -> Union[List, 'TradeBatch']:
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError("TradeBatch index out of range")
+            return self[key:key + 1 or None].to_list()[0]
+        return TradeBatch({col: values[key] for col, values in self.columns.items()},
+                          self.categories)
+
+    def __iter__(self) -> Iterator[List]:
+        return iter(self.to_list())
+
+    def __repr__(self) -> str:
+        return f"TradeBatch({len(self)} trades)"
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        return self.columns['timestamp']
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.columns['id']
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in self.columns.values())
+
+    def values(self, col: str) -> np.ndarray:
+        """
+        Values of a column, with strings decoded (object array, None for missing values)
+        """
+        values = self.columns[col]
+        if col in CATEGORICAL_COLUMNS:
+            return np.array([*self.categories[col], None], dtype=object)[values]
+        if col == 'id':
+            try:
+                values = values.astype(str)
+            except UnicodeDecodeError:
+                values = np.char.decode(values, 'utf-8')
+            return np.where(values == '', None, values.astype(object))
+        return values
+
+    def to_list(self) -> TradeList:
+        """
+        :return: List of Lists, column sequence as in DEFAULT_TRADES_COLUMNS
+        """
+        columns = [self.values(col).tolist() for col in DEFAULT_TRADES_COLUMNS]
+        return [list(trade) for trade in zip(*columns)]
+
+    def to_frame(self) -> DataFrame:
+        """
+        :return: DataFrame with DEFAULT_TRADES_COLUMNS as columns, strings as objects
+        """
+        return DataFrame({col: self.values(col) for col in DEFAULT_TRADES_COLUMNS})
+
+    def remove_duplicates(self) -> 'TradeBatch':
+        """
+        Sort trades by timestamp and drop trades whose id was already seen.
+        Trades without id are kept.
+        """
+        batch = self
+        timestamps = self.timestamp
+        if not (timestamps[1:] >= timestamps[:-1]).all():
+            batch = self[np.argsort(timestamps, kind='stable')]
+        _, first = np.unique(batch.ids, return_index=True)
+        keep = batch.ids == b''
+        keep[first] = True
+        return batch if keep.all() else batch[keep]
+
+    def filter_timerange(self, timerange: Optional[TimeRange]) -> 'TradeBatch':
+        """
+        Keep only trades within the timerange (start included, stop excluded)
+        """
+        if not timerange:
+            return self
+        keep = np.ones(len(self), dtype=bool)
+        if timerange.starttype == 'date':
+            keep &= self.timestamp >= timerange.startts * 1000
+        if timerange.stoptype == 'date':
+            keep &= self.timestamp < timerange.stopts * 1000
+        return self if keep.all() else self[keep]
+
+
+def _list_column(trades: TradeList, i: int, dtype: Optional[type]) -> Sequence:
+    """
+    Column i of a TradeList, as numeric array if dtype is given
+    """
+    if dtype:
+        try:
+            return np.fromiter((t[i] for t in trades), dtype=dtype, count=len(trades))
+        except TypeError:
+            # None values (e.g. missing cost) - converted to NaN below
+            pass
+    return [t[i] for t in trades]
+
+
+def _to_bytes(values: Sequence) -> np.ndarray:
+    """
+    Convert ids to a bytes array, None / NaN to b''.
+    Non ascii ids are kept as str.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'SU':
+        array = values
+    else:
+        array = np.where(pd.isna(values), '', values).astype(str)
+    try:
+        return array.astype(np.bytes_)
+    except UnicodeEncodeError:
+        return array.astype(str)
+
+
+def _factorize(values: Sequence) -> Tuple[np.ndarray, Tuple[str, ...]]:
+    """
+    Encode strings as int8 codes into a tuple of categories.
+    None, NaN and empty strings get code -1.
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = [u.decode() if isinstance(u, bytes) else str(u) for u in uniques]
+    if '' in uniques:
+        empty = uniques.index('')
+        codes = np.where(codes == empty, -1, codes - (codes > empty))
+        uniques.pop(empty)
+    if len(uniques) > np.iinfo(np.int8).max:
+        raise ValueError(f"Too many distinct values ({len(uniques)}) for a categorical column.")
+    return codes.astype(np.int8), tuple(uniques)
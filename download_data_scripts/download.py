@@ -36,4 +36,5 @@ def start_download_data(args: Dict[str, Any]) -> None:
     if config.get('download_trades'):
         pairs_not_available = refresh_backtest_trades_data(exchange, pairs=expanded_pairs, datadir=Path(config['data_dir']),
                                                             timerange=None, erase=bool(config.get('erase')),
-                                                            data_format=config['dataformat_trades'])
+                                                            data_format=config['dataformat_trades'],
+                                                            concurrency=config.get('download_concurrency', 1))
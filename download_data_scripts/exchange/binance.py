@@ -1,9 +1,11 @@
 """ Binance exchange subclass """
 import logging
-from typing import Dict
+from typing import Dict, List, Optional
 
 import ccxt
+import numpy as np
 
+from data.tradebatch import TradeBatch
 from exceptions import (DDosProtection, InsufficientFundsError, InvalidOrderException,
             OperationalException, TemporaryError)
 from exchange import Exchange
@@ -12,6 +14,13 @@ from exchange.common import retrier
 
 logger = logging.getLogger(__name__)
 
+# Keys of timestamp, id, price, amount, isBuyerMaker and quote amount (None if not provided)
+# in the raw responses of the spot trade endpoints
+RAW_TRADES_KEYS = {
+    'publicGetAggTrades': ('T', 'a', 'p', 'q', 'm', None),
+    'publicGetHistoricalTrades': ('time', 'id', 'price', 'qty', 'isBuyerMaker', 'quoteQty'),
+}
+
 
 class Binance(Exchange):
 
@@ -21,7 +30,16 @@ class Binance(Exchange):
         "ohlcv_candle_limit": 1000,
         "trades_pagination": "id",
         "trades_pagination_arg": "fromId",
+        "trades_pagination_shards": 8,
+        "trades_raw_decoding": True,
         "l2_limit_range": [5, 10, 20, 50, 100, 500, 1000],
+        "ratelimit_weight_limit": 6000,
+        "ratelimit_interval": 60,
+        "ratelimit_weights": {
+            "fetch_trades": 2,  # aggTrades
+            "fetch_ohlcv": 2,  # klines
+        },
+        "ratelimit_header": "x-mbx-used-weight-1m",
     }
 
     def stoploss_adjust(self, stop_loss: float, order: Dict) -> bool:
@@ -88,3 +106,60 @@ class Binance(Exchange):
                 f'Could not place sell order due to {e.__class__.__name__}. Message: {e}') from e
         except ccxt.BaseError as e:
             raise OperationalException(e) from e
+
+    async def _async_fetch_trades_batch(self, pair: str,
+                                        since: Optional[int] = None,
+                                        params: Optional[dict] = None) -> TradeBatch:
+        """
+        Calls the raw spot trades endpoint (the one ccxt's fetch_trades would use) and
+        decodes the response straight into a TradeBatch, skipping ccxt's per-trade dicts.
+        Prices and amounts are identical to ccxt's, cost (price * amount) may differ in the
+        last bit as ccxt multiplies the decimal strings.
+        Falls back to ccxt for non-spot markets and unsupported fetchTradesMethods.
+        """
+        api = self._api_async
+        if api.markets is None:
+            await api.load_markets()
+        market = api.market(pair)
+        method = api.safe_string(api.options, 'fetchTradesMethod', 'publicGetAggTrades')
+        if (not self._ft_has['trades_raw_decoding'] or not market['spot']
+                or method not in RAW_TRADES_KEYS):
+            return await super()._async_fetch_trades_batch(pair, since=since, params=params)
+
+        # Same request as ccxt's fetch_trades
+        request = {'symbol': market['id'], 'limit': 1000}
+        if since is not None:
+            request['startTime'] = since
+            request['endTime'] = since + 3600000
+        request.update(params or {})
+        response = await getattr(api, method)(request)
+        return self._decode_raw_trades(response, RAW_TRADES_KEYS[method])
+
+    @staticmethod
+    def _decode_raw_trades(response: List[Dict], keys: tuple) -> TradeBatch:
+        """
+        Convert a raw trades response to a TradeBatch
+        :param response: List of raw trades, as returned by the endpoint
+        :param keys: Keys of timestamp, id, price, amount, isBuyerMaker and quote amount
+        """
+        ts_key, id_key, price_key, amount_key, maker_key, cost_key = keys
+        count = len(response)
+        price = np.array([t[price_key] for t in response], dtype=np.float64)
+        amount = np.array([t[amount_key] for t in response], dtype=np.float64)
+        if cost_key:
+            cost = np.array([t[cost_key] for t in response], dtype=np.float64)
+        else:
+            cost = price * amount
+        columns = {
+            'timestamp': np.fromiter((t[ts_key] for t in response), dtype=np.int64, count=count),
+            'id': np.fromiter((t[id_key] for t in response), dtype=np.int64,
+                              count=count).astype(np.bytes_),
+            # No order type in public trades
+            'type': np.full(count, -1, dtype=np.int8),
+            # The buyer being maker means the taker sold
+            'side': np.fromiter((t[maker_key] for t in response), dtype=np.int8, count=count),
+            'price': price,
+            'amount': amount,
+            'cost': cost,
+        }
+        return TradeBatch(columns, {'type': (), 'side': ('buy', 'sell')})
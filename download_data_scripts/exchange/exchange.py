@@ -6,26 +6,33 @@ import asyncio
 import http
 import inspect
 import logging
+import threading
+import time
 from copy import deepcopy
 from datetime import datetime, timezone
 from math import ceil
-from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import arrow
 import ccxt
 import ccxt.async_support as ccxt_async
 from ccxt.base.decimal_to_precision import (ROUND_DOWN, ROUND_UP, TICK_SIZE, TRUNCATE,
                                             decimal_to_precision)
-from pandas import DataFrame
+import numpy as np
+import rapidjson
+from pandas import DataFrame, concat
 
 from constants import DEFAULT_AMOUNT_RESERVE_PERCENT, ListPairsWithTimeframes
-from data.converter import ohlcv_to_dataframe, trades_dict_to_list
+from data.converter import ohlcv_to_dataframe
+from data.klinestore import KlineStore
+from data.tradebatch import TradeBatch
 from exceptions import (DDosProtection, ExchangeError, InsufficientFundsError,InvalidOrderException, OperationalException, RetryableOrderError,
             TemporaryError)
 from exchange.common import (API_FETCH_ORDER_RETRY_COUNT, BAD_EXCHANGES,
                  EXCHANGE_HAS_OPTIONAL, EXCHANGE_HAS_REQUIRED, retrier,
                  retrier_async)
-from misc import deep_merge_dicts, safe_value_fallback2
+from misc import deep_merge_dicts, file_dump_json_atomic, safe_value_fallback2
 from pairlist_helpers import expand_pairlist
 
 
@@ -41,6 +48,130 @@ logger = logging.getLogger(__name__)
 http.cookies.Morsel._reserved["samesite"] = "SameSite"  # type: ignore
 
 
+class MarketsCache:
+    """
+    Snapshot of the markets, currencies and timeframes of one exchange in a json file,
+    so startup doesn't have to fetch the full market list.
+    A snapshot older than `ttl` seconds is still used, but should be refreshed.
+    """
+
+    def __init__(self, path: Path, ttl: int) -> None:
+        self._path = path
+        self._ttl = ttl
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        :return: Snapshot dict (timestamp, markets, currencies, timeframes),
+                 None if there is no readable snapshot
+        """
+        if not self._path.is_file():
+            return None
+        try:
+            with self._path.open('r') as fp:
+                # Default number mode - NM_NATIVE may round precisions and limits
+                snapshot = rapidjson.load(fp)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read markets cache {self._path}, ignoring it.")
+            return None
+        if not isinstance(snapshot, dict) or not snapshot.get('markets'):
+            return None
+        return snapshot
+
+    def is_fresh(self, snapshot: Dict[str, Any]) -> bool:
+        return snapshot['timestamp'] + self._ttl > arrow.utcnow().int_timestamp
+
+    def store(self, markets: Dict[str, Any], currencies: Optional[Dict[str, Any]],
+              timeframes: Optional[Dict[str, str]]) -> int:
+        """
+        Replace the snapshot
+        :return: Timestamp of the snapshot
+        """
+        timestamp = arrow.utcnow().int_timestamp
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            file_dump_json_atomic(self._path, {
+                'timestamp': timestamp,
+                'markets': markets,
+                'currencies': currencies,
+                'timeframes': timeframes,
+            })
+        except OSError as e:
+            logger.warning(f"Could not write markets cache {self._path}. Reason: {e}")
+        return timestamp
+
+
+class WeightRateLimiter:
+    """
+    Token bucket shared by all async calls of one exchange instance.
+    Each call acquires the request weight of its endpoint (as defined in `_ft_has`)
+    before it is sent. The bucket refills continuously at `weight_limit / interval`
+    and is adjusted to the used weight the exchange reports in the response headers.
+    """
+
+    def __init__(self, weight_limit: Optional[int], interval: int,
+                 weights: Dict[str, int], header: Optional[str] = None) -> None:
+        self._weight_limit = weight_limit or 0
+        self._interval = interval
+        self._weights = weights
+        self._header = header.lower() if header else None
+        self._tokens = float(self._weight_limit)
+        self._last_refill = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._weight_limit > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._weight_limit, self._tokens + (now - self._last_refill)
+                           * self._weight_limit / self._interval)
+        self._last_refill = now
+
+    async def acquire(self, method: str) -> None:
+        """
+        Wait until the weight of `method` is available and consume it.
+        Waiting calls are served in order of arrival.
+        :param method: Method name as used in the weight table (e.g. 'fetch_trades')
+        """
+        if not self.enabled:
+            return
+        weight = min(self._weights.get(method, 1), self._weight_limit)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self._tokens < weight:
+                await asyncio.sleep((weight - self._tokens) * self._interval / self._weight_limit)
+                self._refill()
+            self._tokens -= weight
+
+    def update_from_headers(self, headers: Optional[Dict]) -> None:
+        """
+        Align the bucket with the used weight reported by the exchange.
+        :param headers: Response headers of the last call
+        """
+        if not self.enabled or not self._header or not headers:
+            return
+        used = next((v for k, v in headers.items() if k.lower() == self._header), None)
+        if used is None:
+            return
+        try:
+            used_weight = int(used)
+        except ValueError:
+            return
+        self._refill()
+        self._tokens = min(self._tokens, self._weight_limit - used_weight)
+
+    def drain(self) -> None:
+        """
+        Empty the bucket - used when the exchange signals that we are sending too much.
+        """
+        if self.enabled:
+            self._refill()
+            self._tokens = min(self._tokens, 0)
+
+
 class Exchange:
 
     _config: Dict = {}
@@ -61,7 +192,19 @@ class Exchange:
         "ohlcv_partial_candle": True,
         "trades_pagination": "time",  # Possible are "time" or "id"
         "trades_pagination_arg": "since",
+        # Number of id ranges fetched concurrently for "id" pagination.
+        # Only valid for exchanges with dense integer trade ids - 1 keeps the serial loop.
+        "trades_pagination_shards": 1,
+        # Decode raw trade endpoint responses instead of ccxt's parsed trades,
+        # only used by exchanges implementing it (see _async_fetch_trades_batch).
+        "trades_raw_decoding": False,
         "l2_limit_range": None,
+        # Request weight budget per ratelimit_interval (seconds). None disables the
+        # weight-aware limiter and leaves throttling to ccxt.
+        "ratelimit_weight_limit": None,
+        "ratelimit_interval": 60,
+        "ratelimit_weights": {},  # method -> request weight, defaults to 1
+        "ratelimit_header": None,  # Response header holding the used weight
     }
     _ft_has: Dict = {}
 
@@ -69,12 +212,23 @@ class Exchange:
         """
         Initializes this module with the given config,
         it does basic validation whether the specified exchange and pairs are valid.
+        Inside a running event loop (`async with Exchange(config) as exchange:`), markets are
+        loaded and validated by __aenter__ instead.
         :return: None
         """
-        self._api: ccxt.Exchange = None
+        self._api_sync: Optional[ccxt.Exchange] = None
         self._api_async: ccxt_async.Exchange = None
         self._markets: Dict = {}
 
+        # One event loop for all sync wrappers of this instance - the running loop if
+        # created inside a coroutine.
+        try:
+            self.loop = asyncio.get_running_loop()
+            self._own_loop = False
+        except RuntimeError:
+            self.loop = asyncio.new_event_loop()
+            self._own_loop = True
+
         self._config.update(config)
 
         # Holds last candle refreshed time of each pair
@@ -83,7 +237,7 @@ class Exchange:
         self._last_markets_refresh: int = 0
 
         # Holds candles
-        self._klines: Dict[Tuple[str, str], DataFrame] = {}
+        self._klines = KlineStore()
 
         # Holds all open sell orders for dry_run
         self._dry_run_open_orders: Dict[str, Any] = {}
@@ -105,13 +259,15 @@ class Exchange:
 
         self._trades_pagination = self._ft_has['trades_pagination']
         self._trades_pagination_arg = self._ft_has['trades_pagination_arg']
+        self._trades_pagination_shards = self._ft_has['trades_pagination_shards']
 
-        # Initialize ccxt objects
+        # Initialize ccxt objects.
+        # The sync api is only needed for orders, balances and tickers - created on first use.
+        self._exchange_config = exchange_config
         ccxt_config = self._ccxt_config.copy()
         ccxt_config = deep_merge_dicts(exchange_config.get('ccxt_config', {}), ccxt_config)
-        ccxt_config = deep_merge_dicts(exchange_config.get('ccxt_sync_config', {}), ccxt_config)
-
-        self._api = self._init_ccxt(exchange_config, ccxt_kwargs=ccxt_config)
+        self._ccxt_sync_config = deep_merge_dicts(exchange_config.get('ccxt_sync_config', {}),
+                                                  ccxt_config)
 
         ccxt_async_config = self._ccxt_config.copy()
         ccxt_async_config = deep_merge_dicts(exchange_config.get('ccxt_config', {}),
@@ -121,38 +277,113 @@ class Exchange:
         self._api_async = self._init_ccxt(
             exchange_config, ccxt_async, ccxt_kwargs=ccxt_async_config)
 
+        self._ratelimiter = WeightRateLimiter(self._ft_has['ratelimit_weight_limit'],
+                                              self._ft_has['ratelimit_interval'],
+                                              self._ft_has['ratelimit_weights'],
+                                              self._ft_has['ratelimit_header'])
+        if self._ratelimiter.enabled:
+            # Requests are throttled by the shared limiter - ccxt's own throttling would
+            # serialize them again.
+            logger.info("Using request weight rate limiter with a budget of %s per %ss.",
+                        self._ft_has['ratelimit_weight_limit'],
+                        self._ft_has['ratelimit_interval'])
+            self._api_async.enableRateLimit = False
+
         logger.info('Using Exchange "%s"', self.name)
 
+        # Converts the interval provided in minutes in config to seconds
+        self.markets_refresh_interval: int = exchange_config.get(
+            "markets_refresh_interval", 60) * 60
+        self._markets_cache = self._init_markets_cache(config)
+        self._markets_refresh_thread: Optional[threading.Thread] = None
+        # Markets fetched by the background refresh, not yet used by the apis
+        self._pending_markets: Optional[Dict[str, Any]] = None
+
+        # Validation needing markets is left to __aenter__ inside a running loop
+        self._validate_on_enter = validate and self.loop.is_running()
         if validate:
             # Check if timeframe is available
             self.validate_timeframes(config.get('timeframe'))
+            if not self._validate_on_enter:
+                # Initial markets load
+                self._load_markets()
+                self._validate_config(config)
 
-            # Initial markets load
-            self._load_markets()
+    def _validate_config(self, config: Dict[str, Any]) -> None:
+        """
+        Validate the config against the loaded markets
+        """
+        # Check if all pairs are available
+        self.validate_stakecurrency(config['stake_currency'])
+        if not config['exchange'].get('skip_pair_validation'):
+            self.validate_pairs(config['exchange']['pair_whitelist'])
+        self.validate_ordertypes(config.get('order_types', {}))
+        self.validate_order_time_in_force(config.get('order_time_in_force', {}))
+        self.validate_required_startup_candles(config.get('startup_candle_count', 0),
+                                               config.get('timeframe', ''))
 
-            # Check if all pairs are available
-            self.validate_stakecurrency(config['stake_currency'])
-            if not exchange_config.get('skip_pair_validation'):
-                self.validate_pairs(config['exchange']['pair_whitelist'])
-            self.validate_ordertypes(config.get('order_types', {}))
-            self.validate_order_time_in_force(config.get('order_time_in_force', {}))
-            self.validate_required_startup_candles(config.get('startup_candle_count', 0),
-                                                   config.get('timeframe', ''))
+    async def __aenter__(self) -> 'Exchange':
+        """
+        Async facade - loads markets (and validates the config) on the running loop.
+        Use the async methods only, sync wrappers can't run inside the loop.
+        """
+        if not self._markets:
+            await self._async_load_markets()
+        if self._validate_on_enter:
+            self._validate_on_enter = False
+            self._validate_config(self._config)
+        return self
 
-        # Converts the interval provided in minutes in config to seconds
-        self.markets_refresh_interval: int = exchange_config.get(
-            "markets_refresh_interval", 60) * 60
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close_async()
 
     def __del__(self):
         """
         Destructor - clean up async stuff
         """
-        self.close()
+        try:
+            self.close()
+        except Exception:
+            # Interpreter shutdown, or a partially initialized instance
+            pass
 
-    def close(self):
+    def close(self) -> None:
+        """
+        Close the async api and the event loop owned by this instance.
+        Safe to call more than once. Inside a running loop, use close_async() instead.
+        """
+        loop = getattr(self, 'loop', None)
+        if loop is None or loop.is_closed():
+            return
         logger.debug("Exchange object destroyed, closing async loop")
-        if self._api_async and inspect.iscoroutinefunction(self._api_async.close):
-            asyncio.get_event_loop().run_until_complete(self._api_async.close())
+        if loop.is_running():
+            # Can't block inside the loop - close in the background
+            loop.create_task(self.close_async())
+            return
+        loop.run_until_complete(self.close_async())
+        if self._own_loop:
+            loop.close()
+
+    async def close_async(self) -> None:
+        """
+        Close the sessions of the async api
+        """
+        api = getattr(self, '_api_async', None)
+        if api is not None and inspect.iscoroutinefunction(api.close) and api.session is not None:
+            await api.close()
+
+    @property
+    def _api(self) -> ccxt.Exchange:
+        """
+        Sync ccxt api, created on first use with the markets already loaded
+        """
+        if self._api_sync is None:
+            self._api_sync = self._init_ccxt(self._exchange_config,
+                                             ccxt_kwargs=self._ccxt_sync_config)
+            if self._markets:
+                self._api_sync.set_markets(self._markets, self._api_async.currencies)
+                self._api_sync.timeframes = self._api_async.timeframes
+        return self._api_sync
 
     def _init_ccxt(self, exchange_config: Dict[str, Any], ccxt_module: CcxtModuleType = ccxt,
                    ccxt_kwargs: dict = None) -> ccxt.Exchange:
@@ -187,19 +418,37 @@ class Exchange:
 
         return api
 
+    def _init_markets_cache(self, config: Dict[str, Any]) -> Optional[MarketsCache]:
+        """
+        Markets cache in `exchange.markets_cache_dir` (defaults to `<data_dir>/.markets`),
+        refreshed after `exchange.markets_cache_ttl` minutes (defaults to
+        markets_refresh_interval).
+        :return: None if no directory is available or the ttl is 0
+        """
+        exchange_config = config['exchange']
+        cache_dir = exchange_config.get('markets_cache_dir')
+        if cache_dir is None and config.get('data_dir'):
+            cache_dir = Path(config['data_dir']) / '.markets'
+        ttl = exchange_config.get('markets_cache_ttl', self.markets_refresh_interval // 60) * 60
+        if not cache_dir or ttl <= 0:
+            return None
+        # Sandbox apis list different markets
+        suffix = '_sandbox' if exchange_config.get('sandbox') else ''
+        return MarketsCache(Path(cache_dir) / f'{self.id}{suffix}.json', ttl)
+
     @property
     def name(self) -> str:
         """exchange Name (from ccxt)"""
-        return self._api.name
+        return self._api_async.name
 
     @property
     def id(self) -> str:
         """exchange ccxt id"""
-        return self._api.id
+        return self._api_async.id
 
     @property
     def timeframes(self) -> List[str]:
-        return list((self._api.timeframes or {}).keys())
+        return list((self._api_async.timeframes or {}).keys())
 
     @property
     def markets(self) -> Dict:
@@ -212,7 +461,7 @@ class Exchange:
     @property
     def precisionMode(self) -> str:
         """exchange ccxt precisionMode"""
-        return self._api.precisionMode
+        return self._api_async.precisionMode
 
     def ohlcv_candle_limit(self, timeframe: str) -> int:
         """
@@ -279,7 +528,13 @@ class Exchange:
                 symbol_parts[1] == market.get('quote')
                 )
 
-    def klines(self, pair_interval: Tuple[str, str], copy: bool = True) -> DataFrame:
+    def klines(self, pair_interval: Tuple[str, str], copy: bool = False) -> DataFrame:
+        """
+        Cached candles of a pair
+        :param copy: Return a copy instead of a read-only view on the cached candles.
+                     Breaking change: the default used to be True. Modifying values of the
+                     view in place raises "ValueError: assignment destination is read-only".
+        """
         if pair_interval in self._klines:
             return self._klines[pair_interval].copy() if copy else self._klines[pair_interval]
         else:
@@ -295,39 +550,150 @@ class Exchange:
                     f"No Sandbox URL in CCXT for {name}, exiting. Please check your config.json")
                 raise OperationalException(f'Exchange {name} does not provide a sandbox api')
 
-    def _load_async_markets(self, reload: bool = False) -> None:
-        try:
-            if self._api_async:
-                asyncio.get_event_loop().run_until_complete(
-                    self._api_async.load_markets(reload=reload))
+    def set_markets(self, markets: Dict[str, Any], currencies: Optional[Dict[str, Any]] = None,
+                    timeframes: Optional[Dict[str, str]] = None) -> None:
+        """
+        Use the given markets on both the sync and the async api, without fetching them.
+        :param markets: Markets as returned by ccxt's load_markets
+        :param currencies: Currencies of the markets, derived from the markets if not given
+        :param timeframes: Timeframes of the exchange, unchanged if not given
+        """
+        for api in (self._api_sync, self._api_async):
+            # Skip the api the markets were just loaded by
+            if api is not None and api.markets is not markets:
+                api.set_markets(markets, currencies)
+                if timeframes:
+                    api.timeframes = timeframes
+        self._markets = self._api_async.markets
 
-        except (asyncio.TimeoutError, ccxt.BaseError) as e:
-            logger.warning('Could not load async markets. Reason: %s', e)
+    def _markets_fetched(self, api: ccxt.Exchange) -> None:
+        """
+        Share the markets just fetched by `api` with the other apis
+        and store them in the markets cache.
+        """
+        self.set_markets(api.markets, api.currencies)
+        self._last_markets_refresh = self._store_markets(api)
+
+    def _store_markets(self, api: ccxt.Exchange) -> int:
+        """
+        Store the markets of `api` in the markets cache, if enabled
+        :return: Timestamp of the markets
+        """
+        if self._markets_cache:
+            return self._markets_cache.store(api.markets, api.currencies, api.timeframes)
+        return arrow.utcnow().int_timestamp
+
+    async def _async_fetch_markets(self, reload: bool = False) -> None:
+        """
+        Fetch markets with the async api
+        """
+        await self._api_async.load_markets(reload=reload)
+        self._markets_fetched(self._api_async)
+
+    def _fetch_markets(self, reload: bool = False) -> None:
+        self.loop.run_until_complete(self._async_fetch_markets(reload=reload))
+
+    def _refresh_markets_background(self) -> None:
+        """
+        Fetch markets in a background thread, keeping the current markets until done.
+        Uses a separate sync api, the async api belongs to the event loop.
+        ccxt's set_markets isn't atomic, so the fetched markets are only used by the apis
+        once the owning thread runs the event loop or calls reload_markets().
+        """
+        if self._markets_refresh_thread and self._markets_refresh_thread.is_alive():
             return
 
+        def _refresh():
+            try:
+                api = self._init_ccxt(self._exchange_config, ccxt_kwargs=self._ccxt_sync_config)
+                api.load_markets()
+                self._pending_markets = {
+                    'markets': api.markets,
+                    'currencies': api.currencies,
+                    'timeframes': api.timeframes,
+                    'timestamp': self._store_markets(api),
+                }
+                logger.info("Markets refreshed.")
+            except (ccxt.BaseError, OperationalException) as e:
+                logger.warning('Could not refresh markets, using cached markets. Reason: %s', e)
+                return
+            try:
+                self.loop.call_soon_threadsafe(self._apply_pending_markets)
+            except RuntimeError:
+                # Loop closed - applied by reload_markets()
+                pass
+
+        self._markets_refresh_thread = threading.Thread(target=_refresh, daemon=True,
+                                                        name=f'{self.id}-markets-refresh')
+        self._markets_refresh_thread.start()
+
+    def _apply_pending_markets(self) -> None:
+        """
+        Use the markets fetched by the background refresh, if there are any.
+        Must run on the thread owning the apis.
+        """
+        snapshot, self._pending_markets = self._pending_markets, None
+        if snapshot:
+            self.set_markets(snapshot['markets'], snapshot['currencies'],
+                             snapshot['timeframes'])
+            self._last_markets_refresh = snapshot['timestamp']
+
+    def _load_cached_markets(self) -> bool:
+        """
+        Use the markets cache if available - a stale snapshot is refreshed in the background.
+        :return: True if markets were loaded from the cache
+        """
+        snapshot = self._markets_cache.load() if self._markets_cache else None
+        if not snapshot:
+            return False
+        logger.info("Using cached markets.")
+        self.set_markets(snapshot['markets'], snapshot.get('currencies'),
+                         snapshot.get('timeframes'))
+        self._last_markets_refresh = snapshot['timestamp']
+        if not self._markets_cache.is_fresh(snapshot):
+            self._refresh_markets_background()
+        return True
+
     def _load_markets(self) -> None:
         """ Initialize markets both sync and async """
+        if self._load_cached_markets():
+            return
         try:
-            self._markets = self._api.load_markets()
-            self._load_async_markets()
-            self._last_markets_refresh = arrow.utcnow().int_timestamp
-        except ccxt.BaseError:
+            self._fetch_markets()
+        except (asyncio.TimeoutError, ccxt.BaseError):
+            logger.exception('Unable to initialize markets.')
+
+    async def _async_load_markets(self) -> None:
+        """ Initialize markets both sync and async, on the running loop """
+        if self._load_cached_markets():
+            return
+        try:
+            await self._async_fetch_markets()
+        except (asyncio.TimeoutError, ccxt.BaseError):
             logger.exception('Unable to initialize markets.')
 
     def reload_markets(self) -> None:
         """Reload markets both sync and async if refresh interval has passed """
+        self._apply_pending_markets()
         # Check whether markets have to be reloaded
         if (self._last_markets_refresh > 0) and (
                 self._last_markets_refresh + self.markets_refresh_interval
                 > arrow.utcnow().int_timestamp):
             return None
+        if self._markets_cache:
+            # The cache may have been refreshed meanwhile (e.g. by another process)
+            snapshot = self._markets_cache.load()
+            if (snapshot and snapshot['timestamp'] > self._last_markets_refresh
+                    and self._markets_cache.is_fresh(snapshot)):
+                self.set_markets(snapshot['markets'], snapshot.get('currencies'),
+                                 snapshot.get('timeframes'))
+                self._last_markets_refresh = snapshot['timestamp']
+                return None
         logger.debug("Performing scheduled market reload..")
         try:
-            self._markets = self._api.load_markets(reload=True)
-            # Also reload async markets to avoid issues with newly listed pairs
-            self._load_async_markets(reload=True)
-            self._last_markets_refresh = arrow.utcnow().int_timestamp
-        except ccxt.BaseError:
+            # Also reloads the sync markets to avoid issues with newly listed pairs
+            self._fetch_markets(reload=True)
+        except (asyncio.TimeoutError, ccxt.BaseError):
             logger.exception("Could not reload markets.")
 
     def validate_stakecurrency(self, stake_currency: str) -> None:
@@ -397,7 +763,7 @@ class Exchange:
         """
         Check if timeframe from config is a supported timeframe on the exchange
         """
-        if not hasattr(self._api, "timeframes") or self._api.timeframes is None:
+        if not hasattr(self._api_async, "timeframes") or self._api_async.timeframes is None:
             # If timeframes attribute is missing (or is None), the exchange probably
             # has no fetchOHLCV method.
             # Therefore we also show that.
@@ -455,7 +821,7 @@ class Exchange:
         :param endpoint: Name of endpoint (e.g. 'fetchOHLCV', 'fetchTickers')
         :return: bool
         """
-        return endpoint in self._api.has and self._api.has[endpoint]
+        return endpoint in self._api_async.has and self._api_async.has[endpoint]
 
     def amount_to_precision(self, pair: str, amount: float) -> float:
         '''
@@ -733,7 +1099,7 @@ class Exchange:
         :param since_ms: Timestamp in milliseconds to get history from
         :return: List with candle (OHLCV) data
         """
-        return asyncio.get_event_loop().run_until_complete(
+        return self.loop.run_until_complete(
             self._async_get_historic_ohlcv(pair=pair, timeframe=timeframe,
                                            since_ms=since_ms))
 
@@ -790,30 +1156,43 @@ class Exchange:
         """
         Refresh in-memory OHLCV asynchronously and set `_klines` with the result
         Loops asynchronously over pair_list and downloads all pairs async (semi-parallel).
+        Pairs already in `_klines` only fetch the candles since their last cached candle,
+        which are merged into the cached candles.
         Only used in the dataprovider.refresh() method.
         :param pair_list: List of 2 element tuples containing pair, interval to refresh
-        :param since_ms: time since when to download, in milliseconds
+        :param since_ms: time since when to download, in milliseconds.
+                         Fetches a full page for every pair if set.
         :param cache: Assign result to _klines. Usefull for one-off downloads like for pairlists
         :return: Dict of [{(pair, timeframe): Dataframe}]
         """
         logger.debug("Refreshing candle (OHLCV) data for %d pairs", len(pair_list))
 
         input_coroutines = []
+        # Pairs fetching only the new candles
+        incremental = set()
 
         # Gather coroutines to run
         for pair, timeframe in set(pair_list):
             if (((pair, timeframe) not in self._klines)
                     or self._now_is_time_to_refresh(pair, timeframe)):
-                input_coroutines.append(self._async_get_candle_history(pair, timeframe,
-                                                                       since_ms=since_ms))
+                since, limit = since_ms, None
+                if since_ms is None:
+                    since, limit = self._refresh_since(pair, timeframe)
+                    if since is not None:
+                        incremental.add((pair, timeframe))
+                input_coroutines.append(self._async_get_candle_history(
+                    pair, timeframe, since_ms=since, limit=limit))
             else:
                 logger.debug(
                     "Using cached candle (OHLCV) data for pair %s, timeframe %s ...",
                     pair, timeframe
                 )
 
-        results = asyncio.get_event_loop().run_until_complete(
-            asyncio.gather(*input_coroutines, return_exceptions=True))
+        async def _gather():
+            # gather() outside of a coroutine would bind to the default loop instead
+            return await asyncio.gather(*input_coroutines, return_exceptions=True)
+
+        results = self.loop.run_until_complete(_gather())
 
         results_df = {}
         # handle caching
@@ -827,14 +1206,61 @@ class Exchange:
             if ticks:
                 self._pairs_last_refresh_time[(pair, timeframe)] = ticks[-1][0] // 1000
             # keeping parsed dataframe in cache
-            ohlcv_df = ohlcv_to_dataframe(
-                    ticks, timeframe, pair=pair, fill_missing=True,
-                    drop_incomplete=self._ohlcv_partial_candle)
+            if (pair, timeframe) in incremental:
+                ohlcv_df = self._merge_klines(pair, timeframe, ticks, cache)
+            else:
+                ohlcv_df = ohlcv_to_dataframe(
+                        ticks, timeframe, pair=pair, fill_missing=True,
+                        drop_incomplete=self._ohlcv_partial_candle)
+                if cache:
+                    self._klines.set((pair, timeframe), ohlcv_df,
+                                     capacity=self.ohlcv_candle_limit(timeframe))
+                    ohlcv_df = self._klines[(pair, timeframe)]
             results_df[(pair, timeframe)] = ohlcv_df
-            if cache:
-                self._klines[(pair, timeframe)] = ohlcv_df
         return results_df
 
+    def _refresh_since(self, pair: str, timeframe: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Since and limit to fetch only the candles missing in `_klines`.
+        Starts at the last cached candle, which is fetched again in case it was incomplete.
+        :return: (since_ms, limit), (None, None) to fetch a full page
+        """
+        since_ms = self._klines.last_date((pair, timeframe))
+        if since_ms is None:
+            return None, None
+        timeframe_ms = timeframe_to_msecs(timeframe)
+        # Candles since the last cached one, plus the one currently open
+        limit = (arrow.utcnow().int_timestamp * 1000 - since_ms) // timeframe_ms + 2
+        if limit > self.ohlcv_candle_limit(timeframe):
+            # Too far behind - a full page replaces the cached candles
+            return None, None
+        return since_ms, limit
+
+    def _merge_klines(self, pair: str, timeframe: str, ticks: List,
+                      cache: bool = True) -> DataFrame:
+        """
+        Merge candles fetched since the last cached candle into `_klines`.
+        Keeps at most ohlcv_candle_limit candles, like a full refresh.
+        :param ticks: OHLCV list starting at (or after) the last cached candle
+        :param cache: Update `_klines` in place - otherwise only the merged dataframe is built
+        :return: Merged dataframe (read-only view if cache is True)
+        """
+        cached = self._klines[(pair, timeframe)]
+        last = cached.iloc[-1]
+        last_ms = last['date'].value // 10 ** 6
+        if not ticks or ticks[0][0] > last_ms:
+            # Prepend the last cached candle, so missing candles in between are filled
+            ticks = [[last_ms, *last[['open', 'high', 'low', 'close', 'volume']]], *ticks]
+        new = ohlcv_to_dataframe(ticks, timeframe, pair=pair, fill_missing=True,
+                                 drop_incomplete=self._ohlcv_partial_candle)
+        if new.empty:
+            return cached
+        if cache:
+            self._klines.update((pair, timeframe), new)
+            return self._klines[(pair, timeframe)]
+        merged = concat([cached[cached['date'] < new['date'].iloc[0]], new], ignore_index=True)
+        return merged.iloc[-self.ohlcv_candle_limit(timeframe):].reset_index(drop=True)
+
     def _now_is_time_to_refresh(self, pair: str, timeframe: str) -> bool:
         # Timeframe in seconds
         interval_in_sec = timeframe_to_seconds(timeframe)
@@ -844,9 +1270,11 @@ class Exchange:
 
     @retrier_async
     async def _async_get_candle_history(self, pair: str, timeframe: str,
-                                        since_ms: Optional[int] = None) -> Tuple[str, str, List]:
+                                        since_ms: Optional[int] = None,
+                                        limit: Optional[int] = None) -> Tuple[str, str, List]:
         """
         Asynchronously get candle history data using fetch_ohlcv
+        :param limit: Number of candles to fetch, defaults to ohlcv_candle_limit
         returns tuple: (pair, timeframe, ohlcv_list)
         """
         try:
@@ -856,8 +1284,10 @@ class Exchange:
                 "Fetching pair %s, interval %s, since %s %s...",
                 pair, timeframe, since_ms, s
             )
-            limit = self.ohlcv_candle_limit(timeframe)
+            limit = limit or self.ohlcv_candle_limit(timeframe)
+            await self._ratelimiter.acquire('fetch_ohlcv')
             data = await self._api_async.fetch_ohlcv(pair, timeframe=timeframe, since=since_ms, limit=limit)
+            self._ratelimiter.update_from_headers(self._api_async.last_response_headers)
 
             # Some exchanges sort OHLCV in ASC order and others in DESC.
             # Ex: Bittrex returns the list of OHLCV in ASC order (oldest first, newest last)
@@ -874,9 +1304,10 @@ class Exchange:
 
         except ccxt.NotSupported as e:
             raise OperationalException(
-                f'Exchange {self._api.name} does not support fetching historical '
+                f'Exchange {self.name} does not support fetching historical '
                 f'candle (OHLCV) data. Message: {e}') from e
         except ccxt.DDoSProtection as e:
+            self._ratelimiter.drain()
             raise DDosProtection(e) from e
         except (ccxt.NetworkError, ccxt.ExchangeError) as e:
             raise TemporaryError(f'Could not fetch historical candle (OHLCV) data '
@@ -889,32 +1320,34 @@ class Exchange:
     @retrier_async
     async def _async_fetch_trades(self, pair: str,
                                   since: Optional[int] = None,
-                                  params: Optional[dict] = None) -> List[List]:
+                                  params: Optional[dict] = None) -> TradeBatch:
         """
         Asyncronously gets trade history using fetch_trades.
         Handles exchange errors, does one call to the exchange.
         :param pair: Pair to fetch trade data for
         :param since: Since as integer timestamp in milliseconds
-        returns: List of dicts containing trades
+        returns: TradeBatch containing trades
         """
         try:
             # fetch trades asynchronously
+            await self._ratelimiter.acquire('fetch_trades')
             if params:
                 logger.debug("Fetching trades for pair %s, params: %s ", pair, params)
-                trades = await self._api_async.fetch_trades(pair, params=params, limit=1000)
             else:
                 logger.debug(
                     "Fetching trades for pair %s, since %s %s...",
                     pair,  since,
                     '(' + arrow.get(since // 1000).isoformat() + ') ' if since is not None else ''
                 )
-                trades = await self._api_async.fetch_trades(pair, since=since, limit=1000)
-            return trades_dict_to_list(trades)
+            trades = await self._async_fetch_trades_batch(pair, since=since, params=params)
+            self._ratelimiter.update_from_headers(self._api_async.last_response_headers)
+            return trades
         except ccxt.NotSupported as e:
             raise OperationalException(
-                f'Exchange {self._api.name} does not support fetching historical trade data.'
+                f'Exchange {self.name} does not support fetching historical trade data.'
                 f'Message: {e}') from e
         except ccxt.DDoSProtection as e:
+            self._ratelimiter.drain()
             raise DDosProtection(e) from e
         except (ccxt.NetworkError, ccxt.ExchangeError) as e:
             raise TemporaryError(f'Could not load trade history due to {e.__class__.__name__}. '
@@ -922,10 +1355,25 @@ class Exchange:
         except ccxt.BaseError as e:
             raise OperationalException(f'Could not fetch trade data. Msg: {e}') from e
 
-    async def _async_get_trade_history_id(self, pair: str,
-                                          until: int,
-                                          since: Optional[int] = None,
-                                          from_id: Optional[str] = None) -> Tuple[str, List[List]]:
+    async def _async_fetch_trades_batch(self, pair: str,
+                                        since: Optional[int] = None,
+                                        params: Optional[dict] = None) -> TradeBatch:
+        """
+        One fetch_trades call, converted to a TradeBatch.
+        Subclasses can override this to decode the raw endpoint response instead.
+        Exceptions are handled by `_async_fetch_trades`.
+        """
+        if params:
+            trades = await self._api_async.fetch_trades(pair, params=params, limit=1000)
+        else:
+            trades = await self._api_async.fetch_trades(pair, since=since, limit=1000)
+        return TradeBatch.from_dicts(trades)
+
+    async def _async_iter_trade_history_id(self, pair: str,
+                                           until: int,
+                                           since: Optional[int] = None,
+                                           from_id: Optional[str] = None
+                                           ) -> AsyncIterator[TradeBatch]:
         """
         Asyncronously gets trade history using fetch_trades
         use this when exchange uses id-based iteration (check `self._trades_pagination`)
@@ -933,11 +1381,9 @@ class Exchange:
         :param since: Since as integer timestamp in milliseconds
         :param until: Until as integer timestamp in milliseconds
         :param from_id: Download data starting with ID (if id is known). Ignores "since" if set.
-        returns tuple: (pair, trades-list)
+        :return: Async generator yielding one TradeBatch per page, in download order
         """
 
-        trades: List[List] = []
-
         if not from_id:
             # Fetch first elements using timebased method to get an ID to paginate on
             # Depending on the Exchange, this can introduce a drift at the start of the interval
@@ -949,56 +1395,174 @@ class Exchange:
             # DEFAULT_TRADES_COLUMNS: 1 -> id
             if t:
                 from_id = t[-1][1]
-                trades.extend(t[:-1])
+                yield t[:-1]
             else:
-                return (pair, None)
+                return
 
-        last_printed_month = None  # per customizzare il messaggio durante il download
+        last_logged_month = None  # per customizzare il messaggio durante il download
         while True:
             t = await self._async_fetch_trades(pair, params={self._trades_pagination_arg: from_id})
             if t:
-                # Skip last id since its the key for the next call
-                trades.extend(t[:-1])
                 if from_id == int(t[-1][1]) or t[-1][0] > until:
                     #logger.debug(f"Stopping because from_id did not change. "
                     #             f"Reached {t[-1][0]} > {until}")
                     # Reached the end of the defined-download period - add last trade as well.
-                    trades.extend(t[-1:])
+                    yield t
                     break
+                # Skip last id since its the key for the next call
+                yield t[:-1]
 
-                timestamp_milliseconds = trades[-1][0]
-                datetime_object = datetime.fromtimestamp(timestamp_milliseconds / 1000)
-                #current_datetime = datetime.strptime(str(int(ts)), "%Y-%m-%d %H:%M:%S.%f")
-                if last_printed_month is None or datetime_object.month > last_printed_month:
-                    print(datetime_object)
-                    last_printed_month = datetime_object.month
-                else: print('.',end="")
+                last_logged_month = self._log_trades_progress(pair, t[-1][0],
+                                                              last_logged_month)
 
                 from_id = int(t[-1][1])
             else:
                 break
 
-        return (pair, trades)
+    async def _async_iter_trade_history_id_sharded(self, pair: str,
+                                                   until: int,
+                                                   since: Optional[int] = None,
+                                                   from_id: Optional[str] = None
+                                                   ) -> AsyncIterator[TradeBatch]:
+        """
+        Asyncronously gets trade history using fetch_trades, splitting the id window
+        into page-sized id ranges which are fetched `self._trades_pagination_shards` at a time.
+        Requires integer trade ids (check `self._trades_pagination_shards`).
+        Each range [start, start + page) is covered by one call with `fromId=start`, and only
+        trades with an id inside the range are kept - so ranges never overlap.
+        :param pair: Pair to fetch trade data for
+        :param since: Since as integer timestamp in milliseconds
+        :param until: Until as integer timestamp in milliseconds
+        :param from_id: Download data starting with ID (if id is known). Ignores "since" if set.
+        :return: Async generator yielding one TradeBatch per round of ranges, in id order
+        """
+        # Matches the limit used by _async_fetch_trades
+        page_size = 1000
+
+        # DEFAULT_TRADES_COLUMNS: 0 -> timestamp
+        # DEFAULT_TRADES_COLUMNS: 1 -> id
+        if not from_id:
+            t = await self._async_fetch_trades(pair, since=since)
+            if not t:
+                return
+            from_id = t[0][1]
+        start_id = int(from_id)
+
+        # The first trade at "until" closes the window.
+        # Time-based fetches may only cover a short window after "until" (1h on Binance) -
+        # without trades in there, the end is searched by id starting from the latest trade.
+        t = await self._async_fetch_trades(pair, since=until)
+        if t:
+            end_id = int(t[0][1])
+        else:
+            t = await self._async_fetch_trades(pair)
+            if not t:
+                return
+            if t[-1][0] < until:
+                # until is in the future
+                end_id = int(t[-1][1]) + 1
+            else:
+                end_id = await self._async_find_trade_id(pair, until, start_id,
+                                                         int(t[-1][1]))
+        if end_id <= start_id:
+            # All trades from start_id on are after until (e.g. pair listed after until) -
+            # like the serial download, the first page is returned, so the next download
+            # continues from there.
+            t = await self._async_fetch_trades(pair, params={self._trades_pagination_arg: start_id})
+            if t:
+                yield t
+            return
+
+        range_starts = range(start_id, end_id, page_size)
+        logger.debug(f"Fetching trades for {pair}, ids {start_id} - {end_id} "
+                     f"in {len(range_starts)} ranges.")
+        last_logged_month = None  # per customizzare il messaggio durante il download
+        for i in range(0, len(range_starts), self._trades_pagination_shards):
+            starts = range_starts[i:i + self._trades_pagination_shards]
+            results = await asyncio.gather(*[
+                self._async_fetch_trades(pair, params={self._trades_pagination_arg: start})
+                for start in starts])
+            # Stitch the ranges back together in id order
+            ranges = []
+            for start, t in zip(starts, results):
+                stop = min(start + page_size, end_id)
+                ids = t.ids.astype(np.int64)
+                ranges.append(t[(ids >= start) & (ids < stop)])
+            trades = TradeBatch.concat(ranges)
+            yield trades
+
+            if trades:
+                last_logged_month = self._log_trades_progress(pair, trades[-1][0],
+                                                              last_logged_month)
+
+    @staticmethod
+    def _log_trades_progress(pair: str, timestamp: int,
+                             last_logged_month: Optional[Tuple[int, int]]
+                             ) -> Tuple[int, int]:
+        """
+        Log the progress of a trades download - once per month of trades at info level,
+        every page at debug level.
+        :param timestamp: Timestamp (ms) of the last downloaded trade
+        :param last_logged_month: (year, month) returned by the previous call
+        :return: (year, month) of the timestamp
+        """
+        date = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+        month = (date.year, date.month)
+        if month != last_logged_month:
+            logger.info(f"Downloading trades for {pair}: reached {date:%Y-%m-%d %H:%M:%S}.")
+        else:
+            logger.debug(f"Downloading trades for {pair}: reached {date:%Y-%m-%d %H:%M:%S}.")
+        return month
+
+    async def _async_find_trade_id(self, pair: str, timestamp: int,
+                                   low: int, high: int) -> int:
+        """
+        Binary search for the first trade at or after `timestamp`, using id-based fetches.
+        :param timestamp: Timestamp in milliseconds
+        :param low: Trade id before `timestamp` (or the lowest id to consider)
+        :param high: Id of a trade at or after `timestamp`
+        :return: Id of the first trade at or after `timestamp`
+        """
+        # DEFAULT_TRADES_COLUMNS: 0 -> timestamp
+        # DEFAULT_TRADES_COLUMNS: 1 -> id
+        found = high
+        while low < high:
+            mid = (low + high) // 2
+            t = await self._async_fetch_trades(pair, params={self._trades_pagination_arg: mid})
+            if not t:
+                high = mid
+                continue
+            ids = t.ids.astype(np.int64)
+            after = np.flatnonzero(t.timestamp >= timestamp)
+            if not after.size:
+                low = int(ids[-1]) + 1
+            elif after[0] > 0:
+                return int(ids[after[0]])
+            else:
+                # No trades with ids between mid and the first trade of the page
+                found = int(ids[0])
+                high = mid
+        return found
 
-    async def _async_get_trade_history_time(self, pair: str, until: int,
-                                            since: Optional[int] = None) -> Tuple[str, List[List]]:
+    async def _async_iter_trade_history_time(self, pair: str, until: int,
+                                             since: Optional[int] = None
+                                             ) -> AsyncIterator[TradeBatch]:
         """
         Asyncronously gets trade history using fetch_trades,
         when the exchange uses time-based iteration (check `self._trades_pagination`)
         :param pair: Pair to fetch trade data for
         :param since: Since as integer timestamp in milliseconds
         :param until: Until as integer timestamp in milliseconds
-        returns tuple: (pair, trades-list)
+        :return: Async generator yielding one TradeBatch per page
         """
 
-        trades: List[List] = []
         # DEFAULT_TRADES_COLUMNS: 0 -> timestamp
         # DEFAULT_TRADES_COLUMNS: 1 -> id
         while True:
             t = await self._async_fetch_trades(pair, since=since)
             if t:
                 since = t[-1][0]
-                trades.extend(t)
+                yield t
                 # Reached the end of the defined-download period
                 if until and t[-1][0] > until:
                     logger.debug(
@@ -1007,38 +1571,58 @@ class Exchange:
             else:
                 break
 
-        return (pair, trades)
-
-    async def _async_get_trade_history(self, pair: str,
-                                       since: Optional[int] = None,
-                                       until: Optional[int] = None,
-                                       from_id: Optional[str] = None) -> Tuple[str, List[List]]:
+    def _async_iter_trade_history(self, pair: str,
+                                  since: Optional[int] = None,
+                                  until: Optional[int] = None,
+                                  from_id: Optional[str] = None) -> AsyncIterator[TradeBatch]:
         """
-        Async wrapper handling downloading trades using either time or id based methods.
+        Async generator handling downloading trades using either time or id based methods.
+        Yields trades page by page, so callers can process them without keeping the full
+        download in memory.
         """
 
-        logger.debug(f"_async_get_trade_history(), pair: {pair}, "
+        logger.debug(f"_async_iter_trade_history(), pair: {pair}, "
                      f"since: {since}, until: {until}, from_id: {from_id}")
 
         if until is None:
             until = ccxt.Exchange.milliseconds()
             logger.debug(f"Exchange milliseconds: {until}")
+        # Sent as startTime by some exchanges - must not be a float
+        until = int(until)
 
         if self._trades_pagination == 'time':
-            return await self._async_get_trade_history_time(
+            return self._async_iter_trade_history_time(
                 pair=pair, since=since, until=until)
         elif self._trades_pagination == 'id':
-            return await self._async_get_trade_history_id(
+            if self._trades_pagination_shards > 1:
+                return self._async_iter_trade_history_id_sharded(
+                    pair=pair, since=since, until=until, from_id=from_id
+                )
+            return self._async_iter_trade_history_id(
                 pair=pair, since=since, until=until, from_id=from_id
             )
         else:
             raise OperationalException(f"Exchange {self.name} does use neither time, "
                                        f"nor id based pagination")
 
+    async def _async_get_trade_history(self, pair: str,
+                                       since: Optional[int] = None,
+                                       until: Optional[int] = None,
+                                       from_id: Optional[str] = None) -> Tuple[str, TradeBatch]:
+        """
+        Async wrapper collecting all trades of `_async_iter_trade_history`.
+        returns tuple: (pair, TradeBatch)
+        """
+        pages: List[TradeBatch] = []
+        async for t in self._async_iter_trade_history(pair=pair, since=since,
+                                                      until=until, from_id=from_id):
+            pages.append(t)
+        return (pair, TradeBatch.concat(pages))
+
     def get_historic_trades(self, pair: str,
                             since: Optional[int] = None,
                             until: Optional[int] = None,
-                            from_id: Optional[str] = None) -> Tuple[str, List]:
+                            from_id: Optional[str] = None) -> Tuple[str, TradeBatch]:
         """
         Get trade history data using asyncio.
         Handles all async work and returns the list of candles.
@@ -1047,12 +1631,12 @@ class Exchange:
         :param since: Timestamp in milliseconds to get history from
         :param until: Timestamp in milliseconds. Defaults to current timestamp if not defined.
         :param from_id: Download data starting with ID (if id is known)
-        :returns List of trade data
+        :returns TradeBatch of trade data
         """
         if not self.exchange_has("fetchTrades"):
             raise OperationalException("This exchange does not suport downloading Trades.")
 
-        return asyncio.get_event_loop().run_until_complete(
+        return self.loop.run_until_complete(
             self._async_get_trade_history(pair=pair, since=since,
                                           until=until, from_id=from_id))
 
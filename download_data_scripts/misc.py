@@ -3,10 +3,11 @@ Various tool function for Freqtrade and scripts
 """
 import gzip
 import logging
+import os
 import re
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Tuple
 from typing.io import IO
 
 import rapidjson
@@ -77,6 +78,21 @@ def file_dump_json(filename: Path, data: Any, is_zip: bool = False, log: bool =
     logger.debug(f'done json to "{filename}"')
 
 
+def file_dump_json_atomic(filename: Path, data: Any) -> None:
+    """
+    Dump JSON data into a file, without ever leaving a partially written file behind.
+    Data is written to a temporary file, flushed to disk and moved in place.
+    :param filename: file to create or replace
+    :param data: JSON Data to save
+    """
+    tmp_filename = filename.with_name(filename.name + '.tmp')
+    with open(tmp_filename, 'w') as fp:
+        rapidjson.dump(data, fp, default=str, number_mode=rapidjson.NM_NATIVE)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_filename, filename)
+
+
 def json_load(datafile: IO) -> Any:
     """
     load data with rapidjson
@@ -106,6 +122,78 @@ def file_load_json(file):
     return pairdata
 
 
+def file_read_tail(filename: Path, separator: bytes, count: int,
+                   block_size: int = 64 * 1024) -> Tuple[bytes, int]:
+    """
+    Read the end of a file backwards, one block at a time, until it contains
+    at least `count` separators or the start of the file is reached.
+    :param filename: file to read
+    :param separator: single byte to count (e.g. b'\\n')
+    :param count: number of separators needed
+    :param block_size: bytes read per step
+    :return: Tuple of (data read, offset of the data in the file)
+    """
+    blocks = []
+    found = 0
+    with open(filename, 'rb') as fp:
+        offset = fp.seek(0, os.SEEK_END)
+        while offset > 0 and found < count:
+            step = min(block_size, offset)
+            offset -= step
+            fp.seek(offset)
+            block = fp.read(step)
+            found += block.count(separator)
+            blocks.append(block)
+    return b''.join(reversed(blocks)), offset
+
+
+def file_bisect(fp: IO, target: Any, record_key: Callable[[bytes], Any],
+                separator: bytes, start: int, end: int, block_size: int = 4096) -> int:
+    """
+    Binary search in a file of records sorted by key, without reading the whole file.
+    Records are separated by `separator`, the first one starts at offset `start`.
+    :param fp: file opened in binary mode
+    :param target: key to search for
+    :param record_key: key of a record, from the bytes at the start of the record
+    :param separator: bytes between two records (e.g. b'\\n')
+    :param start: offset of the first record
+    :param end: offset of the end of the last record
+    :param block_size: bytes read per step
+    :return: offset of the first record with a key >= target, `end` if there's none
+    """
+    def record_at(pos: int) -> int:
+        # Offset of the first record starting at or after pos
+        if pos <= start:
+            return start
+        pos -= len(separator)
+        fp.seek(pos)
+        data = b''
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                return end
+            data += block
+            idx = data.find(separator)
+            if idx >= 0:
+                return min(pos + idx + len(separator), end)
+
+    def is_after(pos: int) -> bool:
+        record = record_at(pos)
+        if record >= end:
+            return True
+        fp.seek(record)
+        return record_key(fp.read(block_size)) >= target
+
+    low, high = start, end
+    while low < high:
+        mid = (low + high) // 2
+        if is_after(mid):
+            high = mid
+        else:
+            low = mid + 1
+    return record_at(low)
+
+
 def pair_to_filename(pair: str) -> str:
     for ch in ['/', '-', ' ', '.', '@', '$', '+', ':']:
         pair = pair.replace(ch, '_')
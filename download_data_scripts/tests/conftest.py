@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+
+# Modules are imported from the script directory (e.g. `import misc`)
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import DEFAULT_DATAFRAME_COLUMNS
+from data.converter import clean_ohlcv_dataframe, ohlcv_group_numpy, ohlcv_to_dataframe
+from exchange import timeframe_to_minutes
+
+
+TIMEFRAMES = ['1m', '5m', '1h', '4h', '1d', '1w']
+
+
+def make_ohlcv(timeframe, rows=500, gaps=0.0, duplicates=0.0, shuffle=False, offset=None,
+               seed=0):
+    """
+    Candles of timeframe starting at 2021-01-01 (a friday)
+    :param gaps: Fraction of candles removed
+    :param duplicates: Fraction of candles repeated with other values
+    :param shuffle: Shuffle the rows
+    :param offset: Shift the dates by this Timedelta (dates not aligned to the timeframe)
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2021-01-01', periods=rows,
+                          freq=f'{timeframe_to_minutes(timeframe)}min', tz='UTC')
+    if offset is not None:
+        dates = dates + offset
+    df = pd.DataFrame({
+        'date': dates,
+        'open': rng.random(rows),
+        'high': rng.random(rows) + 1,
+        'low': rng.random(rows) - 1,
+        'close': rng.random(rows),
+        'volume': rng.random(rows) * 100,
+    }, columns=DEFAULT_DATAFRAME_COLUMNS)
+    if gaps:
+        # Keep the first and last candle
+        keep = rng.random(rows) >= gaps
+        keep[[0, -1]] = True
+        df = df.loc[keep]
+    if duplicates:
+        dups = df.sample(frac=duplicates, random_state=seed)
+        dups[DEFAULT_DATAFRAME_COLUMNS[1:]] = rng.random((len(dups), 5))
+        df = pd.concat([df, dups]).sort_values('date', kind='stable')
+    if shuffle:
+        df = df.sample(frac=1, random_state=seed)
+    return df.reset_index(drop=True)
+
+
+CASES = {
+    'clean': {},
+    'gaps': {'gaps': 0.1},
+    'duplicates': {'duplicates': 0.05},
+    'gaps_duplicates': {'gaps': 0.1, 'duplicates': 0.05},
+    'unsorted': {'gaps': 0.1, 'duplicates': 0.05, 'shuffle': True},
+    'misaligned': {'gaps': 0.1, 'offset': pd.Timedelta(seconds=17)},
+}
+
+
+def clean_both(df, timeframe, **kwargs):
+    return [clean_ohlcv_dataframe(df.copy(), timeframe, 'ETH/BTC', engine=engine, **kwargs)
+            for engine in ('pandas', 'numpy')]
+
+
+@pytest.mark.parametrize('drop_incomplete', [True, False])
+@pytest.mark.parametrize('fill_missing', [True, False])
+@pytest.mark.parametrize('case', CASES)
+@pytest.mark.parametrize('timeframe', TIMEFRAMES)
+def test_clean_ohlcv_dataframe_engines(timeframe, case, fill_missing, drop_incomplete):
+    df = make_ohlcv(timeframe, **CASES[case])
+
+    expected, result = clean_both(df, timeframe, fill_missing=fill_missing,
+                                  drop_incomplete=drop_incomplete)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('case', CASES)
+@pytest.mark.parametrize('timeframe', TIMEFRAMES)
+def test_ohlcv_group_numpy_handled(timeframe, case):
+    # The comparison above must not pass just because numpy falls back to pandas
+    df = make_ohlcv(timeframe, **CASES[case])
+    grouped = ohlcv_group_numpy(df, volume='max')
+    assert grouped is not None
+    assert grouped['date'].is_unique and grouped['date'].is_monotonic_increasing
+    filled = ohlcv_group_numpy(grouped, volume='sum',
+                               timeframe_minutes=timeframe_to_minutes(timeframe))
+    assert filled is not None
+    assert (filled['volume'] >= 0).all()
+
+
+def test_ohlcv_group_numpy_fallback():
+    df = make_ohlcv('1h', duplicates=0.05)
+    # Volumes of candles sharing a slot would be summed
+    assert ohlcv_group_numpy(df, volume='sum', timeframe_minutes=60) is None
+    assert ohlcv_group_numpy(df.iloc[:0], volume='max') is None
+
+    df.loc[3, 'close'] = np.nan
+    assert ohlcv_group_numpy(df, volume='max') is None
+    # NaN values are still handled, by pandas
+    expected, result = clean_both(df, '1h')
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_ohlcv_to_dataframe_engines():
+    df = make_ohlcv('5m', gaps=0.1, duplicates=0.05, shuffle=True)
+    ohlcv = [[int(d.timestamp() * 1000), *v]
+             for d, v in zip(df['date'], df[DEFAULT_DATAFRAME_COLUMNS[1:]].values.tolist())]
+
+    expected, result = [ohlcv_to_dataframe(ohlcv, '5m', 'ETH/BTC', engine=engine)
+                        for engine in ('pandas', 'numpy')]
+    pd.testing.assert_frame_equal(result, expected)
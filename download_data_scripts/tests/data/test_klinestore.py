@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import DEFAULT_DATAFRAME_COLUMNS
+from data import klinestore
+from data.klinestore import KlineStore
+
+
+KEY = ('ETH/BTC', '5m')
+
+
+def make_ohlcv(rows, start='2021-01-01'):
+    values = np.arange(rows * 5, dtype=np.float64).reshape(rows, 5)
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=rows, freq='5min', tz='UTC'),
+        **{col: values[:, i] for i, col in enumerate(DEFAULT_DATAFRAME_COLUMNS[1:])}
+    }, columns=DEFAULT_DATAFRAME_COLUMNS)
+
+
+@pytest.mark.parametrize('views', [
+    pytest.param(True, marks=pytest.mark.skipif(not klinestore._FRAME_VIEWS,
+                                                reason='pandas >= 2.2')),
+    False,
+])
+def test_klinestore_frames(monkeypatch, views):
+    monkeypatch.setattr(klinestore, '_FRAME_VIEWS', views)
+    full = make_ohlcv(30)
+    store = KlineStore()
+    store.set(KEY, full.iloc[:15], capacity=20)
+    # Replaces the last candle, drops the oldest beyond capacity
+    store.update(KEY, full.iloc[14:30])
+
+    frame = store[KEY]
+    pd.testing.assert_frame_equal(frame, full.iloc[10:].reset_index(drop=True))
+    assert store.last_date(KEY) == full['date'].iloc[-1].value // 10 ** 6
+    # Columns can always be added
+    frame['sma'] = frame['close'].rolling(3).mean()
+    assert list(store[KEY].columns) == DEFAULT_DATAFRAME_COLUMNS
+
+    if views:
+        with pytest.raises(ValueError, match='read-only'):
+            frame['close'].values[0] = 0
+    else:
+        frame.loc[0, 'close'] = 0
+        assert store[KEY]['close'].iloc[0] == full['close'].iloc[10]
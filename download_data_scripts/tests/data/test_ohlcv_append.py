@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import DEFAULT_DATAFRAME_COLUMNS
+from data.history.idatahandler import get_datahandler
+
+
+PAIR = 'ETH/BTC'
+TIMEFRAME = '1h'
+FORMATS = ['csv', 'json', 'jsongz', 'hdf5', 'parquet', 'npy']
+
+
+def make_ohlcv(rows, start='2021-01-01', freq='1h', seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'date': pd.date_range(start, periods=rows, freq=freq, tz='UTC'),
+        'open': rng.random(rows),
+        'high': rng.random(rows) + 1,
+        'low': rng.random(rows) - 1,
+        'close': rng.random(rows),
+        'volume': rng.random(rows) * 100,
+    }, columns=DEFAULT_DATAFRAME_COLUMNS)
+
+
+def load(dh):
+    return dh._ohlcv_load(PAIR, TIMEFRAME, timerange=None).reset_index(drop=True)
+
+
+def assert_stored(dh, expected):
+    expected = expected.reset_index(drop=True)
+    pd.testing.assert_frame_equal(load(dh), expected, check_dtype=False)
+    assert dh.ohlcv_data_min_max(PAIR, TIMEFRAME) == (expected['date'].iloc[0],
+                                                      expected['date'].iloc[-1])
+
+
+@pytest.mark.parametrize('data_format', FORMATS)
+def test_ohlcv_append(tmp_path, data_format):
+    dh = get_datahandler(tmp_path, data_format)
+    full = make_ohlcv(200)
+    dh.ohlcv_store(PAIR, TIMEFRAME, full.iloc[:100])
+
+    # Overlapping: the last stored candle was incomplete and is replaced
+    update = full.iloc[90:150].copy()
+    dh.ohlcv_append(PAIR, TIMEFRAME, update)
+    assert_stored(dh, full.iloc[:150])
+
+    # Only older candles - nothing changes
+    dh.ohlcv_append(PAIR, TIMEFRAME, full.iloc[10:20])
+    assert_stored(dh, full.iloc[:150])
+
+    # Gap: the missing candles are not filled on append
+    dh.ohlcv_append(PAIR, TIMEFRAME, full.iloc[170:])
+    assert_stored(dh, pd.concat([full.iloc[:150], full.iloc[170:]]))
+
+
+@pytest.mark.parametrize('data_format', FORMATS)
+def test_ohlcv_append_replace_last(tmp_path, data_format):
+    dh = get_datahandler(tmp_path, data_format)
+    full = make_ohlcv(50)
+    dh.ohlcv_store(PAIR, TIMEFRAME, full.iloc[:30])
+
+    # Same date as the last stored candle, other values
+    update = make_ohlcv(21, start=full['date'].iloc[29], seed=1)
+    dh.ohlcv_append(PAIR, TIMEFRAME, update)
+    assert_stored(dh, pd.concat([full.iloc[:29], update]))
+
+
+@pytest.mark.parametrize('data_format', FORMATS)
+def test_ohlcv_append_empty(tmp_path, data_format):
+    dh = get_datahandler(tmp_path, data_format)
+    full = make_ohlcv(50)
+    # Stored without candles (e.g. `[]` for json)
+    dh.ohlcv_store(PAIR, TIMEFRAME, full.iloc[:0])
+    assert load(dh).empty
+
+    dh.ohlcv_append(PAIR, TIMEFRAME, full)
+    assert_stored(dh, full)
+
+
+@pytest.mark.parametrize('data_format', FORMATS)
+def test_ohlcv_append_new_file(tmp_path, data_format):
+    dh = get_datahandler(tmp_path, data_format)
+    full = make_ohlcv(50)
+
+    dh.ohlcv_append(PAIR, TIMEFRAME, full.iloc[:20])
+    dh.ohlcv_append(PAIR, TIMEFRAME, full.iloc[19:])
+    assert_stored(dh, full)
@@ -0,0 +1,54 @@
+import ccxt
+import numpy as np
+import pytest
+
+from data.converter import trades_dict_to_list
+from exchange.binance import RAW_TRADES_KEYS, Binance
+
+
+# GET /api/v3/aggTrades
+AGG_TRADES = [
+    {'a': 26129, 'p': '0.01633102', 'q': '4.70443515', 'f': 27781, 'l': 27781,
+     'T': 1498793709153, 'm': True, 'M': True},
+    {'a': 26130, 'p': '0.01633102', 'q': '0.1', 'f': 27782, 'l': 27784,
+     'T': 1498793709153, 'm': False, 'M': True},
+    {'a': 26131, 'p': '19350.01', 'q': '0.00300000', 'f': 27785, 'l': 27785,
+     'T': 1498793709160, 'm': False, 'M': True},
+    {'a': 26132, 'p': '19349.99', 'q': '1.23456789', 'f': 27786, 'l': 27790,
+     'T': 1498793710001, 'm': True, 'M': True},
+]
+
+# GET /api/v3/historicalTrades
+HISTORICAL_TRADES = [
+    {'id': 28457, 'price': '4.00000100', 'qty': '12.00000000', 'quoteQty': '48.000012',
+     'time': 1499865549590, 'isBuyerMaker': True, 'isBestMatch': True},
+    {'id': 28458, 'price': '0.30000000', 'qty': '0.10000000', 'quoteQty': '0.03',
+     'time': 1499865549590, 'isBuyerMaker': False, 'isBestMatch': True},
+    {'id': 28460, 'price': '19350.01', 'qty': '0.00300000', 'quoteQty': '58.05003',
+     'time': 1499865549612, 'isBuyerMaker': False, 'isBestMatch': True},
+]
+
+
+@pytest.mark.parametrize('method,response', [
+    ('publicGetAggTrades', AGG_TRADES),
+    ('publicGetHistoricalTrades', HISTORICAL_TRADES),
+])
+def test__decode_raw_trades(method, response):
+    api = ccxt.binance()
+    expected = trades_dict_to_list(api.parse_trades(response))
+
+    trades = Binance._decode_raw_trades(response, RAW_TRADES_KEYS[method])
+
+    assert len(trades) == len(expected)
+    result = trades.to_list()
+    for col, name in enumerate(['timestamp', 'id', 'type', 'side', 'price', 'amount']):
+        assert [t[col] for t in result] == [t[col] for t in expected], name
+    # ccxt multiplies the decimal strings - cost may differ in the last bit
+    assert np.isclose([t[6] for t in result], [t[6] for t in expected], rtol=1e-15,
+                      atol=0).all()
+
+
+def test__decode_raw_trades_empty():
+    trades = Binance._decode_raw_trades([], RAW_TRADES_KEYS['publicGetAggTrades'])
+    assert len(trades) == 0
+    assert trades.to_list() == []
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from data.tradebatch import TradeBatch
+from exchange.binance import Binance
+
+
+HOUR_MS = 3600 * 1000
+PAGE_SIZE = 1000
+
+
+class FakeBinance(Binance):
+    """
+    Binance serving trades from a list instead of the api:
+    fromId returns the next 1000 trades, since the first 1000 trades within one hour.
+    """
+
+    def __init__(self, trades, shards):
+        super().__init__({'dry_run': True, 'stake_currency': 'USDT',
+                          'exchange': {'name': 'binance', 'pair_whitelist': []}},
+                         validate=False)
+        self._trades_pagination_shards = shards
+        self.trades = trades
+        self.calls = []
+
+    async def _async_fetch_trades(self, pair, since=None, params=None):
+        self.calls.append((since, params))
+        if params:
+            from_id = int(params['fromId'])
+            trades = [t for t in self.trades if int(t[1]) >= from_id]
+        elif since is None:
+            trades = self.trades[-PAGE_SIZE:]
+        else:
+            trades = [t for t in self.trades if since <= t[0] < since + HOUR_MS]
+        return TradeBatch.from_list(trades[:PAGE_SIZE])
+
+
+def make_trades(ids, start=1600000000000, step=1000, gap_after=None, gap=0):
+    return [[start + i * step + (gap if gap_after is not None and i > gap_after else 0),
+             str(i), None, 'buy' if i % 2 else 'sell', 1.0 + i, 0.5, (1.0 + i) * 0.5]
+            for i in ids]
+
+
+def download(exchange, **kwargs):
+    async def _download():
+        return TradeBatch.concat([t async for t in exchange._async_iter_trade_history(
+            'ETH/BTC', **kwargs)])
+    return exchange.loop.run_until_complete(_download()).to_list()
+
+
+@pytest.mark.parametrize('shards', [1, 8])
+def test_iter_trade_history_id_listed_after_until(shards):
+    # Nothing stored yet: the download starts at id 1 with an until before the listing
+    trades = make_trades(range(1, 5001), start=1600000000000)
+    exchange = FakeBinance(trades, shards)
+
+    result = download(exchange, since=0, until=1534358028000.0, from_id=1)
+
+    # First page only, the next download resumes from there
+    assert result == trades[:PAGE_SIZE]
+    assert all(isinstance(since, int) for since, _ in exchange.calls if since is not None)
+
+
+@pytest.mark.parametrize('shards', [1, 8])
+def test_iter_trade_history_id_until(shards):
+    # Trade ids with holes, so fromId pages overlap the next shard's range
+    rng = np.random.default_rng(1)
+    ids = np.sort(rng.choice(np.arange(100, 30000), 12000, replace=False))
+    trades = make_trades(ids)
+    until = trades[9000][0]
+    exchange = FakeBinance(trades, shards)
+
+    result = download(exchange, since=0, until=until, from_id='500')
+
+    expected = [t for t in trades if int(t[1]) >= 500 and t[0] < until]
+    if shards == 1:
+        # The serial download stops after the first page ending after until
+        assert result[:len(expected)] == expected
+        assert result[len(expected)][0] >= until
+    else:
+        assert result == expected
+
+
+def test_iter_trade_history_id_sharded_until_before_gap():
+    # No trades in the hour after until - the end is searched by id
+    trades = make_trades(range(1, 20001), gap_after=15000, gap=6 * HOUR_MS)
+    until = trades[14999][0] + 500
+    exchange = FakeBinance(trades, 8)
+
+    result = download(exchange, since=0, until=until, from_id=1)
+
+    assert result == trades[:15000]